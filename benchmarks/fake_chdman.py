@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Stand-in for chdman used by the benchmarks. It mimics the command line, the progress output,
+# the timing and the exit codes of the real tool without doing any compression.
+#
+# Behaviour is configured through environment variables:
+#   FAKE_CHDMAN_SPEED    MB/s of input processed per second, 0 to finish instantly (default 200)
+#   FAKE_CHDMAN_RATIO    Size of a CHD compared to its input (default 0.45)
+#   FAKE_CHDMAN_FAIL     Inputs whose name contains this text fail with exit code 1
+#   FAKE_CHDMAN_VERSION  Version shown in the banner (default 0.262)
+import os
+import re
+import struct
+import sys
+import time
+from pathlib import Path
+
+SPEED = float(os.environ.get("FAKE_CHDMAN_SPEED", "200"))
+RATIO = float(os.environ.get("FAKE_CHDMAN_RATIO", "0.45"))
+FAIL = os.environ.get("FAKE_CHDMAN_FAIL")
+VERSION = os.environ.get("FAKE_CHDMAN_VERSION", "0.262")
+BANNER = f"chdman - MAME Compressed Hunks of Data (CHD) manager {VERSION} (fake)"
+USAGE = """Usage:
+   chdman info [--input|-i] <input.chd>
+   chdman verify [--input|-i] <input.chd>
+   chdman createcd [--output|-o] <output.chd> [--input|-i] <input.toc/cue/gdi/iso>
+   chdman extractcd [--output|-o] <output.cue/gdi> [--input|-i] <input.chd>
+   chdman extractraw [--output|-o] <output.raw> [--input|-i] <input.chd>"""
+CHD_HEADER_SIZE = 124
+SECTOR_SIZE = 2352
+
+
+def write_chd(path, logical_bytes, size):
+    """Write a CHD v5 header and a one track CHT2 metadata entry, padded up to size bytes (sparse where supported)."""
+    compressors = [int.from_bytes(codec, "big") for codec in (b"cdlz", b"cdzl", b"cdfl", b"\0\0\0\0")]
+    track = f"TRACK:1 TYPE:MODE1_RAW SUBTYPE:NONE FRAMES:{logical_bytes // 2448} PREGAP:0 PGTYPE:MODE1 PGSUB:RW POSTGAP:0".encode() + b"\0"
+    metadata = struct.pack(">4sIQ", b"CHT2", 0x01 << 24 | len(track), 0) + track
+    header = b"MComprHD" + struct.pack(">II4IQQQII", CHD_HEADER_SIZE, 5, *compressors, logical_bytes, CHD_HEADER_SIZE, CHD_HEADER_SIZE, 19584, 2448)
+    header += b"\0" * (CHD_HEADER_SIZE - len(header))
+    with open(path, "wb") as chd:
+        chd.write(header + metadata)
+        chd.truncate(max(size, CHD_HEADER_SIZE + len(metadata)))
+
+
+def chd_logical_bytes(path):
+    with open(path, "rb") as chd:
+        header = chd.read(CHD_HEADER_SIZE)
+    if header[:8] != b"MComprHD":
+        return Path(path).stat().st_size
+    return struct.unpack(">Q", header[32:40])[0]
+
+
+def input_bytes(path):
+    path = Path(path)
+    total = path.stat().st_size
+    if path.suffix.lower() in (".cue", ".gdi"):
+        for name in re.findall(r'"([^"]+)"|(\S+\.(?:bin|raw))', path.read_text(errors="replace"), re.IGNORECASE):
+            track = path.parent / (name[0] or name[1])
+            if track.is_file():
+                total += track.stat().st_size
+    return total
+
+
+def report_progress(verb, total_bytes):
+    duration = total_bytes / (SPEED * 1_000_000) if SPEED > 0 else 0
+    steps = 100 if duration > 0.5 else 10
+    for step in range(steps + 1):
+        sys.stderr.write(f"\r{verb}, {step * 100 / steps:.1f}% complete... (ratio={RATIO * 100:.1f}%)")
+        sys.stderr.flush()
+        if step < steps and duration:
+            time.sleep(duration / steps)
+
+
+def option(args, long_name, short_name):
+    for name in (long_name, short_name):
+        if name in args:
+            return args[args.index(name) + 1]
+    return None
+
+
+def main(args):
+    if not args:
+        print(BANNER)
+        print(USAGE)
+        return 1
+    command = args[0]
+    input_path, output_path = option(args, "--input", "-i"), option(args, "--output", "-o")
+    print(BANNER)
+    if input_path is None or not Path(input_path).exists():
+        print(f"Error opening input file ({input_path})", file=sys.stderr)
+        return 1
+    if FAIL and FAIL in Path(input_path).name:
+        print(f"Error: simulated failure for {input_path}", file=sys.stderr)
+        return 1
+    if output_path and Path(output_path).exists() and "--force" not in args and "-f" not in args:
+        print("Error: file already exists", file=sys.stderr)
+        return 1
+
+    if command == "createcd":
+        size = input_bytes(input_path)
+        report_progress("Compressing", size)
+        write_chd(output_path, size, int(size * RATIO))
+        sys.stderr.write(f"\rCompression complete ... final ratio = {RATIO * 100:.1f}%\n")
+    elif command in ("extractcd", "extractraw"):
+        size = chd_logical_bytes(input_path)
+        report_progress("Extracting", size)
+        output_path = Path(output_path)
+        if command == "extractraw":
+            with open(output_path, "wb") as raw:
+                raw.truncate(size)
+        else:
+            track = output_path.with_suffix(".bin")
+            with open(track, "wb") as raw:
+                raw.truncate(size - size % SECTOR_SIZE)
+            output_path.write_text(f'FILE "{track.name}" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n')
+        sys.stderr.write("\rExtraction complete\n")
+    elif command == "verify":
+        report_progress("Verifying", chd_logical_bytes(input_path))
+        sys.stderr.write("\rRaw SHA1 verification successful!\nOverall SHA1 verification successful!\n")
+    elif command == "info":
+        print(f"Input file:    {input_path}")
+        print("File Version:  5")
+        print(f"Logical size:  {chd_logical_bytes(input_path):,} bytes")
+    else:
+        print(f"Error: unknown command {command}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+# Benchmark harness: python benchmarks/run_benchmarks.py --output results.json
+# Builds a synthetic library, then times the directory scan, the file list, batch conversion
+# through the fake chdman and the batch scheduling overhead. Results are written as JSON so
+# runs before and after a change can be compared.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARK_DIRECTORY = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIRECTORY.parent / "src"))
+
+from archives import ArchiveScratch  # noqa: E402
+from constants import CHD, VALID_FORMATS  # noqa: E402
+from filelistmodel import FileListModel  # noqa: E402
+from scanindex import ScanIndex, INDEX_FILENAME  # noqa: E402
+from sheets import input_bytes  # noqa: E402
+from tools import FileConverter, BatchConverter, ConversionJob  # noqa: E402
+from synthetic_library import generate_library  # noqa: E402
+
+FAKE_CHDMAN = BENCHMARK_DIRECTORY / "fake_chdman.py"
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def rglob_scan(root):
+    """The directory walk the Multiple Files tab used before the scan index, kept as a baseline."""
+    return [p for p in Path(root).rglob("*") if p.is_file() and p.suffix.lower() in VALID_FORMATS]
+
+
+def bench_scan(root):
+    (Path(root) / INDEX_FILENAME).unlink(missing_ok=True)
+    rglob_seconds, baseline = timed(rglob_scan, root)
+    cold_seconds, _ = timed(ScanIndex(root).scan)
+    warm_seconds, scanned = timed(ScanIndex(root).scan)
+    return {
+        "files": len(scanned),
+        "rglob_files": len(baseline),
+        "rglob_seconds": rglob_seconds,
+        "index_cold_seconds": cold_seconds,
+        "index_warm_seconds": warm_seconds,
+    }, scanned
+
+
+def bench_file_list(scanned):
+    model_seconds, model = timed(FileListModel, ((f.path, f.size) for f in scanned))
+    results = {"rows": len(model), "model_build_seconds": model_seconds}
+    try:
+        import customtkinter
+        from virtualfilelist import VirtualFileList
+        root = customtkinter.CTk()
+    except Exception as e:  # no customtkinter or no display
+        results["render"] = {"skipped": f"{type(e).__name__}: {e}"}
+        return results
+
+    try:
+        view = VirtualFileList(root)
+        view.pack()
+        root.update()
+
+        def render():
+            view.set_model(model)
+            root.update_idletasks()
+
+        def scroll():
+            for _ in range(100):
+                view.scroll_rows(10)
+            root.update_idletasks()
+
+        results["render"] = {"draw_seconds": timed(render)[0], "scroll_100_pages_seconds": timed(scroll)[0]}
+    finally:
+        root.destroy()
+    return results
+
+
+def bench_batch(images, worker_counts, batch_discs, speed):
+    os.environ["FAKE_CHDMAN_SPEED"] = str(speed)
+    converter = FileConverter(chdman=str(FAKE_CHDMAN))
+    sources = [image for image in images if image.suffix != CHD][:batch_discs]
+    total_bytes = sum(input_bytes(source) for source in sources)
+    results = []
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory(prefix="easychd-bench-out-") as output_directory:
+            jobs = [ConversionJob(source, output_directory) for source in sources]
+            batch = BatchConverter(converter, workers=workers, cores=max(workers, os.cpu_count() or 1))
+            seconds, outcome = timed(batch.run_jobs, jobs)
+        results.append({
+            "workers": workers,
+            "jobs": len(jobs),
+            "failed": sum(not success for success, _, _ in outcome.values()),
+            "seconds": seconds,
+            "jobs_per_second": len(jobs) / seconds,
+            "input_mb_per_second": total_bytes / seconds / 1_000_000,
+        })
+    return results
+
+
+class InstantConverter:
+    """Converter that returns at once, isolating the cost of BatchConverter itself."""
+    def __init__(self):
+        self.archives = ArchiveScratch()  # BatchConverter prefetches ZIP inputs through it
+
+    def convert_file(self, input_file, output_directory, output_format=CHD, **kwargs):
+        return True, subprocess.CompletedProcess([], 0, b"", b"")
+
+
+def bench_scheduling(job_count, workers):
+    jobs = [ConversionJob(f"/nonexistent/{index}.cue") for index in range(job_count)]
+    seconds, _ = timed(BatchConverter(InstantConverter(), workers=workers, cores=workers).run_jobs, jobs)
+    return {"jobs": job_count, "workers": workers, "seconds": seconds, "microseconds_per_job": seconds / job_count * 1_000_000}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scanning, the file list and batch conversion against a fake chdman.")
+    parser.add_argument("--discs", type=int, default=2000, help="Disc images in the synthetic library (default: %(default)s).")
+    parser.add_argument("--track-mb", type=float, default=64, help="Size of each disc's data track in MB (default: %(default)s).")
+    parser.add_argument("--batch-discs", type=int, default=64, help="Discs converted per batch run (default: %(default)s).")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma separated worker counts to run batches with (default: %(default)s).")
+    parser.add_argument("--speed", type=float, default=2000, help="Fake chdman speed in MB/s, 0 for instant (default: %(default)s).")
+    parser.add_argument("--library", help="Build the library here and keep it, instead of in a temporary directory.")
+    parser.add_argument("--output", default="-", help="JSON results file, '-' for stdout (default).")
+    args = parser.parse_args(argv)
+
+    library = Path(args.library) if args.library else Path(tempfile.mkdtemp(prefix="easychd-bench-lib-"))
+    try:
+        generate_seconds, images = timed(generate_library, library, discs=args.discs, track_bytes=int(args.track_mb * 1_000_000))
+        scan_results, scanned = bench_scan(library)
+        worker_counts = [int(count) for count in args.workers.split(",")]
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "arguments": vars(args),
+            },
+            "library": {"discs": len(images), "generate_seconds": generate_seconds},
+            "scan": scan_results,
+            "file_list": bench_file_list(scanned),
+            "batch": bench_batch(images, worker_counts, args.batch_discs, args.speed),
+            "scheduling": bench_scheduling(5000, max(worker_counts)),
+        }
+    finally:
+        if not args.library:
+            shutil.rmtree(library, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        Path(args.output).write_text(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Generates directory trees of fake disc images for the benchmarks.
+# Track files are sparse, so libraries with thousands of multi-megabyte discs are cheap to create.
+import random
+from pathlib import Path
+from fake_chdman import write_chd
+
+SECTOR_SIZE = 2352
+DEFAULT_MIX = {".cue": 0.4, ".gdi": 0.15, ".iso": 0.25, ".chd": 0.2}
+
+
+def sparse_file(path, size):
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def write_cue_disc(directory, name, track_bytes):
+    track = directory / f"{name}.bin"
+    sparse_file(track, track_bytes - track_bytes % SECTOR_SIZE)
+    (directory / f"{name}.cue").write_text(f'FILE "{track.name}" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n')
+    return directory / f"{name}.cue"
+
+
+def write_gdi_disc(directory, name, track_bytes):
+    sizes = [SECTOR_SIZE * 300, SECTOR_SIZE * 75 * 4, track_bytes - track_bytes % SECTOR_SIZE]
+    lines = ["3"]
+    lba = 0
+    for number, size in enumerate(sizes, start=1):
+        track = directory / f"{name} track{number:02d}.{'raw' if number == 2 else 'bin'}"
+        sparse_file(track, size)
+        lines.append(f'{number} {lba} {0 if number == 2 else 4} {SECTOR_SIZE} "{track.name}" 0')
+        lba = 45000 if number == 2 else lba + size // SECTOR_SIZE
+    (directory / f"{name}.gdi").write_text("\n".join(lines) + "\n")
+    return directory / f"{name}.gdi"
+
+
+def write_iso_disc(directory, name, track_bytes):
+    sparse_file(directory / f"{name}.iso", track_bytes - track_bytes % 2048)
+    return directory / f"{name}.iso"
+
+
+def write_chd_disc(directory, name, track_bytes):
+    write_chd(directory / f"{name}.chd", track_bytes, int(track_bytes * 0.45))
+    return directory / f"{name}.chd"
+
+
+WRITERS = {".cue": write_cue_disc, ".gdi": write_gdi_disc, ".iso": write_iso_disc, ".chd": write_chd_disc}
+
+
+def generate_library(root, discs=1000, discs_per_directory=50, track_bytes=8 * 1024 * 1024, mix=DEFAULT_MIX, junk_per_directory=5, seed=0):
+    """Create discs disc images below root, spread over nested directories.
+
+    mix: Share of each format among the discs.
+    junk_per_directory: Unrelated files per directory that a scan has to look at and skip.
+    Returns the list of disc image paths, the sheet file for CUE and GDI discs.
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    formats, weights = zip(*mix.items())
+    images = []
+    for index in range(discs):
+        directory = root / f"set{index // (discs_per_directory * 10):03d}" / f"dir{index // discs_per_directory:05d}"
+        if not directory.exists():
+            directory.mkdir(parents=True)
+            for junk in range(junk_per_directory):
+                (directory / f"readme{junk}.txt").write_text("not a disc image\n")
+        disc_format = rng.choices(formats, weights)[0]
+        images.append(WRITERS[disc_format](directory, f"Game {index:06d}", track_bytes))
+    return images
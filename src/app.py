@@ -1,8 +1,10 @@
 import customtkinter
+import threading
 from multiplefilesframe import MultipleFilesFrame
 from singlefileframe import SingleFileFrame
 from tools import FileConverter
 from exceptions import ChdmanNotInstalledError
+from uiqueue import UIUpdateQueue
 
 # Theme settings
 customtkinter.set_appearance_mode("System")
@@ -20,11 +22,10 @@ class App(customtkinter.CTk):
     def __init__(self):
         super().__init__()
         self.title(APP_TITLE)
-        try:
-            file_converter = FileConverter()
-        except ChdmanNotInstalledError as e:
-            file_converter = None
-            
+        # Single queue through which every worker thread updates the widgets of both tabs
+        self.ui_queue = UIUpdateQueue(self)
+        # chdman is probed in the background so the window opens right away
+        threading.Thread(target=self.load_converter, daemon=True).start()
 
         # Font settings
         self.title_font = customtkinter.CTkFont(size=30, weight="bold", slant="italic")
@@ -50,13 +51,24 @@ class App(customtkinter.CTk):
             expand=True
         )
         self.sf_tab = self.tabview.add(SF_TAB)
-        self.sf_view = SingleFileFrame(self.sf_tab, file_converter)
+        self.sf_view = SingleFileFrame(self.sf_tab, None, ui_queue=self.ui_queue)
         self.sf_view.pack()
         self.mf_tab = self.tabview.add(MF_TAB)
-        self.mf_view = MultipleFilesFrame(self.mf_tab, file_converter)
+        self.mf_view = MultipleFilesFrame(self.mf_tab, None, ui_queue=self.ui_queue)
         self.mf_view.pack()
         self.tabview.set(SF_TAB)
 
+    def load_converter(self):
+        try:
+            file_converter = FileConverter()
+        except ChdmanNotInstalledError:
+            file_converter = None
+        self.ui_queue.call(self.install_converter, file_converter)
+
+    def install_converter(self, file_converter):
+        """Hand the converter to both frames once the background probe is done."""
+        self.sf_view.set_converter(file_converter)
+        self.mf_view.set_converter(file_converter)
 
 
 if __name__ == "__main__":
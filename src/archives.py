@@ -0,0 +1,152 @@
+# Extracts the disc image of ZIP archives into scratch directories, one archive ahead of the conversions
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from constants import STAGING_PREFIX
+from exceptions import ConversionCancelledError
+from sheets import preflight
+
+EXTRACT_CHUNK_BYTES = 1024 * 1024
+# Largest archive extracted ahead of time; bigger ones are extracted when their job starts
+DEFAULT_PREFETCH_BYTES = 8 * 1024 ** 3
+
+
+def extract_archive(archive_image, directory, cancel_event=None):
+    """Stream the members of an ArchiveImage into directory and return the path of the extracted image.
+
+    Members are decompressed chunk by chunk, so memory use does not depend on their size, and
+    cancel_event is checked between chunks. Raises ConversionCancelledError once it is set.
+    """
+    image = directory / archive_image.image
+    # chdman and the converter only know lower case extensions
+    image = image.with_suffix(image.suffix.lower())
+    with zipfile.ZipFile(archive_image.archive) as zip_file:
+        for name in archive_image.members:
+            target = image if name == archive_image.image else directory / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with zip_file.open(name) as source, open(target, "wb") as destination:
+                while chunk := source.read(EXTRACT_CHUNK_BYTES):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ConversionCancelledError()
+                    destination.write(chunk)
+    return image
+
+
+class ArchiveExtraction:
+    """One archive being extracted on a thread of its own into a private scratch directory."""
+    def __init__(self, archive, output_directory):
+        self.archive = archive
+        Path(output_directory).mkdir(parents=True, exist_ok=True)
+        self.directory = Path(tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{os.getpid()}-", dir=output_directory))
+        self.image = None  # Path of the extracted disc image once done
+        self.error = None
+        self.claimed = False
+        self.done = threading.Event()
+        self.cancel_event = threading.Event()
+        self.thread = threading.Thread(target=self.__extract, daemon=True)
+
+    def __extract(self):
+        try:
+            check = preflight(self.archive)
+            if not check.ok:
+                raise check.error
+            self.image = extract_archive(check.archive_image, self.directory, self.cancel_event)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self):
+        """Block until extracted and return the image path, raising what the extraction failed with."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.image
+
+    def remove(self):
+        self.cancel_event.set()
+        self.done.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class ArchiveScratch:
+    """Scratch directories of the archives being converted, plus at most one extracted ahead of time.
+
+    Scratch directories are created next to the outputs, on the disk the outputs need room on anyway,
+    with the staging prefix so that remove_orphaned_staging() cleans up after a crash.
+    prefetch_bytes: Largest archive, once extracted, that prefetch() takes on.
+    """
+    def __init__(self, prefetch_bytes=DEFAULT_PREFETCH_BYTES):
+        self.prefetch_bytes = prefetch_bytes
+        self.extractions = {}
+        self.deferred = None  # (archive, output_directory, reserve) to prefetch once the waiting one is claimed
+        self.lock = threading.Lock()
+
+    def prefetch(self, archive, output_directory, reserve=None):
+        """Start extracting archive in the background.
+
+        While another prefetched archive waits to be converted, archive is only remembered and extracted
+        as soon as that one is claimed. reserve(size) is called with the extracted size before anything is
+        written, and nothing is when it returns False, e.g. because the disk is short of space.
+        Returns True when an extraction was started.
+        """
+        archive = Path(archive)
+        with self.lock:
+            if archive in self.extractions:
+                return False
+            if any(not extraction.claimed for extraction in self.extractions.values()):
+                self.deferred = (archive, output_directory, reserve)
+                return False
+            return self.__start_prefetch(archive, output_directory, reserve)
+
+    def __start_prefetch(self, archive, output_directory, reserve):
+        check = preflight(archive)
+        if not check.ok or check.total_bytes > self.prefetch_bytes:
+            return False
+        if reserve is not None and not reserve(check.total_bytes):
+            return False
+        try:
+            extraction = ArchiveExtraction(archive, output_directory)
+        except OSError:
+            return False  # Left to the job, which reports the error as its own
+        self.extractions[archive] = extraction
+        extraction.thread.start()
+        return True
+
+    def claim(self, archive, output_directory):
+        """The ArchiveExtraction of archive, started now unless prefetch() already did. Release it once converted."""
+        archive = Path(archive)
+        with self.lock:
+            extraction = self.extractions.get(archive)
+            if extraction is None or extraction.claimed:
+                extraction = ArchiveExtraction(archive, output_directory)
+                extraction.thread.start()
+                # A second claim of the same archive keeps its own extraction, not tracked here
+                if archive not in self.extractions:
+                    self.extractions[archive] = extraction
+            extraction.claimed = True
+            waiting = any(not other.claimed for other in self.extractions.values())
+            if self.deferred is not None and self.deferred[0] not in self.extractions and not waiting:
+                self.__start_prefetch(*self.deferred)
+            self.deferred = None
+        return extraction
+
+    def release(self, extraction):
+        """Delete the scratch directory of extraction, stopping it if still running."""
+        with self.lock:
+            if self.extractions.get(extraction.archive) is extraction:
+                del self.extractions[extraction.archive]
+        extraction.remove()
+
+    def clear(self):
+        """Drop the extractions nobody claimed, e.g. of jobs a cancelled batch never started."""
+        with self.lock:
+            unclaimed = [extraction for extraction in self.extractions.values() if not extraction.claimed]
+            for extraction in unclaimed:
+                del self.extractions[extraction.archive]
+            self.deferred = None
+        for extraction in unclaimed:
+            extraction.remove()
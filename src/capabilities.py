@@ -0,0 +1,88 @@
+# Probe of what the installed chdman can do, cached on disk so startup does not have to spawn it
+import json
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from constants import CACHE_DIRECTORY
+from exceptions import ChdmanNotInstalledError
+
+CAPABILITIES_CACHE_PATH = CACHE_DIRECTORY / "chdman-capabilities.json"
+CHDMAN_OUTPUT_VERIFICATION = "chdman - MAME Compressed Hunks of Data (CHD) manager"
+VERSION_PATTERN = re.compile(r"manager\s+(\d+)\.(\d+)")
+COMMAND_PATTERN = re.compile(r"^\s+chdman\s+(\w+)", re.MULTILINE)
+# chdman does not list its codecs, they are known from the MAME release that added them
+BASE_CODECS = ["zlib", "lzma", "huff", "flac", "cdzl", "cdlz", "cdfl"]
+ZSTD_CODECS = ["zstd", "cdzs"]
+ZSTD_MINIMUM_VERSION = (0, 256)
+
+
+class ChdmanCapabilities:
+    def __init__(self, path, version, commands, codecs):
+        self.path = path
+        self.version = version
+        self.commands = commands
+        self.codecs = codecs
+
+    @property
+    def version_tuple(self):
+        return tuple(int(part) for part in self.version.split(".")) if self.version else (0, 0)
+
+    def supports(self, command):
+        return command in self.commands
+
+    def to_dict(self):
+        return {"path": self.path, "version": self.version, "commands": self.commands, "codecs": self.codecs}
+
+
+def binary_key(path):
+    stat = Path(path).stat()
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def probe_chdman(binary="chdman", cache_path=CAPABILITIES_CACHE_PATH):
+    """Return the capabilities of the chdman found on PATH (or at binary).
+
+    The result is cached keyed by the resolved binary path, size and mtime, so chdman is only
+    spawned again after it was replaced or upgraded.
+    Raises ChdmanNotInstalledError when chdman cannot be found or does not look like chdman.
+    """
+    path = shutil.which(binary)
+    if path is None:
+        raise ChdmanNotInstalledError()
+    key = binary_key(path)
+
+    try:
+        with open(cache_path) as cache:
+            cached = json.load(cache)
+        if cached.get("key") == key:
+            return ChdmanCapabilities(**cached["capabilities"])
+    except (OSError, ValueError, TypeError, KeyError):
+        pass
+
+    capabilities = run_probe(path)
+    try:
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w") as cache:
+            json.dump({"key": key, "capabilities": capabilities.to_dict()}, cache, indent=1)
+    except OSError:
+        pass  # a read only home directory only costs a spawn on the next start
+    return capabilities
+
+
+def run_probe(path):
+    try:
+        # chdman prints its banner and usage and exits with an error when run with no command
+        output = subprocess.run([path], capture_output=True, text=True, errors="replace").stdout
+    except OSError:
+        raise ChdmanNotInstalledError()
+    if CHDMAN_OUTPUT_VERIFICATION not in output:
+        raise ChdmanNotInstalledError()
+
+    match = VERSION_PATTERN.search(output)
+    version = f"{match.group(1)}.{match.group(2)}" if match else None
+    commands = sorted(set(COMMAND_PATTERN.findall(output)))
+    codecs = list(BASE_CODECS)
+    if match and (int(match.group(1)), int(match.group(2))) >= ZSTD_MINIMUM_VERSION:
+        codecs += ZSTD_CODECS
+    return ChdmanCapabilities(path, version, commands, codecs)
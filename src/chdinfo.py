@@ -0,0 +1,197 @@
+# Reads the header and metadata of CHD v5 files without spawning chdman
+import mmap
+import re
+import struct
+from pathlib import Path
+from exceptions import ChdFormatError, UnsupportedChdVersionError
+from constants import CUE, GDI, ISO
+
+CHD_MAGIC = b"MComprHD"
+CHD_V5_HEADER = struct.Struct(">8sII4IQQQII20s20s20s")  # 124 bytes, every field big endian
+METADATA_ENTRY_HEADER = struct.Struct(">IIQ")  # tag, flags << 24 | length, next
+MAX_METADATA_ENTRIES = 4096
+NO_SHA1 = bytes(20)
+
+# Metadata tags that tell which kind of disc or drive a CHD holds
+CDROM_TRACK_TAGS = (b"CHTR", b"CHT2")
+GDROM_TRACK_TAGS = (b"CHGT", b"CHGD")
+DVD_TAG = b"DVD "
+HARD_DISK_TAG = b"GDDD"
+MEDIA_CD = "CD"
+MEDIA_GDROM = "GD-ROM"
+MEDIA_DVD = "DVD"
+MEDIA_HARD_DISK = "Hard disk"
+# Format a CHD was most likely created from, by media
+ORIGINAL_FORMATS = {
+    MEDIA_CD: CUE,
+    MEDIA_GDROM: GDI,
+    MEDIA_DVD: ISO,
+}
+TRACK_FIELD_PATTERN = re.compile(rb"([A-Z]+):(\S+)")
+
+
+class ChdTrack:
+    """One track record of a CHT2/CHGD metadata entry."""
+    def __init__(self, number, track_type, subtype, frames, pregap=0, postgap=0):
+        self.number = number
+        self.track_type = track_type  # e.g. MODE1_RAW, MODE2_RAW or AUDIO
+        self.subtype = subtype
+        self.frames = frames
+        self.pregap = pregap
+        self.postgap = postgap
+
+    @property
+    def is_audio(self):
+        return self.track_type == "AUDIO"
+
+
+class ChdInfo:
+    def __init__(self, path, file_bytes, version, compressors, logical_bytes, map_offset, meta_offset,
+                 hunk_bytes, unit_bytes, raw_sha1, sha1, parent_sha1, media, tracks):
+        self.path = path
+        self.file_bytes = file_bytes
+        self.version = version
+        self.compressors = compressors  # codec tags such as "cdlz", in the order chdman tries them
+        self.logical_bytes = logical_bytes
+        self.map_offset = map_offset
+        self.meta_offset = meta_offset
+        self.hunk_bytes = hunk_bytes
+        self.unit_bytes = unit_bytes
+        self.raw_sha1 = raw_sha1
+        self.sha1 = sha1
+        self.parent_sha1 = parent_sha1  # None unless the CHD is a diff against a parent
+        self.media = media
+        self.tracks = tracks
+
+    @property
+    def compression_ratio(self):
+        return self.file_bytes / self.logical_bytes if self.logical_bytes else None
+
+    @property
+    def original_format(self):
+        return ORIGINAL_FORMATS.get(self.media)
+
+    def to_dict(self):
+        return {
+            "path": str(self.path),
+            "version": self.version,
+            "media": self.media,
+            "original_format": self.original_format,
+            "compressors": self.compressors,
+            "logical_bytes": self.logical_bytes,
+            "file_bytes": self.file_bytes,
+            "compression_ratio": self.compression_ratio,
+            "hunk_bytes": self.hunk_bytes,
+            "unit_bytes": self.unit_bytes,
+            "sha1": self.sha1,
+            "raw_sha1": self.raw_sha1,
+            "parent_sha1": self.parent_sha1,
+            "tracks": [
+                {"number": track.number, "type": track.track_type, "subtype": track.subtype, "frames": track.frames}
+                for track in self.tracks
+            ],
+        }
+
+    def summary(self):
+        """Short description for the file list, e.g. "CD, 3 tracks, 46% of 680.2 MB"."""
+        parts = [self.media or "Unknown media"]
+        if self.tracks:
+            parts.append(f"{len(self.tracks)} track{'s' if len(self.tracks) != 1 else ''}")
+        if self.compression_ratio is not None:
+            parts.append(f"{self.compression_ratio * 100:.0f}% of {self.logical_bytes / 1e6:.1f} MB")
+        return ", ".join(parts)
+
+
+def read_chd_info(path):
+    """Read the v5 header and metadata chain of a CHD.
+
+    The file is memory mapped and only the header and metadata entries are touched, a few kilobytes
+    whatever the size of the CHD. Raises ChdFormatError for anything that is not a CHD, and its subclass
+    UnsupportedChdVersionError for CHDs older than version 5, which chdman still reads.
+    """
+    path = Path(path)
+    with open(path, "rb") as chd_file:
+        file_bytes = chd_file.seek(0, 2)
+        if file_bytes < CHD_V5_HEADER.size:
+            raise ChdFormatError(f"{path.name}: too small to be a CHD")
+        with mmap.mmap(chd_file.fileno(), 0, access=mmap.ACCESS_READ) as chd:
+            if chd[:8] != CHD_MAGIC:
+                raise ChdFormatError(f"{path.name}: not a CHD")
+            version = struct.unpack_from(">I", chd, 12)[0]
+            if version != 5:
+                raise UnsupportedChdVersionError(f"{path.name}: CHD version {version} can not be read, only version 5")
+
+            (_, header_bytes, _, c0, c1, c2, c3, logical_bytes, map_offset, meta_offset,
+             hunk_bytes, unit_bytes, raw_sha1, sha1, parent_sha1) = CHD_V5_HEADER.unpack_from(chd, 0)
+            if header_bytes < CHD_V5_HEADER.size or map_offset > file_bytes or meta_offset > file_bytes:
+                raise ChdFormatError(f"{path.name}: corrupt header")
+            media, tracks = read_metadata(chd, meta_offset, path.name)
+
+    return ChdInfo(
+        path=path,
+        file_bytes=file_bytes,
+        version=version,
+        compressors=[codec_name(codec) for codec in (c0, c1, c2, c3) if codec],
+        logical_bytes=logical_bytes,
+        map_offset=map_offset,
+        meta_offset=meta_offset,
+        hunk_bytes=hunk_bytes,
+        unit_bytes=unit_bytes,
+        raw_sha1=raw_sha1.hex(),
+        sha1=sha1.hex(),
+        parent_sha1=parent_sha1.hex() if parent_sha1 != NO_SHA1 else None,
+        media=media,
+        tracks=tracks,
+    )
+
+
+def codec_name(codec):
+    return codec.to_bytes(4, "big").decode("ascii", errors="replace").strip()
+
+
+def read_metadata(chd, offset, name):
+    """Walk the metadata chain starting at offset and return (media, tracks)."""
+    media = None
+    tracks = []
+    visited = set()
+    while offset:
+        if offset in visited or len(visited) >= MAX_METADATA_ENTRIES or offset + METADATA_ENTRY_HEADER.size > len(chd):
+            raise ChdFormatError(f"{name}: corrupt metadata chain")
+        visited.add(offset)
+        tag, flags_and_length, next_offset = METADATA_ENTRY_HEADER.unpack_from(chd, offset)
+        tag = tag.to_bytes(4, "big")
+        length = flags_and_length & 0xFFFFFF
+        data_start = offset + METADATA_ENTRY_HEADER.size
+        data = chd[data_start:data_start + length]
+
+        if tag in CDROM_TRACK_TAGS or tag in GDROM_TRACK_TAGS:
+            media = MEDIA_GDROM if tag in GDROM_TRACK_TAGS else MEDIA_CD
+            tracks.append(parse_track(data))
+        elif tag == DVD_TAG:
+            media = MEDIA_DVD
+        elif tag == HARD_DISK_TAG and media is None:
+            media = MEDIA_HARD_DISK
+        offset = next_offset
+
+    tracks.sort(key=lambda track: track.number)
+    return media, tracks
+
+
+def parse_track(data):
+    """Parse the "TRACK:1 TYPE:MODE1_RAW SUBTYPE:NONE FRAMES:1234 ..." text of a track record."""
+    fields = {key.decode(): value.decode(errors="replace") for key, value in TRACK_FIELD_PATTERN.findall(data.rstrip(b"\0"))}
+
+    def number(key):
+        try:
+            return int(fields.get(key, 0))
+        except ValueError:
+            return 0
+
+    return ChdTrack(
+        number=number("TRACK"),
+        track_type=fields.get("TYPE"),
+        subtype=fields.get("SUBTYPE"),
+        frames=number("FRAMES"),
+        pregap=number("PREGAP"),
+        postgap=number("POSTGAP"),
+    )
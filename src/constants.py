@@ -1,5 +1,22 @@
+from pathlib import Path
+
 CHD = ".chd"
 CUE = ".cue"
 GDI = ".gdi"
 ISO = ".iso"
-VALID_FORMATS = [CHD, CUE, GDI, ISO]
\ No newline at end of file
+ZIP = ".zip"
+VALID_FORMATS = [CHD, CUE, GDI, ISO]
+# Formats that can be converted from but not to, the disc image inside an archive is converted
+INPUT_FORMATS = VALID_FORMATS + [ZIP]
+
+# Prefix of the private directories conversions and archive extractions write into
+STAGING_PREFIX = ".easychd-tmp-"
+
+# Per-user location for indexes, journals and caches that do not belong next to a library
+CACHE_DIRECTORY = Path.home() / ".cache" / "easychd"
+
+# Job states recorded in the batch journal
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
\ No newline at end of file
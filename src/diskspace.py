@@ -0,0 +1,78 @@
+# Estimates how much room a conversion needs on its output disk and checks that the disk has it
+import shutil
+from pathlib import Path
+from constants import CHD, ZIP
+from sheets import preflight
+
+# CHD size over uncompressed size assumed until a batch has created CHDs of its own; a bit
+# pessimistic, discs with many audio tracks compress worse than data discs
+DEFAULT_CHD_RATIO = 0.75
+ESTIMATE_MARGIN = 1.15  # Guard against discs compressing worse than those seen so far
+RESERVED_FREE_BYTES = 256 * 1024 * 1024  # Never fill a disk to the last byte
+
+
+def existing_parent(path):
+    """path, or its closest parent that exists."""
+    path = Path(path).absolute()
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def free_bytes(path):
+    """Free bytes on the disk holding path, which may not exist yet."""
+    return shutil.disk_usage(existing_parent(path)).free
+
+
+def uncompressed_bytes(input_file):
+    """Size of the disc image input_file holds once extracted, 0 when it can not be read."""
+    try:
+        check = preflight(input_file)
+    except OSError:
+        return 0
+    return check.chd_info.logical_bytes if check.chd_info is not None else check.total_bytes
+
+
+class SpaceEstimator:
+    """Predicts the peak bytes a job writes to its output disk, learning from the CHDs a batch creates.
+
+    A conversion writes everything into a staging directory next to its output, so the intermediary
+    CHD of a two-step conversion and the final output are on the output disk together at the end.
+    """
+    def __init__(self):
+        self.chd_bytes = 0
+        self.chd_source_bytes = 0
+        self.uncompressed = {}
+
+    @property
+    def chd_ratio(self):
+        if not self.chd_source_bytes:
+            return DEFAULT_CHD_RATIO
+        # Only tiny images, where the CHD header and map dominate, come out bigger than their source
+        return min(1.0, self.chd_bytes / self.chd_source_bytes)
+
+    def observe(self, metrics):
+        """Update the CHD ratio from the ConversionMetrics of a successful conversion."""
+        if metrics.intermediary_bytes:
+            self.chd_bytes += metrics.intermediary_bytes
+            self.chd_source_bytes += metrics.source_bytes
+        elif metrics.output_format == CHD and metrics.output_bytes:
+            self.chd_bytes += metrics.output_bytes
+            self.chd_source_bytes += metrics.source_bytes
+
+    def estimate(self, job):
+        """Peak bytes job is expected to write to the disk of its output directory."""
+        if job.input_file not in self.uncompressed:
+            self.uncompressed[job.input_file] = uncompressed_bytes(job.input_file)
+        size = self.uncompressed[job.input_file]
+        if job.output_format == CHD:
+            peak = size * self.chd_ratio
+        elif job.input_file.suffix == CHD:
+            peak = size
+        else:
+            # Intermediary CHD plus the extracted output
+            peak = size * self.chd_ratio + size
+        if job.input_file.suffix == ZIP:
+            # The image is extracted next to the output first
+            peak += size
+        return int(peak * ESTIMATE_MARGIN)
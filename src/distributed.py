@@ -0,0 +1,445 @@
+# Spreads a batch over several machines: a coordinator hands out jobs, workers pull and convert them
+import hmac
+import ipaddress
+import json
+import queue
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+import uuid
+import exceptions
+from collections import deque
+from constants import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, CHD, ZIP
+from exceptions import RemoteJobError, ConversionCancelledError
+from profiles import AUTO_PROFILE
+from scheduler import job_bytes
+from syncmanifest import SyncManifest
+from tools import ConversionJob, ConversionProgress, CancelToken
+
+DEFAULT_PORT = 5735
+DEFAULT_LEASE_SECONDS = 60
+POLL_SECONDS = 1.0
+PROGRESS_REPORT_SECONDS = 2.0
+# Exceptions a worker may report that keep their type on the coordinator, anything else becomes a RemoteJobError
+REMOTE_ERRORS = {
+    name: getattr(exceptions, name) for name in (
+        "FileFormatNotSupportedError",
+        "SameFileExtensionError",
+        "OutputFileAlreadyExists",
+        "SheetParseError",
+        "MissingTrackFileError",
+        "ChdFormatError",
+        "ArchiveError",
+        "ConversionTimeoutError",
+    )
+}
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    """Split "host:port", ":port" or "port" into a (host, port) tuple."""
+    host, _, port = str(address).rpartition(":")
+    return host or default_host, int(port) if port else DEFAULT_PORT
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def send_request(address, message, timeout=30):
+    """Send one JSON message to the coordinator and return its JSON reply."""
+    with socket.create_connection(address, timeout=timeout) as connection:
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        reply = connection.makefile("rb").readline()
+    if not reply:
+        raise ConnectionError("coordinator closed the connection")
+    return json.loads(reply)
+
+
+class Lease:
+    def __init__(self, lease_id, job_id, worker, expires):
+        self.lease_id = lease_id
+        self.job_id = job_id
+        self.worker = worker
+        self.expires = expires
+
+
+class CoordinatorRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            reply = self.server.coordinator.handle_message(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"error": f"bad request: {e}"}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, coordinator):
+        self.coordinator = coordinator
+        super().__init__(address, CoordinatorRequestHandler)
+
+
+class Coordinator:
+    """Serves the jobs of a batch to Worker processes over TCP, one JSON line per request and reply.
+
+    Workers lease one job at a time and must heartbeat before the lease runs out, a job whose lease
+    expires is queued again for the next worker that asks. Only a result reported under the job's
+    current lease counts. Paths are sent as they are, so every worker must see the sources and output directories
+    under the same paths as the coordinator.
+
+    run_jobs takes the same callbacks as BatchConverter.run_jobs, so either can drive a batch.
+    """
+    def __init__(self, address=("127.0.0.1", DEFAULT_PORT), lease_seconds=DEFAULT_LEASE_SECONDS, token=None,
+                 sync=False, sync_hash=False, journal=None, profile=None, local_workers=0, converter=None, timeout=None,
+                 min_mb_per_second=None, num_processors=None):
+        """address: (host, port) to listen on, port 0 picks a free port.
+        token: Shared secret every worker request must carry, None to accept any request. Required unless
+            address is a loopback address, so that nobody else on the network can take or finish jobs.
+        local_workers: Number of Worker threads to run in this process with converter, next to the remote ones.
+        num_processors: Cores each local worker's chdman may use, chdman's default when None.
+        sync, sync_hash, journal, profile: As for BatchConverter.
+        timeout, min_mb_per_second: As for BatchConverter, sent to the workers along with every job.
+        """
+        if token is None and not is_loopback(address[0]):
+            raise ValueError(f"a token is required to listen on {address[0]}")
+        self.address = address
+        self.lease_seconds = lease_seconds
+        self.token = token
+        self.sync = sync or sync_hash
+        self.sync_hash = sync_hash
+        self.journal = journal
+        self.profile = profile
+        self.local_workers = local_workers
+        self.converter = converter
+        self.timeout = timeout
+        self.min_mb_per_second = min_mb_per_second
+        self.num_processors = num_processors
+        self.lock = threading.Lock()
+        self.server = None
+        self.cancel_token = CancelToken()
+        self.__reset([])
+
+    def __reset(self, jobs):
+        self.jobs = list(jobs)
+        # Largest first, so the batch does not end waiting on one big disc
+        self.pending = deque(sorted(range(len(self.jobs)), key=lambda job_id: job_bytes(self.jobs[job_id]), reverse=True))
+        self.leases = {}
+        self.finished = set()
+        self.events = queue.Queue()
+
+    def cancel(self):
+        """Stop serving, stop the local workers and fail every unfinished job with ConversionCancelledError."""
+        self.cancel_token.cancel()
+        self.events.put(("cancel", None, None))
+
+    @property
+    def server_address(self):
+        """Address the coordinator listens on while run_jobs is running."""
+        return self.server.server_address if self.server is not None else self.address
+
+    def handle_message(self, message):
+        if self.token is not None and not hmac.compare_digest(str(message.get("token", "")), self.token):
+            return {"error": "unauthorized"}
+        handlers = {
+            "lease": self.__lease,
+            "heartbeat": self.__heartbeat,
+            "result": self.__result,
+        }
+        if message["op"] not in handlers:
+            return {"error": f"unknown op {message['op']}"}
+        with self.lock:
+            return handlers[message["op"]](message)
+
+    def __lease(self, message):
+        self.__requeue_expired()
+        if not self.pending:
+            return {"job": None, "finished": len(self.finished) == len(self.jobs)}
+        job_id = self.pending.popleft()
+        lease = Lease(uuid.uuid4().hex, job_id, message.get("worker", "?"), time.monotonic() + self.lease_seconds)
+        self.leases[lease.lease_id] = lease
+        job = self.jobs[job_id]
+        if self.journal is not None:
+            self.journal.mark(job, JOB_RUNNING)
+        return {
+            "job": {
+                "input": str(job.input_file),
+                "output_directory": str(job.output_directory),
+                "output_format": job.output_format,
+                "profile": self.profile if isinstance(self.profile, str) or self.profile is None else self.profile.name,
+                "overwrite": self.sync,
+                "timeout": self.timeout,
+                "min_mb_per_second": self.min_mb_per_second,
+            },
+            "job_id": job_id,
+            "lease": lease.lease_id,
+            "lease_seconds": self.lease_seconds,
+        }
+
+    def __heartbeat(self, message):
+        lease = self.leases.get(message["lease"])
+        if lease is None:
+            return {"ok": False}
+        lease.expires = time.monotonic() + self.lease_seconds
+        progress = message.get("progress")
+        if progress is not None:
+            self.events.put(("progress", lease.job_id, ConversionProgress(
+                progress["stage"], progress["percent"], progress["mb_per_second"], progress["eta_seconds"]
+            )))
+        return {"ok": True}
+
+    def __result(self, message):
+        # A result for an expired or unknown lease is dropped, the job has been queued again
+        lease = self.leases.pop(message["lease"], None)
+        if lease is None or lease.job_id in self.finished:
+            return {"ok": True, "accepted": False}
+        job_id = lease.job_id
+
+        self.finished.add(job_id)
+        if job_id in self.pending:
+            self.pending.remove(job_id)
+        for other in [other for other in self.leases.values() if other.job_id == job_id]:
+            del self.leases[other.lease_id]
+
+        completed_process = None
+        if message.get("returncode") is not None:
+            completed_process = subprocess.CompletedProcess(
+                message.get("args", []), message["returncode"], b"", message.get("stderr", "").encode()
+            )
+        error = None
+        if message.get("error") is not None:
+            error = REMOTE_ERRORS.get(message["error"], RemoteJobError)(message.get("message") or message["error"])
+        self.events.put(("done", job_id, (bool(message["success"]), completed_process, error)))
+        return {"ok": True, "accepted": True}
+
+    def __requeue_expired(self):
+        now = time.monotonic()
+        for lease in [lease for lease in self.leases.values() if lease.expires < now]:
+            del self.leases[lease.lease_id]
+            self.pending.appendleft(lease.job_id)
+            if self.journal is not None:
+                self.journal.mark(self.jobs[lease.job_id], JOB_QUEUED)
+
+    def run_jobs(self, jobs, on_job_done=None, on_progress=None, on_job_skipped=None):
+        """Serve jobs until every one of them has a result and return {job: (success, completed_process, error)}."""
+        results = {}
+        manifests = {}
+        if self.sync:
+            pending_jobs = []
+            for job in jobs:
+                if job.output_directory not in manifests:
+                    manifests[job.output_directory] = SyncManifest(job.output_directory)
+                if manifests[job.output_directory].is_up_to_date(job, use_hash=self.sync_hash):
+                    results[job] = (True, None, None)
+                    if on_job_skipped is not None:
+                        on_job_skipped(job)
+                else:
+                    pending_jobs.append(job)
+            jobs = pending_jobs
+
+        with self.lock:
+            self.__reset(jobs)
+        if self.journal is not None:
+            self.journal.start_batch(jobs)
+
+        self.server = CoordinatorServer(self.address, self)
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        worker_threads = [
+            threading.Thread(
+                target=Worker(self.converter, self.server_address, name=f"local-{n}", token=self.token, num_processors=self.num_processors,
+                              cancel_token=self.cancel_token).run,
+                daemon=True
+            )
+            for n in range(self.local_workers)
+        ]
+        for worker_thread in worker_threads:
+            worker_thread.start()
+
+        jobs_done = 0
+        try:
+            while jobs_done < len(jobs):
+                try:
+                    kind, job_id, payload = self.events.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    with self.lock:
+                        self.__requeue_expired()
+                    continue
+
+                if kind == "cancel":
+                    with self.lock:
+                        cancelled = [job_id for job_id in range(len(self.jobs)) if job_id not in self.finished]
+                        self.finished.update(cancelled)
+                        self.pending.clear()
+                        self.leases.clear()
+                    for job_id in cancelled:
+                        self.events.put(("done", job_id, (False, None, ConversionCancelledError())))
+                    continue
+
+                job = self.jobs[job_id]
+                if kind == "progress":
+                    if on_progress is not None and job not in results:
+                        on_progress(job, payload)
+                    continue
+
+                success, completed_process, error = payload
+                results[job] = payload
+                jobs_done += 1
+                if self.sync and success:
+                    manifests[job.output_directory].record(job, use_hash=self.sync_hash)
+                if self.journal is not None:
+                    self.journal.mark(job, JOB_DONE if success else JOB_FAILED)
+                if on_job_done is not None:
+                    on_job_done(job, success, completed_process, error)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            for worker_thread in worker_threads:
+                worker_thread.join()
+
+        if self.journal is not None:
+            self.journal.finish_batch()
+        return results
+
+
+class Worker:
+    """Pulls jobs from a Coordinator and runs them through a FileConverter until the batch is finished.
+
+    While a job runs, a heartbeat carrying its latest progress is sent every PROGRESS_REPORT_SECONDS,
+    or every third of the lease time when leases are shorter.
+    """
+    def __init__(self, converter, address, name=None, token=None, num_processors=None, cancel_token=None):
+        """cancel_token: CancelToken that stops the worker and the job it is running."""
+        self.converter = converter
+        self.cancel_token = cancel_token if cancel_token is not None else CancelToken()
+        self.address = tuple(address)
+        self.name = name or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+        self.token = token
+        self.num_processors = num_processors
+        self.auto_profile = None
+        self.jobs_done = 0
+        self.error = None  # RemoteJobError the coordinator turned this worker away with, e.g. a wrong token
+
+    def __request(self, message):
+        message = dict(message, worker=self.name)
+        if self.token is not None:
+            message["token"] = self.token
+        reply = send_request(self.address, message)
+        if "error" in reply:
+            raise RemoteJobError(reply["error"])
+        return reply
+
+    def run(self):
+        """Convert jobs until the coordinator reports the batch finished or goes away. Returns the number of jobs run.
+
+        A request the coordinator rejects stops the worker with the rejection kept in self.error,
+        asking again would only be rejected again.
+        """
+        connected = False
+        while not self.cancel_token.cancelled:
+            try:
+                reply = self.__request({"op": "lease"})
+            except OSError:
+                # Wait for a coordinator that is not up yet, stop once the one we worked for is gone
+                if connected:
+                    return self.jobs_done
+                time.sleep(POLL_SECONDS)
+                continue
+            except RemoteJobError as e:
+                self.error = e
+                return self.jobs_done
+            connected = True
+
+            if reply["job"] is None:
+                if reply["finished"]:
+                    return self.jobs_done
+                time.sleep(POLL_SECONDS)
+                continue
+            self.__run_leased_job(reply)
+            self.jobs_done += 1
+        return self.jobs_done
+
+    def __profile(self, job, profile, min_mb_per_second=None):
+        if profile != AUTO_PROFILE:
+            return profile
+        if self.auto_profile is None and job.output_format == CHD and job.input_file.suffix not in (CHD, ZIP):
+            self.auto_profile, _ = self.converter.autotune_profile(job.input_file, min_mb_per_second=min_mb_per_second,
+                                                                   num_processors=self.num_processors)
+        return self.auto_profile
+
+    def __run_leased_job(self, reply):
+        lease_id = reply["lease"]
+        spec = reply["job"]
+        job = ConversionJob(spec["input"], spec["output_directory"], spec["output_format"])
+        latest_progress = None
+        stop_heartbeat = threading.Event()
+        # Stops the job when the worker is cancelled or the lease was lost to another worker
+        job_token = CancelToken()
+        unregister = self.cancel_token.register(job_token.cancel)
+
+        def heartbeat():
+            while not stop_heartbeat.wait(min(PROGRESS_REPORT_SECONDS, reply["lease_seconds"] / 3)):
+                progress = None
+                if latest_progress is not None:
+                    progress = {
+                        "stage": latest_progress.stage,
+                        "percent": latest_progress.percent,
+                        "mb_per_second": latest_progress.mb_per_second,
+                        "eta_seconds": latest_progress.eta_seconds,
+                    }
+                try:
+                    if not self.__request({"op": "heartbeat", "lease": lease_id, "progress": progress})["ok"]:
+                        job_token.cancel()
+                except (OSError, RemoteJobError):
+                    pass
+
+        def progressed(progress):
+            nonlocal latest_progress
+            latest_progress = progress
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        result = {"op": "result", "lease": lease_id, "job_id": reply["job_id"]}
+        try:
+            success, completed_process = self.converter.convert_file(
+                input_file=job.input_file,
+                output_directory=job.output_directory,
+                output_format=job.output_format,
+                num_processors=self.num_processors,
+                on_progress=progressed,
+                overwrite=spec.get("overwrite", False),
+                profile=self.__profile(job, spec.get("profile"), spec.get("min_mb_per_second")),
+                timeout=spec.get("timeout"),
+                cancel_token=job_token
+            )
+            result.update(
+                success=success,
+                args=[str(arg) for arg in completed_process.args],
+                returncode=completed_process.returncode,
+                stderr=(completed_process.stderr or b"").decode(errors="replace"),
+            )
+        except ConversionCancelledError:
+            # The coordinator either gave the job to another worker or is no longer waiting for it
+            return
+        except Exception as e:
+            result.update(success=False, error=type(e).__name__, message=str(e))
+        finally:
+            unregister()
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+
+        try:
+            self.__request(result)
+        except (OSError, RemoteJobError):
+            pass
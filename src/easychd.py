@@ -0,0 +1,274 @@
+# Headless command line entry point: python -m easychd
+# Only depends on the conversion tooling so it starts fast and runs without a display.
+import argparse
+import glob
+import json
+import signal
+import threading
+import sys
+import time
+from pathlib import Path
+from constants import *
+from exceptions import ChdmanNotInstalledError, ChdFormatError
+from tools import FileConverter, BatchConverter, ConversionJob
+from profiles import PROFILES, DEFAULT_PROFILE, AUTO_PROFILE
+from scanindex import ScanIndex
+from sheets import preflight_library
+from journal import JobJournal, DEFAULT_JOURNAL_PATH
+from chdinfo import read_chd_info
+from verifier import BulkVerifier, DEFAULT_VERIFY_JOBS_PER_DEVICE
+from distributed import Coordinator, Worker, parse_address, is_loopback, DEFAULT_LEASE_SECONDS
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="easychd",
+        description="Convert disc images with chdman and write one JSON result per line."
+    )
+    parser.add_argument("inputs", nargs="*", help="Files, directories (searched recursively) or glob patterns to convert.")
+    parser.add_argument("-m", "--manifest", help="JSON-lines file of jobs, '-' for stdin. Each line holds an \"input\" and "
+                                                 "optionally \"output_format\" and \"output_directory\".")
+    parser.add_argument("-f", "--format", default=CHD, choices=VALID_FORMATS, help="Output format (default: %(default)s).")
+    parser.add_argument("-o", "--output-directory", help="Write outputs here instead of next to each input.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of conversions to run at once (default: %(default)s).")
+    parser.add_argument("--timeout", type=float, default=None, help="Stop any single job still running after this many seconds "
+                        "and report it as failed (default: no limit).")
+    parser.add_argument("--jobs-per-disk", type=positive_int, default=None, help="Most jobs reading from or writing to the same disk "
+                        "at once (default: no limit). Jobs start largest first.")
+    parser.add_argument("--no-space-check", action="store_true", help="Start jobs even when their output disk looks too full for them.")
+    parser.add_argument("--cores", type=int, default=None, help="Cores shared between the running jobs (default: all).")
+    parser.add_argument("-p", "--profile", default=DEFAULT_PROFILE, choices=list(PROFILES) + [AUTO_PROFILE],
+                        help="Compression profile for created CHDs, '%s' test-compresses a sample with each (default: %%(default)s)." % AUTO_PROFILE)
+    parser.add_argument("--min-speed", type=float, default=None, help="With --profile auto, pick the best ratio among "
+                                                                       "profiles compressing at least this many MB/s.")
+    parser.add_argument("--sync", action="store_true", help="Skip inputs whose output is already up to date.")
+    parser.add_argument("--sync-hash", action="store_true", help="With --sync, also compare a content hash of the inputs.")
+    parser.add_argument("--journal", type=Path, help="Record job states in this journal so an interrupted batch can be resumed.")
+    parser.add_argument("--resume", action="store_true", help="First run the unfinished jobs of the journal "
+                                                              "(default journal: %s)." % DEFAULT_JOURNAL_PATH)
+    parser.add_argument("--metrics-log", help="Append per-job metrics (wall and CPU time, bytes, ratio) to this JSON-lines file.")
+    parser.add_argument("--prometheus", help="Keep aggregate metrics in this Prometheus textfile.")
+    parser.add_argument("--info", action="store_true", help="Print the header and track layout of every CHD input "
+                        "as JSON lines instead of converting anything.")
+    parser.add_argument("--verify", action="store_true", help="Verify every CHD input with chdman instead of converting, "
+                        "--jobs at a time and at most --jobs-per-disk per disk. Unchanged CHDs that were verified before are not read again.")
+    parser.add_argument("--reverify", action="store_true", help="With --verify, also read CHDs that were verified before.")
+    parser.add_argument("--coordinator", metavar="HOST:PORT", help="Hand the jobs out to workers listening for them on this "
+                        "address instead of converting them here. --jobs local workers still convert, use -j 0 to only coordinate. "
+                        "--timeout and --min-speed are sent to every worker, --cores is shared by the local ones; "
+                        "--jobs-per-disk and --no-space-check do not apply.")
+    parser.add_argument("--worker", metavar="HOST:PORT", help="Convert jobs leased from the coordinator at this address "
+                        "until its batch is finished, running --jobs of them at once. Inputs are ignored.")
+    parser.add_argument("--token", help="Shared secret between a coordinator and its workers.")
+    parser.add_argument("--lease-seconds", type=int, default=DEFAULT_LEASE_SECONDS, help="How long a worker may go silent "
+                        "before its job is handed to another worker (default: %(default)s).")
+    parser.add_argument("-r", "--results", default="-", help="Where to write JSON-lines results, '-' for stdout (default).")
+    return parser
+
+
+def expand_inputs(inputs):
+    """Resolve every path, directory and glob pattern given on the command line into input files."""
+    files = []
+    for pattern in inputs:
+        matches = [Path(match) for match in glob.glob(pattern, recursive=True)] if glob.has_magic(pattern) else [Path(pattern)]
+        for match in matches:
+            if match.is_dir():
+                # Images that are the track file of a sheet are converted through that sheet
+                files.extend(sorted(check.input_file for check in preflight_library(ScanIndex(match).scan())))
+            else:
+                files.append(match)
+    return files
+
+
+def read_manifest(manifest, default_format, default_output_directory):
+    jobs = []
+    stream = sys.stdin if manifest == "-" else open(manifest)
+    try:
+        for line in stream:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            jobs.append(ConversionJob(
+                entry["input"],
+                entry.get("output_directory", default_output_directory),
+                entry.get("output_format", default_format)
+            ))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return jobs
+
+
+def job_result(job, success, completed_process, error, elapsed_seconds, skipped=False):
+    message = None
+    if error is not None:
+        message = str(error) or type(error).__name__
+    elif not success:
+        message = completed_process.stderr.decode(errors="replace").strip()
+    return {
+        "input": str(job.input_file),
+        "output": str(job.output_directory / (job.input_file.stem + job.output_format)),
+        "output_format": job.output_format,
+        "success": success,
+        "skipped": skipped,
+        "returncode": None if completed_process is None else completed_process.returncode,
+        "error": None if error is None else type(error).__name__,
+        "message": message,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+    }
+
+
+def run_workers(args):
+    try:
+        converter = FileConverter()
+    except ChdmanNotInstalledError:
+        print("easychd: chdman is not installed or not on PATH", file=sys.stderr)
+        return 2
+    converter.metrics.log_path = args.metrics_log
+    converter.metrics.prometheus_path = args.prometheus
+
+    slots = max(1, args.jobs)
+    num_processors = max(1, args.cores // slots) if args.cores else None
+    address = parse_address(args.worker)
+    workers = [Worker(converter, address, token=args.token, num_processors=num_processors) for _ in range(slots)]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    errors = sorted({str(worker.error) for worker in workers if worker.error is not None})
+    for error in errors:
+        print(f"easychd: rejected by the coordinator: {error}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def print_info(inputs):
+    failures = 0
+    for input_file in inputs:
+        if input_file.suffix != CHD:
+            continue
+        try:
+            print(json.dumps(read_chd_info(input_file).to_dict()))
+        except (ChdFormatError, OSError) as e:
+            failures += 1
+            print(json.dumps({"path": str(input_file), "error": type(e).__name__, "message": str(e)}))
+    return 1 if failures else 0
+
+
+def cancel_on_interrupt(batch):
+    """Make Ctrl-C cancel the batch, which kills chdman and removes partial outputs, instead of leaving it running."""
+    signal.signal(signal.SIGINT, lambda _signal, _frame: batch.cancel())
+
+
+def verify_inputs(args):
+    inputs = [input_file for input_file in expand_inputs(args.inputs) if input_file.suffix == CHD]
+    if not inputs:
+        print("easychd: no CHD to verify", file=sys.stderr)
+        return 2
+    try:
+        converter = FileConverter()
+    except ChdmanNotInstalledError:
+        print("easychd: chdman is not installed or not on PATH", file=sys.stderr)
+        return 2
+
+    results = sys.stdout if args.results == "-" else open(args.results, "a")
+    failures = 0
+
+    def verified(result):
+        nonlocal failures
+        failures += not result.ok
+        results.write(json.dumps(result.to_dict()) + "\n")
+        results.flush()
+
+    try:
+        verifier = BulkVerifier(converter, workers=args.jobs, jobs_per_device=args.jobs_per_disk or DEFAULT_VERIFY_JOBS_PER_DEVICE, timeout=args.timeout)
+        cancel_on_interrupt(verifier)
+        verifier.verify_files(inputs, on_result=verified, force=args.reverify)
+    finally:
+        if results is not sys.stdout:
+            results.close()
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.coordinator and args.token is None and not is_loopback(parse_address(args.coordinator)[0]):
+        parser.error("--token is required for a --coordinator that listens beyond this machine")
+    if args.coordinator and args.jobs_per_disk is not None:
+        parser.error("--jobs-per-disk does not apply to --coordinator, workers take jobs one at a time")
+    if args.coordinator and args.no_space_check:
+        parser.error("--no-space-check does not apply to --coordinator, which does not check disk space")
+    if args.worker:
+        return run_workers(args)
+    if args.info:
+        return print_info(expand_inputs(args.inputs))
+    if args.verify:
+        return verify_inputs(args)
+
+    journal = None
+    jobs = []
+    if args.journal or args.resume:
+        journal = JobJournal(args.journal or DEFAULT_JOURNAL_PATH)
+    if args.resume:
+        jobs += journal.recover()
+
+    jobs += [ConversionJob(f, args.output_directory, args.format) for f in expand_inputs(args.inputs)]
+    if args.manifest:
+        jobs += read_manifest(args.manifest, args.format, args.output_directory)
+    if not jobs:
+        print("easychd: nothing to convert", file=sys.stderr)
+        return 2
+
+    converter = None
+    if not args.coordinator or args.jobs > 0:
+        try:
+            converter = FileConverter()
+        except ChdmanNotInstalledError:
+            print("easychd: chdman is not installed or not on PATH", file=sys.stderr)
+            return 2
+        converter.metrics.log_path = args.metrics_log
+        converter.metrics.prometheus_path = args.prometheus
+
+    results = sys.stdout if args.results == "-" else open(args.results, "a")
+    started = time.monotonic()
+    failures = 0
+
+    def job_done(job, success, completed_process, error, skipped=False):
+        nonlocal failures
+        failures += not success
+        results.write(json.dumps(job_result(job, success, completed_process, error, time.monotonic() - started, skipped)) + "\n")
+        results.flush()
+
+    try:
+        if args.coordinator:
+            num_processors = max(1, args.cores // args.jobs) if args.cores and args.jobs > 0 else None
+            batch = Coordinator(parse_address(args.coordinator), lease_seconds=args.lease_seconds, token=args.token, sync=args.sync,
+                                sync_hash=args.sync_hash, journal=journal, profile=args.profile, local_workers=args.jobs, converter=converter,
+                                timeout=args.timeout, min_mb_per_second=args.min_speed, num_processors=num_processors)
+        else:
+            batch = BatchConverter(converter, workers=args.jobs, cores=args.cores, sync=args.sync or args.sync_hash, sync_hash=args.sync_hash, journal=journal,
+                                   profile=args.profile, min_mb_per_second=args.min_speed, jobs_per_device=args.jobs_per_disk, timeout=args.timeout,
+                                   check_disk_space=not args.no_space_check)
+        cancel_on_interrupt(batch)
+        batch.run_jobs(
+            jobs,
+            on_job_done=job_done,
+            on_job_skipped=lambda job: job_done(job, True, None, None, skipped=True)
+        )
+    finally:
+        if results is not sys.stdout:
+            results.close()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,5 +17,41 @@ class SameFileExtensionError(Exception):
         super().__init__(*args)
 
 class OutputFileAlreadyExists(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class SheetParseError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class MissingTrackFileError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class RemoteJobError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class ChdFormatError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class UnsupportedChdVersionError(ChdFormatError):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class ConversionCancelledError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class ConversionTimeoutError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class InsufficientDiskSpaceError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class ArchiveError(Exception):
     def __init__(self, *args):
         super().__init__(*args)
\ No newline at end of file
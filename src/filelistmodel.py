@@ -0,0 +1,94 @@
+# Compact selection and status model behind the file list of MultipleFilesFrame
+from pathlib import Path
+
+STATUS_UNCONVERTED = "unconverted"
+STATUS_CONVERTED = "converted"
+STATUS_ERROR = "error"
+STATUS_VERIFIED = "verified"
+STATUS_COLORS = {
+    STATUS_UNCONVERTED: None,
+    STATUS_CONVERTED: "green",
+    STATUS_VERIFIED: "green",
+    STATUS_ERROR: "red",
+}
+FILTER_ALL = "All"
+
+
+class FileListModel:
+    """Holds every file found by a search in parallel lists instead of one widget or Tk variable per file.
+
+    Rows are addressed by their position in the sorted list of paths. The filter only changes which
+    rows are visible, selection and status are kept for every row.
+    """
+    def __init__(self, files=()):
+        self.paths = []
+        self.names = []
+        self.formats = []
+        self.sizes = []
+        self.statuses = []
+        self.messages = []
+        self.details = []  # e.g. media, track count and ratio of a CHD, read from its header
+        self.selected = bytearray()
+        self.row_of_path = {}
+        self.longest_filename = 0
+        self.format_filter = FILTER_ALL
+        self.status_filter = FILTER_ALL
+        self.visible_rows = []
+
+        for path, size in sorted(files, key=lambda item: Path(item[0]).as_posix()):
+            path = Path(path)
+            self.row_of_path[path.as_posix()] = len(self.paths)
+            self.paths.append(path)
+            self.names.append(path.stem)
+            self.formats.append(path.suffix.lower())
+            self.sizes.append(size)
+            self.statuses.append(STATUS_UNCONVERTED)
+            self.messages.append(STATUS_UNCONVERTED)
+            self.details.append("")
+            self.selected.append(0)
+            self.longest_filename = max(self.longest_filename, len(path.stem))
+        self.apply_filter()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return Path(path).as_posix() in self.row_of_path
+
+    def row_text(self, row):
+        text = f"{self.names[row].ljust(self.longest_filename)}  FORMAT: {self.formats[row]}  STATUS: {self.messages[row]}"
+        return f"{text}  ({self.details[row]})" if self.details[row] else text
+
+    def apply_filter(self, format_filter=None, status_filter=None):
+        if format_filter is not None:
+            self.format_filter = format_filter
+        if status_filter is not None:
+            self.status_filter = status_filter
+        self.visible_rows = [
+            row for row in range(len(self.paths))
+            if self.format_filter in (FILTER_ALL, self.formats[row])
+            and self.status_filter in (FILTER_ALL, self.statuses[row])
+        ]
+
+    def toggle(self, row):
+        self.selected[row] ^= 1
+
+    def select_visible(self, selected=True):
+        for row in self.visible_rows:
+            self.selected[row] = 1 if selected else 0
+
+    def all_visible_selected(self):
+        return bool(self.visible_rows) and all(self.selected[row] for row in self.visible_rows)
+
+    def selected_paths(self):
+        return [self.paths[row] for row in range(len(self.paths)) if self.selected[row]]
+
+    def set_details(self, path, details):
+        self.details[self.row_of_path[Path(path).as_posix()]] = details
+
+    def set_status(self, path, status, message=None):
+        row = self.row_of_path[Path(path).as_posix()]
+        self.statuses[row] = status
+        self.messages[row] = message if message is not None else status
+        if self.status_filter != FILTER_ALL:
+            self.apply_filter()
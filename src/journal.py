@@ -0,0 +1,86 @@
+# Append-only journal of batch jobs, used to resume a batch after the app was killed
+import json
+import os
+import threading
+from constants import CACHE_DIRECTORY, JOB_QUEUED, JOB_RUNNING
+from tools import ConversionJob, remove_orphaned_staging
+
+DEFAULT_JOURNAL_PATH = CACHE_DIRECTORY / "journal.jsonl"
+UNFINISHED_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+
+def job_key(job):
+    return f"{job.input_file}|{job.output_directory}|{job.output_format}"
+
+
+class JobJournal:
+    """Records the queued, running and done state of every job of the current batch.
+
+    Each state change is one JSON line, flushed and synced before the job moves on, so the
+    journal survives the app being killed at any point. Replaying it gives the jobs that were
+    queued or running when the batch stopped.
+    """
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __write(self, records, mode="a"):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock, open(self.path, mode) as journal:
+            for record in records:
+                journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def start_batch(self, jobs):
+        """Start a new journal holding every job of the batch as queued."""
+        self.__write(
+            [
+                {
+                    "job": job_key(job),
+                    "state": JOB_QUEUED,
+                    "input": str(job.input_file),
+                    "output_directory": str(job.output_directory),
+                    "output_format": job.output_format,
+                }
+                for job in jobs
+            ],
+            mode="w"
+        )
+
+    def mark(self, job, state):
+        self.__write([{"job": job_key(job), "state": state}])
+
+    def finish_batch(self):
+        """Forget the batch once every job has finished."""
+        with self.lock:
+            self.path.unlink(missing_ok=True)
+
+    def unfinished_jobs(self):
+        """Jobs of the last batch that were queued or still running, in their original order."""
+        jobs = {}
+        states = {}
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash
+                    if "input" in record:
+                        jobs[record["job"]] = ConversionJob(record["input"], record["output_directory"], record["output_format"])
+                    states[record["job"]] = record["state"]
+        except FileNotFoundError:
+            return []
+        return [job for key, job in jobs.items() if states[key] in UNFINISHED_STATES]
+
+    def recover(self):
+        """Clean up after an interrupted batch and return its unfinished jobs.
+
+        Staging directories left by the killed conversions are removed from every output directory of the batch.
+        """
+        jobs = self.unfinished_jobs()
+        for output_directory in {job.output_directory for job in jobs}:
+            if output_directory.is_dir():
+                remove_orphaned_staging(output_directory)
+        return jobs
@@ -0,0 +1,132 @@
+# Per-conversion measurements, aggregated for the GUI and exported as JSON lines or Prometheus text
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+PROMETHEUS_PREFIX = "easychd"
+
+
+class ConversionMetrics:
+    """What one convert_file call cost.
+
+    cpu times are those of the chdman processes the job waited on (or of the converting thread
+    for conversions done in Python), bytes_read counts the source and any intermediary CHD,
+    bytes_written every file written including the intermediary.
+    """
+    def __init__(self, input_file, output_file, output_format):
+        self.input_file = str(input_file)
+        self.output_file = str(output_file)
+        self.output_format = output_format
+        self.started = time.time()
+        self.success = False
+        self.wall_seconds = 0.0
+        self.user_cpu_seconds = 0.0
+        self.system_cpu_seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.output_bytes = 0
+        self.source_bytes = 0
+        self.intermediary_seconds = 0.0
+        self.intermediary_bytes = 0
+
+    @property
+    def compression_ratio(self):
+        """Size of the final output compared to the source, None when nothing was written."""
+        return self.output_bytes / self.source_bytes if self.source_bytes and self.output_bytes else None
+
+    def add_usage(self, rusage):
+        if rusage is not None:
+            self.user_cpu_seconds += rusage.ru_utime
+            self.system_cpu_seconds += rusage.ru_stime
+
+    def to_dict(self):
+        return {
+            "input": self.input_file,
+            "output": self.output_file,
+            "output_format": self.output_format,
+            "started": self.started,
+            "success": self.success,
+            "wall_seconds": self.wall_seconds,
+            "user_cpu_seconds": self.user_cpu_seconds,
+            "system_cpu_seconds": self.system_cpu_seconds,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "compression_ratio": self.compression_ratio,
+            "intermediary_seconds": self.intermediary_seconds,
+            "intermediary_bytes": self.intermediary_bytes,
+        }
+
+
+class MetricsRecorder:
+    """Collects ConversionMetrics from any thread.
+
+    log_path: When set, every job is appended to this JSON-lines file as it finishes.
+    prometheus_path: When set, aggregate counters are rewritten to this node_exporter textfile after every job.
+    """
+    def __init__(self, log_path=None, prometheus_path=None):
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def record(self, metrics):
+        with self.lock:
+            self.jobs.append(metrics)
+            if self.log_path is not None:
+                with open(self.log_path, "a") as log:
+                    log.write(json.dumps(metrics.to_dict()) + "\n")
+            if self.prometheus_path is not None:
+                self.write_prometheus(self.prometheus_path)
+
+    def summary(self):
+        """Totals over every recorded job. Throughput is measured over the span from the first job
+        starting to the last one finishing, so concurrent jobs add up."""
+        jobs = list(self.jobs)
+        if not jobs:
+            return {"jobs": 0, "failed": 0, "bytes_read": 0, "bytes_written": 0, "wall_seconds": 0.0,
+                    "user_cpu_seconds": 0.0, "system_cpu_seconds": 0.0, "intermediary_seconds": 0.0, "mb_per_second": 0.0}
+        span = max(job.started + job.wall_seconds for job in jobs) - min(job.started for job in jobs)
+        source_bytes = sum(job.source_bytes for job in jobs)
+        return {
+            "jobs": len(jobs),
+            "failed": sum(not job.success for job in jobs),
+            "bytes_read": sum(job.bytes_read for job in jobs),
+            "bytes_written": sum(job.bytes_written for job in jobs),
+            "wall_seconds": sum(job.wall_seconds for job in jobs),
+            "user_cpu_seconds": sum(job.user_cpu_seconds for job in jobs),
+            "system_cpu_seconds": sum(job.system_cpu_seconds for job in jobs),
+            "intermediary_seconds": sum(job.intermediary_seconds for job in jobs),
+            "mb_per_second": source_bytes / span / 1_000_000 if span > 0 else 0.0,
+        }
+
+    def write_prometheus(self, path):
+        summary = self.summary()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_jobs_total Conversions finished.",
+            f"# TYPE {PROMETHEUS_PREFIX}_jobs_total counter",
+            f"{PROMETHEUS_PREFIX}_jobs_total {summary['jobs']}",
+            f"# HELP {PROMETHEUS_PREFIX}_jobs_failed_total Conversions that failed.",
+            f"# TYPE {PROMETHEUS_PREFIX}_jobs_failed_total counter",
+            f"{PROMETHEUS_PREFIX}_jobs_failed_total {summary['failed']}",
+        ]
+        for key, help_text in (
+            ("bytes_read", "Bytes read by conversions."),
+            ("bytes_written", "Bytes written by conversions."),
+            ("wall_seconds", "Wall clock seconds spent converting."),
+            ("user_cpu_seconds", "User CPU seconds of conversion processes."),
+            ("system_cpu_seconds", "System CPU seconds of conversion processes."),
+            ("intermediary_seconds", "Seconds spent creating intermediary CHDs."),
+        ):
+            name = f"{PROMETHEUS_PREFIX}_{key}_total"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {summary[key]}"]
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_throughput_mb_per_second Source MB converted per second.",
+            f"# TYPE {PROMETHEUS_PREFIX}_throughput_mb_per_second gauge",
+            f"{PROMETHEUS_PREFIX}_throughput_mb_per_second {summary['mb_per_second']}",
+        ]
+        # The textfile collector may read at any time, so never let it see a half written file
+        temporary_path = Path(str(path) + ".tmp")
+        temporary_path.write_text("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
@@ -1,26 +1,59 @@
 from tkinter.filedialog import askdirectory
 import customtkinter
 from pathlib import Path
+from os import cpu_count
 import threading
-from exceptions import ProgressBarException, SameFileExtensionError, FileFormatNotSupportedError, OutputFileAlreadyExists
+import time
+from profiles import PROFILES, DEFAULT_PROFILE, AUTO_PROFILE
+from exceptions import ProgressBarException, SameFileExtensionError, FileFormatNotSupportedError, OutputFileAlreadyExists, SheetParseError, MissingTrackFileError, RemoteJobError, ConversionCancelledError, ConversionTimeoutError, InsufficientDiskSpaceError, ArchiveError, ChdFormatError
 from constants import *
+from tools import BatchConverter, ConversionJob, format_eta
+from scheduler import job_bytes
+from verifier import BulkVerifier
+from distributed import Coordinator, DEFAULT_PORT
+from journal import JobJournal
+from scanindex import ScanIndex
+from sheets import preflight_library
+from filelistmodel import FileListModel, FILTER_ALL, STATUS_UNCONVERTED, STATUS_CONVERTED, STATUS_ERROR, STATUS_VERIFIED
+from virtualfilelist import VirtualFileList
+from uiqueue import UIUpdateQueue
 
 NO_DIRECTORY_TEXT = "No directory selected"
+CHDMAN_MISSING_TEXT = "chdman was not found, install it to convert files"
 PROGRESS_START = "start"
 PROGRESS_STOP = "stop"
 PROGRESS_SEARCH = "search"
 PROGRESS_CONVERT = "convert"
+FORMAT_FILTER_CHOICES = [FILTER_ALL] + INPUT_FORMATS
+SAME_DIRECTORY_TEXT = "Next to each source file"
+UNLIMITED_JOBS_PER_DISK = "Unlimited"
+JOBS_PER_DISK_CHOICES = ["1", "2", "4", UNLIMITED_JOBS_PER_DISK]
+STATUS_FILTER_CHOICES = [FILTER_ALL, STATUS_UNCONVERTED, STATUS_CONVERTED, STATUS_VERIFIED, STATUS_ERROR]
+WORKER_CHOICES = [str(n) for n in (1, 2, 4, 8, 16, 32, 64) if n <= (cpu_count() or 1)]
 
 class MultipleFilesFrame(customtkinter.CTkFrame):
-    def __init__(self, master, converter, **kwargs):
+    def __init__(self, master, converter, ui_queue=None, **kwargs):
         super().__init__(master, **kwargs)
     
         self.converter = converter
+        self.ui_queue = ui_queue if ui_queue is not None else UIUpdateQueue(self)
         self.selected_directory = customtkinter.StringVar(master=self, value=NO_DIRECTORY_TEXT)
-        self.file_list = {}
-        self.longest_filename = 0
+        self.file_list = FileListModel()
+        self.profile = customtkinter.StringVar(master=self, value=DEFAULT_PROFILE)
         self.output_format = customtkinter.StringVar(master=self, value=CHD)
-        self.scrollable_frame_switches = []  # stores widgets displayed in scrollable list.
+        self.worker_count = customtkinter.StringVar(master=self, value=max((c for c in WORKER_CHOICES if int(c) <= 4), key=int))
+        self.format_filter = customtkinter.StringVar(master=self, value=FILTER_ALL)
+        self.status_filter = customtkinter.StringVar(master=self, value=FILTER_ALL)
+        self.select_all_state = customtkinter.IntVar(master=self, value=0)
+        self.sync_state = customtkinter.IntVar(master=self, value=0)
+        self.output_directory = customtkinter.StringVar(master=self, value=SAME_DIRECTORY_TEXT)
+        self.jobs_per_disk = customtkinter.StringVar(master=self, value="2")
+        self.coordinate_state = customtkinter.IntVar(master=self, value=0)
+        self.coordinator_port = customtkinter.StringVar(master=self, value=str(DEFAULT_PORT))
+        self.coordinator_token = customtkinter.StringVar(master=self, value="")
+        self.journal = JobJournal()
+        self.resume_jobs = self.journal.recover()  # unfinished jobs of a batch that was interrupted
+        self.active_batch = None  # BatchConverter, Coordinator or BulkVerifier currently running, for cancel()
         self.label_font = customtkinter.CTkFont(size=15)
         self.result_font = customtkinter.CTkFont(size=15, slant="italic")
 
@@ -43,12 +76,39 @@ class MultipleFilesFrame(customtkinter.CTkFrame):
         
         # Convert widgets
         self.convert_button = customtkinter.CTkButton(self, text="Convert Files", state="disabled", command=self.convert_files)
+        self.verify_button = customtkinter.CTkButton(self, text="Verify CHDs", state="disabled", command=self.verify_files)
+        self.cancel_button = customtkinter.CTkButton(self, text="Cancel", state="disabled", command=self.cancel)
+        self.resume_button = customtkinter.CTkButton(self, text=f"Resume Batch ({len(self.resume_jobs)})", command=self.resume_batch)
         self.progressbar = customtkinter.CTkProgressBar(master=self, mode="indeterminate")
         self.progressbar_text = customtkinter.StringVar(value="")
         self.progressbar_label = customtkinter.CTkLabel(master=self, textvariable=self.progressbar_text, anchor="e")
 
+        # Aggregate metrics of the conversions run so far
+        self.stats_text = customtkinter.StringVar(value="")
+        self.stats_label = customtkinter.CTkLabel(master=self, textvariable=self.stats_text, anchor="w")
+
         # List of selectable files
-        self.scrollable_frame = customtkinter.CTkScrollableFrame(self, label_text="Files Found", label_anchor="w")
+        self.select_all_checkbox = customtkinter.CTkCheckBox(
+            master=self,
+            text="Select all",
+            variable=self.select_all_state,
+            command=self.select_all
+        )
+        self.format_filter_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=FORMAT_FILTER_CHOICES,
+            variable=self.format_filter,
+            command=self.filter_file_list
+        )
+        self.status_filter_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=STATUS_FILTER_CHOICES,
+            variable=self.status_filter,
+            command=self.filter_file_list
+        )
+        self.file_list_view = VirtualFileList(self)
 
         # Conversion format
         self.conversion_output_format_label = customtkinter.CTkLabel(
@@ -63,27 +123,148 @@ class MultipleFilesFrame(customtkinter.CTkFrame):
             variable=self.output_format 
         )
 
+        # Concurrent jobs
+        self.worker_count_label = customtkinter.CTkLabel(
+            master=self,
+            text="Parallel jobs:",
+            font=self.label_font
+        )
+        self.worker_count_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=WORKER_CHOICES,
+            variable=self.worker_count
+        )
+
+        self.jobs_per_disk_label = customtkinter.CTkLabel(
+            master=self,
+            text="Jobs per disk:",
+            font=self.label_font
+        )
+        self.jobs_per_disk_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=JOBS_PER_DISK_CHOICES,
+            variable=self.jobs_per_disk
+        )
+
+        # Output directory, possibly on another disk than the sources
+        self.output_directory_label = customtkinter.CTkLabel(
+            master=self,
+            text="Output directory:",
+            font=self.label_font
+        )
+        self.output_directory_button = customtkinter.CTkButton(master=self, text="Select", command=self.get_output_directory)
+        self.output_directory_reset_button = customtkinter.CTkButton(master=self, text="Reset", width=60, command=self.reset_output_directory)
+        self.output_directory_value_label = customtkinter.CTkLabel(
+            master=self,
+            textvariable=self.output_directory,
+            font=self.result_font,
+            anchor="w",
+            text_color="darkorange"
+        )
+
+        # Hand the batch out to workers on other machines, see distributed.Coordinator
+        self.coordinate_checkbox = customtkinter.CTkCheckBox(
+            master=self,
+            text="Share batch with remote workers",
+            variable=self.coordinate_state
+        )
+        self.coordinator_port_entry = customtkinter.CTkEntry(master=self, width=80, textvariable=self.coordinator_port)
+        self.coordinator_token_entry = customtkinter.CTkEntry(
+            master=self,
+            placeholder_text="Token (optional)",
+            textvariable=self.coordinator_token
+        )
+
+        self.profile_label = customtkinter.CTkLabel(
+            master=self,
+            text="Compression profile:",
+            font=self.label_font
+        )
+        self.profile_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=list(PROFILES) + [AUTO_PROFILE],
+            variable=self.profile
+        )
+        self.sync_checkbox = customtkinter.CTkCheckBox(
+            master=self,
+            text="Skip up-to-date outputs",
+            variable=self.sync_state
+        )
+
         # Layout
         self.directory_info_label.grid(row=0, column=0, sticky="e", padx=20, pady=10)
         self.directory_browse_button.grid(row=0, column=1, padx=(20, 10), pady=10, sticky="w")
         self.directory_label.grid(row=0, column=2, padx=(0, 20), pady=10, sticky="w")
         self.convert_button.grid(row=10, column=0, padx=(20, 10), pady=(10, 10), sticky="w")
+        self.verify_button.grid(row=9, column=0, padx=(20, 10), pady=(10, 0), sticky="w")
+        self.cancel_button.grid(row=9, column=1, padx=20, pady=(10, 0), sticky="w")
+        if self.resume_jobs:
+            self.resume_button.grid(row=11, column=0, padx=(20, 10), pady=(0, 10), sticky="w")
         self.progressbar.grid(row=10, column=1, columnspan=3, padx=(20, 20), pady=(10, 0), sticky="ew")
         self.progressbar.grid_forget()  # initially hide the progress bar
+        self.stats_label.grid(row=12, column=0, columnspan=4, padx=20, pady=(0, 10), sticky="w")
         self.progressbar_label.grid(row=11, column=1, columnspan=3, padx=(0,20), pady=10, sticky="ew")
-        self.scrollable_frame.grid(row=3, column=0, columnspan=4, padx=20, pady=10, sticky="nsew")
-        self.scrollable_frame.grid_columnconfigure(0, weight=1)
+        self.select_all_checkbox.grid(row=2, column=0, padx=20, pady=(10, 0), sticky="w")
+        self.format_filter_selector.grid(row=2, column=1, padx=20, pady=(10, 0), sticky="w")
+        self.status_filter_selector.grid(row=2, column=2, padx=(0, 20), pady=(10, 0), sticky="w")
+        self.file_list_view.grid(row=3, column=0, columnspan=4, padx=20, pady=10, sticky="nsew")
         self.draw_file_list()
         self.conversion_output_format_label.grid(row=4, column=0, padx=20, pady=10, sticky="e")
         self.conversion_output_format_selector.grid(row=4, column=1, padx=20, pady=10,sticky="w")
+        self.worker_count_label.grid(row=5, column=0, padx=20, pady=10, sticky="e")
+        self.worker_count_selector.grid(row=5, column=1, padx=20, pady=10, sticky="w")
+        self.profile_label.grid(row=6, column=0, padx=20, pady=10, sticky="e")
+        self.profile_selector.grid(row=6, column=1, padx=20, pady=10, sticky="w")
+        self.sync_checkbox.grid(row=4, column=2, padx=(0, 20), pady=10, sticky="w")
+        self.jobs_per_disk_label.grid(row=5, column=2, padx=(0, 20), pady=10, sticky="e")
+        self.jobs_per_disk_selector.grid(row=5, column=3, padx=(0, 20), pady=10, sticky="w")
+        self.output_directory_label.grid(row=7, column=0, padx=20, pady=10, sticky="e")
+        self.output_directory_button.grid(row=7, column=1, padx=20, pady=10, sticky="w")
+        self.output_directory_value_label.grid(row=7, column=2, padx=(0, 20), pady=10, sticky="w")
+        self.output_directory_reset_button.grid(row=7, column=3, padx=(0, 20), pady=10, sticky="w")
+        self.coordinate_checkbox.grid(row=8, column=0, padx=20, pady=10, sticky="e")
+        self.coordinator_port_entry.grid(row=8, column=1, padx=20, pady=10, sticky="w")
+        self.coordinator_token_entry.grid(row=8, column=2, padx=(0, 20), pady=10, sticky="w")
+
+    def set_converter(self, converter):
+        self.converter = converter
+        if converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
+
+    def show_stats(self):
+        summary = self.converter.metrics.summary()
+        if summary["jobs"]:
+            self.stats_text.set(
+                f"Jobs: {summary['jobs']} ({summary['failed']} failed)  "
+                f"Read: {summary['bytes_read'] / 1e9:.2f} GB  Written: {summary['bytes_written'] / 1e9:.2f} GB  "
+                f"Throughput: {summary['mb_per_second']:.1f} MB/s  "
+                f"CPU: {summary['user_cpu_seconds'] + summary['system_cpu_seconds']:.0f} s"
+            )
 
     def toggle_ui_state(self, ui_state="enabled"):
         self.convert_button.configure(state=ui_state, text="Convert Files")
+        self.verify_button.configure(state=ui_state)
+        # Cancel is only usable while everything else is disabled
+        self.cancel_button.configure(state="disabled" if ui_state == "enabled" else "normal", text="Cancel")
         self.directory_browse_button.configure(state=ui_state)
-        for switch in self.scrollable_frame_switches:
-            if isinstance(switch, customtkinter.CTkCheckBox):
-                switch.configure(state=ui_state)
+        self.resume_button.configure(state=ui_state)
+        self.file_list_view.set_row_state(ui_state)
+        self.select_all_checkbox.configure(state=ui_state)
+        self.format_filter_selector.configure(state=ui_state)
+        self.status_filter_selector.configure(state=ui_state)
         self.conversion_output_format_selector.configure(state=ui_state)
+        self.worker_count_selector.configure(state=ui_state)
+        self.sync_checkbox.configure(state=ui_state)
+        self.profile_selector.configure(state=ui_state)
+        self.jobs_per_disk_selector.configure(state=ui_state)
+        self.output_directory_button.configure(state=ui_state)
+        self.output_directory_reset_button.configure(state=ui_state)
+        self.coordinate_checkbox.configure(state=ui_state)
+        self.coordinator_port_entry.configure(state=ui_state)
+        self.coordinator_token_entry.configure(state=ui_state)
 
     def interact_with_progressbar(self, state=PROGRESS_START, mode="search"):
         valid_state_inputs = [PROGRESS_START, PROGRESS_STOP]
@@ -98,14 +279,16 @@ class MultipleFilesFrame(customtkinter.CTkFrame):
             self.progressbar.grid_forget()
         else:
             if mode == PROGRESS_SEARCH:
-                self.progressbar.configure(progress_color="darkorange")
+                self.progressbar.configure(progress_color="darkorange", mode="indeterminate")
                 self.progressbar_text.set("Searching directory...")
             else:
-                self.progressbar.configure(progress_color="mediumorchid")
+                self.progressbar.configure(progress_color="mediumorchid", mode="determinate")
+                self.progressbar.set(0)
                 self.progressbar_text.set("Checking files for conversion...")
 
             self.progressbar.grid(row=10, column=1, columnspan=3, padx=(20, 20), pady=(10, 0), sticky="ew")
-            self.progressbar.start()
+            if mode == PROGRESS_SEARCH:
+                self.progressbar.start()
 
     def get_directory(self):
         new_dir = askdirectory(mustexist=True)
@@ -114,69 +297,137 @@ class MultipleFilesFrame(customtkinter.CTkFrame):
             self.search_for_files()
         self.directory_browse_button.focus_set()
 
+    def get_output_directory(self):
+        new_dir = askdirectory(mustexist=True)
+        if new_dir != "":
+            self.output_directory.set(new_dir)
+
+    def reset_output_directory(self):
+        self.output_directory.set(SAME_DIRECTORY_TEXT)
+
     def search_for_files(self):
         # Draw a progress bar to distract us and disable 
         # things that shouldn't be clicked while a search is ongoing
         self.toggle_ui_state("disabled")
         self.interact_with_progressbar(state=PROGRESS_START, mode=PROGRESS_SEARCH)
         # Actually walk the path and build a list of components with files.
+        directory_path = Path(self.selected_directory.get())
+
         def build_file_list():
-            self.file_list = {}
-            self.longest_filename = 0
-
-            directory_path = Path(self.selected_directory.get())
-            for file_path in directory_path.rglob('*'):
-                if file_path.is_file() and str.lower(file_path.suffix) in VALID_FORMATS:
-                    self.file_list[file_path.as_posix()] = {
-                        "filename": file_path.stem,
-                        "filetype": file_path.suffix,
-                        "convertstate": customtkinter.IntVar(master=self)
-                    }
-
-                # used for fixed length display of switch text.
-                if len(file_path.stem) > self.longest_filename:
-                    self.longest_filename = len(file_path.stem)
-            
-            # Let the app go back to functioning as normal
-            self.toggle_ui_state("enabled")
-            self.interact_with_progressbar(state=PROGRESS_STOP)
-            self.draw_file_list()
+            checks = preflight_library(ScanIndex(directory_path).scan())
+            file_list = FileListModel((check.input_file, check.total_bytes) for check in checks)
+            for check in checks:
+                if check.chd_info is not None:
+                    file_list.set_details(check.input_file, check.chd_info.summary())
+                if not check.ok:
+                    broken = "Broken archive" if type(check.error) is ArchiveError else "Broken sheet"
+                    file_list.set_status(check.input_file, STATUS_ERROR, f"{broken} - {check.error}")
+            self.ui_queue.call(self.finish_search, file_list)
 
         threading.Thread(target=build_file_list, daemon=True).start()
 
+    def finish_search(self, file_list):
+        # Let the app go back to functioning as normal
+        self.file_list = file_list
+        self.toggle_ui_state("enabled")
+        self.interact_with_progressbar(state=PROGRESS_STOP)
+        self.draw_file_list()
+
     def draw_file_list(self):
-        # Delete existing list of switches
-        for switch in self.scrollable_frame_switches:
-            switch.destroy()
-        self.scrollable_frame_switches = []
-
-        # Draw new list
-        if self.file_list != {}:
-            for f in sorted(self.file_list.keys()):
-                fname = self.file_list[f]["filename"]
-                ftype = self.file_list[f]["filetype"]
-                if len(fname) < self.longest_filename:
-                    switch_text = f"{fname.ljust(self.longest_filename)}  FORMAT: {ftype}  STATUS: unconverted"
-                else:
-                    switch_text = f"{fname}  FORMAT: {ftype}  STATUS: unconverted"
+        self.file_list.apply_filter(self.format_filter.get(), self.status_filter.get())
+        self.select_all_state.set(int(self.file_list.all_visible_selected()))
+        self.file_list_view.set_model(self.file_list)
 
-                switch = customtkinter.CTkCheckBox(
-                    master=self.scrollable_frame,
-                    font=customtkinter.CTkFont(family="Courier New", size=12),
-                    text=switch_text,
-                    variable=self.file_list[f]["convertstate"]
-                )
-                self.file_list[f]["switch"] = switch  # keep a reference to the switch here. BUG_TEST
-                switch.grid(row=len(self.scrollable_frame_switches), column=0, padx=10, pady=(0, 20), sticky="w")
-                self.scrollable_frame_switches.append(switch)
-        else:
-            no_files_found_label = customtkinter.CTkLabel(master=self.scrollable_frame, text="No files found in this directory")
-            no_files_found_label.grid(row=0, column=0, padx=10, pady=(0, 20), sticky="w")
-            self.scrollable_frame_switches.append(no_files_found_label)
+    def filter_file_list(self, _choice=None):
+        self.file_list.apply_filter(self.format_filter.get(), self.status_filter.get())
+        self.select_all_state.set(int(self.file_list.all_visible_selected()))
+        self.file_list_view.first_row = 0
+        self.file_list_view.refresh()
+
+    def select_all(self):
+        self.file_list.select_visible(bool(self.select_all_state.get()))
+        self.file_list_view.refresh()
+
+    def cancel(self):
+        """Stop the running batch or verification, killing chdman and removing partial outputs."""
+        if self.active_batch is not None:
+            self.active_batch.cancel()
+            self.cancel_button.configure(state="disabled", text="Cancelling...")
+
+    def finish_batch(self):
+        self.active_batch = None
+        self.toggle_ui_state("enabled")
+        self.interact_with_progressbar(state=PROGRESS_STOP)
+        self.progressbar_text.set(f"Conversion(s) Completed.")
 
     def convert_files(self):
         """Convert selected files from checkboxes into desired format."""
-        conversion_list = [f for f in self.file_list.keys() if self.file_list[f]["convertstate"].get()]
+        output_format = self.output_format.get()
+        output_directory = self.output_directory.get()
+        output_directory = None if output_directory == SAME_DIRECTORY_TEXT else Path(output_directory)
+        self.run_batch([ConversionJob(f, output_directory, output_format) for f in self.file_list.selected_paths()])
+
+    def verify_files(self):
+        """Verify the selected CHDs, several at once, skipping the ones verified before and unchanged since."""
+        if self.converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
+            return
+        input_files = [f for f in self.file_list.selected_paths() if f.suffix == CHD]
+        if not input_files:
+            self.progressbar_text.set("No CHD selected to verify")
+            return
+
+        self.toggle_ui_state("disabled")
+        self.interact_with_progressbar(state=PROGRESS_START, mode=PROGRESS_CONVERT)
+        # Read the widgets here, the worker thread must not touch Tk
+        verifier = BulkVerifier(
+            self.converter,
+            workers=int(self.worker_count.get()),
+            jobs_per_device=None if self.jobs_per_disk.get() == UNLIMITED_JOBS_PER_DISK else int(self.jobs_per_disk.get())
+        )
+        self.active_batch = verifier
+        ui_queue = self.ui_queue
+        file_list = self.file_list
+        total_files = len(input_files)
+        self.progressbar_text.set(f"Verifying {total_files} file(s)")
+
+        def run_verification():
+            verified = 0
+            failed = 0
+
+            def file_verified(result):
+                nonlocal verified, failed
+                verified += 1
+                failed += not result.ok
+                if result.ok:
+                    status, message = STATUS_VERIFIED, "Verified (cached)" if result.cached else "Verified"
+                else:
+                    status, message = STATUS_ERROR, f"Error - Verify failed - {result.message}"
+                ui_queue.call(file_list.set_status, result.path, status, message)
+                ui_queue.post((self, "file_list"), self.file_list_view.refresh)
+                ui_queue.post((self, "progress"), self.progressbar.set, verified / total_files)
+                ui_queue.post((self, "progress_text"), self.progressbar_text.set, f"Verified {verified}/{total_files} - {failed} failed")
+
+            verifier.verify_files(input_files, on_result=file_verified)
+            ui_queue.call(self.finish_verification, f"Verification completed - {failed} of {total_files} failed")
+
+        threading.Thread(target=run_verification, daemon=True).start()
+
+    def finish_verification(self, result_text):
+        self.finish_batch()
+        self.progressbar_text.set(result_text)
+
+    def resume_batch(self):
+        """Run the jobs a previously interrupted batch did not finish."""
+        resume_jobs = self.resume_jobs
+        self.resume_jobs = []
+        self.resume_button.grid_forget()
+        self.run_batch(resume_jobs)
+
+    def run_batch(self, conversion_list):
+        if self.converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
+            return
         total_files = len(conversion_list)
         
         if total_files == 0:
@@ -187,53 +438,125 @@ class MultipleFilesFrame(customtkinter.CTkFrame):
         self.interact_with_progressbar(state=PROGRESS_START, mode=PROGRESS_CONVERT)
         self.progressbar.grid(row=10, column=1, columnspan=3, padx=(20, 20), pady=(10, 0), sticky="ew")
         
+        # Read the widgets here, the worker thread must not touch Tk
+        if self.coordinate_state.get():
+            port = int(self.coordinator_port.get()) if self.coordinator_port.get().isdigit() else DEFAULT_PORT
+            token = self.coordinator_token.get() or None
+            # Without a token, only workers on this machine may connect
+            batch = Coordinator(
+                ("0.0.0.0" if token is not None else "127.0.0.1", port),
+                token=token,
+                sync=bool(self.sync_state.get()),
+                journal=self.journal,
+                profile=self.profile.get(),
+                local_workers=int(self.worker_count.get()),
+                converter=self.converter
+            )
+            if token is not None:
+                self.progressbar_text.set(f"Converting {total_files} file(s), serving remote workers on port {port}")
+            else:
+                self.progressbar_text.set(f"Converting {total_files} file(s), serving workers on this machine only, set a token to serve remote ones")
+        else:
+            batch = BatchConverter(
+                self.converter,
+                workers=int(self.worker_count.get()),
+                sync=bool(self.sync_state.get()),
+                journal=self.journal,
+                profile=self.profile.get(),
+                jobs_per_device=None if self.jobs_per_disk.get() == UNLIMITED_JOBS_PER_DISK else int(self.jobs_per_disk.get())
+            )
+            self.progressbar_text.set(f"Converting {total_files} file(s) with {batch.workers} parallel job(s)")
+        self.active_batch = batch
+        ui_queue = self.ui_queue
+        file_list = self.file_list
+
         def run_conversion():
             conversion_counter = 1
-            for f in conversion_list:
-                error_found = False
-                switch = self.file_list[f]["switch"]
-
-                try:
-                    self.progressbar_text.set(f"Converting {f} - {conversion_counter}/{total_files}")
-                    result, completed_process = self.converter.convert_file(
-                        input_file=Path(f),
-                        output_directory=Path(f).parent,
-                        output_format=self.output_format.get()
-                    )
-                    error_found = not result
+            job_progress = {}  # percent complete and MB/s of every started job
+            # Progress and ETA are weighted by bytes, a 4 GB disc counts for more than a 40 MB one
+            sizes = {job: job_bytes(job) for job in conversion_list}
+            total_bytes = sum(sizes.values()) or 1
+            batch_started = time.monotonic()
+
+            def set_status(input_file, status, message):
+                # Resumed jobs may come from a directory that is not the one listed
+                if input_file in file_list:
+                    ui_queue.call(file_list.set_status, input_file, status, message)
+                    ui_queue.post((self, "file_list"), self.file_list_view.refresh)
+
+            def job_done(job, result, completed_process, e):
+                nonlocal conversion_counter
+                error_found = not result
+                if e is None:
                     if error_found:
                         error_text = f"Error - {str(completed_process.stderr.decode())}"
+                elif type(e) is SameFileExtensionError:
+                    error_text = f"Error - Already in format"
+                elif type(e) is FileFormatNotSupportedError:
+                    error_text = f"Error - Format not supported"
+                elif type(e) is OutputFileAlreadyExists:
+                    error_text = f"Error - Output file already exists cannot overwrite"
+                elif type(e) is ConversionCancelledError:
+                    error_text = f"Cancelled"
+                elif type(e) is ConversionTimeoutError:
+                    error_text = f"Error - Timed out"
+                elif type(e) is InsufficientDiskSpaceError:
+                    error_text = f"Error - Not enough disk space - {e}"
+                elif type(e) is RemoteJobError:
+                    error_text = f"Error - Remote worker - {e}"
+                elif type(e) in (SheetParseError, MissingTrackFileError):
+                    error_text = f"Error - Broken sheet - {e}"
+                elif type(e) is ArchiveError:
+                    error_text = f"Error - Broken archive - {e}"
+                elif type(e) is ChdFormatError:
+                    error_text = f"Error - Broken CHD - {e}"
+                else:
+                    error_text = f"Error - Unknown error"
 
-                except (SameFileExtensionError, FileFormatNotSupportedError, OutputFileAlreadyExists, Exception) as e:
-                    error_found = True
-                    if type(e) is SameFileExtensionError:
-                        error_text = f"Error - Already in format"
-                    elif type(e) is FileFormatNotSupportedError:
-                        error_text = f"Error - Format not supported"
-                    elif type(e) is OutputFileAlreadyExists:
-                        error_text = f"Error - Output file already exists cannot overwrite"
-                    else:
-                        error_text = f"Error - Unknown error"
-                finally:
-                    current_text = switch.cget("text")
-                    current_text = current_text[0:current_text.rfind(":")+1]
+                if type(e) is ConversionCancelledError:
+                    set_status(job.input_file, STATUS_UNCONVERTED, error_text)
+                elif error_found:
+                    set_status(job.input_file, STATUS_ERROR, error_text)
+                else:
+                    set_status(job.input_file, STATUS_CONVERTED, "Converted successfully")
+                job_progress[job] = (100, 0)
+                ui_queue.post((self, "stats"), self.show_stats)
+                ui_queue.post((self, "progress_text"), self.progressbar_text.set, f"Converted {job.input_file.name} - {conversion_counter}/{total_files}")
+                conversion_counter += 1
 
-                    if error_found:
-                        switch.configure(
-                            text=current_text+f" "+error_text,
-                            text_color="red"
-                        )
-                    else:
-                        switch.configure(
-                            text=current_text+f" Converted successfully",
-                            text_color="green"
-                        )
-                    conversion_counter += 1
-
-
-            self.toggle_ui_state("enabled")
-            self.interact_with_progressbar(state=PROGRESS_STOP)
-            self.progressbar_text.set(f"Conversion(s) Completed.")
+            def job_skipped(job):
+                nonlocal conversion_counter
+                set_status(job.input_file, STATUS_CONVERTED, "Up to date")
+                job_progress[job] = (100, 0)
+                conversion_counter += 1
+
+            def job_progressed(job, progress):
+                job_progress[job] = (progress.percent, progress.mb_per_second)
+                fraction = sum(percent * sizes[progressed_job] for progressed_job, (percent, _) in list(job_progress.items())) / 100 / total_bytes
+                throughput = sum(mb_per_second for _, mb_per_second in list(job_progress.values()))
+                elapsed = time.monotonic() - batch_started
+                eta = elapsed / fraction * (1 - fraction) if fraction > 0 else None
+                ui_queue.post((self, "progress"), self.progressbar.set, fraction)
+                ui_queue.post(
+                    (self, "progress_text"),
+                    self.progressbar_text.set,
+                    f"{conversion_counter - 1}/{total_files} done - {fraction * 100:.1f}% - {throughput:.1f} MB/s - ETA {format_eta(eta)}"
+                )
+
+            try:
+                batch.run_jobs(
+                    conversion_list,
+                    on_job_done=job_done,
+                    on_progress=job_progressed,
+                    on_job_skipped=job_skipped
+                )
+            except OSError as e:
+                # The coordinator could not listen on its port
+                ui_queue.call(self.finish_batch)
+                ui_queue.call(self.progressbar_text.set, f"Could not serve remote workers - {e}")
+                return
+
+            ui_queue.call(self.finish_batch)
         
         # Begin the conversion in a different thread
         threading.Thread(target=run_conversion, daemon=True).start()
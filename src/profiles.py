@@ -0,0 +1,117 @@
+# Named chdman createcd compression settings and the sampling used to auto-tune between them
+from pathlib import Path
+from constants import CUE, GDI, ISO
+from exceptions import SheetParseError
+from sheets import parse_cue, parse_gdi, ISO_SECTOR_SIZE
+
+CD_FRAME_SIZE = 2448  # sector plus subcode, CD hunk sizes must be a multiple of it
+DEFAULT_PROFILE = "default"
+AUTO_PROFILE = "auto"
+AUTOTUNE_SAMPLE_BYTES = 64 * 1024 * 1024
+
+
+class CompressionProfile:
+    """A set of chdman createcd options.
+
+    codecs: Codecs in order of preference, codecs the installed chdman lacks are dropped.
+        None keeps chdman's own default (cdlz,cdzl,cdfl).
+    hunk_size: Bytes per hunk, larger hunks compress better but make random access slower.
+    max_processors: Upper limit on --numprocessors regardless of the batch core budget.
+    """
+    def __init__(self, name, description, codecs=None, hunk_size=None, max_processors=None):
+        self.name = name
+        self.description = description
+        self.codecs = codecs
+        self.hunk_size = hunk_size
+        self.max_processors = max_processors
+
+    def createcd_args(self, capabilities=None, num_processors=None):
+        args = []
+        if self.codecs is not None:
+            codecs = [codec for codec in self.codecs if capabilities is None or codec in capabilities.codecs or codec == "none"]
+            args += ["--compression", ",".join(codecs) or "none"]
+        if self.hunk_size is not None:
+            args += ["--hunksize", str(self.hunk_size)]
+        if self.max_processors is not None:
+            num_processors = min(num_processors or self.max_processors, self.max_processors)
+        if num_processors:
+            args += ["--numprocessors", str(num_processors)]
+        return args
+
+    def __repr__(self):
+        return f"CompressionProfile({self.name!r})"
+
+
+PROFILES = {
+    profile.name: profile for profile in (
+        CompressionProfile(DEFAULT_PROFILE, "chdman defaults"),
+        CompressionProfile("fast", "Fast zstd/zlib only, for staging", codecs=["cdzs", "cdzl"], hunk_size=8 * CD_FRAME_SIZE),
+        CompressionProfile("balanced", "zlib and flac", codecs=["cdzl", "cdfl"], hunk_size=8 * CD_FRAME_SIZE),
+        CompressionProfile("archive", "Maximum lzma/flac ratio, for long term storage", codecs=["cdlz", "cdzl", "cdfl"], hunk_size=16 * CD_FRAME_SIZE),
+        CompressionProfile("store", "No compression", codecs=["none"]),
+    )
+}
+# Used for the CHD that two-step conversions create and delete again, where speed is all that matters
+INTERMEDIARY_PROFILE = PROFILES["fast"]
+
+
+def get_profile(name):
+    if isinstance(name, CompressionProfile):
+        return name
+    return PROFILES[name or DEFAULT_PROFILE]
+
+
+def copy_prefix(source, destination, length):
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        remaining = length
+        while remaining > 0:
+            chunk = source_file.read(min(remaining, 8 * 1024 * 1024))
+            if not chunk:
+                break
+            destination_file.write(chunk)
+            remaining -= len(chunk)
+
+
+def write_sample_image(input_file, directory, sample_bytes=AUTOTUNE_SAMPLE_BYTES):
+    """Write a small disc image made of the first sample_bytes of input_file's first data track.
+
+    Returns the path of the sample, an ISO or a single-track CUE sheet that createcd accepts,
+    or None when input_file can not be sampled.
+    """
+    directory = Path(directory)
+    try:
+        if input_file.suffix == ISO:
+            sample = directory / "sample.iso"
+            copy_prefix(input_file, sample, sample_bytes - sample_bytes % ISO_SECTOR_SIZE)
+            return sample
+
+        if input_file.suffix == CUE:
+            track_file = parse_cue(input_file).files[0]
+            track_path, mode, sector_size = track_file.path, track_file.tracks[0].mode, track_file.tracks[0].sector_size
+        elif input_file.suffix == GDI:
+            gdi_tracks = parse_gdi(input_file).tracks
+            track = max(gdi_tracks, key=lambda gdi_track: gdi_track.path.stat().st_size if gdi_track.is_data else -1)
+            track_path, sector_size = track.path, track.sector_size
+            mode = "MODE1/2352" if sector_size == 2352 else "MODE1/2048"
+        else:
+            return None
+    except (SheetParseError, IndexError, OSError):
+        return None
+
+    sample_bin = directory / "sample.bin"
+    copy_prefix(track_path, sample_bin, sample_bytes - sample_bytes % sector_size)
+    sample = directory / "sample.cue"
+    sample.write_text(f'FILE "{sample_bin.name}" BINARY\n  TRACK 01 {mode}\n    INDEX 01 00:00:00\n')
+    return sample
+
+
+def pick_profile(measurements, min_mb_per_second=None):
+    """Choose from (profile, ratio, mb_per_second) measurements.
+
+    Returns the best ratio among the profiles at least min_mb_per_second fast, or the fastest
+    profile when none of them is.
+    """
+    fast_enough = [m for m in measurements if min_mb_per_second is None or m[2] >= min_mb_per_second]
+    if fast_enough:
+        return min(fast_enough, key=lambda m: m[1])[0]
+    return max(measurements, key=lambda m: m[2])[0]
@@ -0,0 +1,137 @@
+# Persistent index of the disc images found under a library directory
+import os
+import sqlite3
+import hashlib
+from pathlib import Path
+from constants import INPUT_FORMATS, CACHE_DIRECTORY
+
+INDEX_FILENAME = ".easychd-index.sqlite"
+# Bumped whenever the indexed formats change, so that older indexes are rebuilt instead of missing files
+INDEX_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+"""
+
+
+class ScannedFile:
+    def __init__(self, path, size, mtime_ns, file_format):
+        self.path = Path(path)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.format = file_format
+
+
+class ScanIndex:
+    """SQLite index of every convertible file below root.
+
+    Only directories whose mtime changed since the previous scan are listed again with os.scandir,
+    the contents of every other directory are served from the index. The index is kept beside the
+    library, or in the user cache directory when the library is read only.
+    """
+    def __init__(self, root, index_path=None):
+        self.root = Path(root)
+        self.index_path = Path(index_path) if index_path is not None else self.__default_index_path()
+
+    def __default_index_path(self):
+        if os.access(self.root, os.W_OK):
+            return self.root / INDEX_FILENAME
+        root_hash = hashlib.sha1(str(self.root.resolve()).encode()).hexdigest()
+        CACHE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+        return CACHE_DIRECTORY / f"index-{root_hash}.sqlite"
+
+    def scan(self):
+        """Bring the index up to date and return a ScannedFile for every convertible file below root."""
+        connection = sqlite3.connect(self.index_path)
+        try:
+            connection.executescript(SCHEMA)
+            if connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                with connection:
+                    connection.execute("DELETE FROM directories")
+                    connection.execute("DELETE FROM files")
+                connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            known_mtimes = {}
+            known_children = {}
+            for path, parent, mtime_ns in connection.execute("SELECT path, parent, mtime_ns FROM directories"):
+                known_mtimes[path] = mtime_ns
+                known_children.setdefault(parent, []).append(path)
+
+            with connection:
+                pending = [(self.root.as_posix(), None)]
+                while pending:
+                    directory, parent = pending.pop()
+                    subdirectories = self.__refresh_directory(connection, directory, parent, known_mtimes, known_children)
+                    pending.extend((subdirectory, directory) for subdirectory in subdirectories)
+
+            return [
+                ScannedFile(path, size, mtime_ns, file_format)
+                for path, size, mtime_ns, file_format in connection.execute(
+                    "SELECT path, size, mtime_ns, format FROM files WHERE path >= ? AND path < ?",
+                    subtree_bounds(self.root.as_posix())
+                )
+            ]
+        finally:
+            connection.close()
+
+    def __refresh_directory(self, connection, directory, parent, known_mtimes, known_children):
+        """Update the index for one directory and return its subdirectories."""
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.__forget_directory(connection, directory)
+            return []
+
+        if known_mtimes.get(directory) == mtime_ns:
+            return known_children.get(directory, [])
+
+        subdirectories = []
+        files = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(Path(entry.path).as_posix())
+                        elif entry.is_file():
+                            file_format = os.path.splitext(entry.name)[1].lower()
+                            if file_format in INPUT_FORMATS:
+                                stat = entry.stat()
+                                files.append((Path(entry.path).as_posix(), directory, stat.st_size, stat.st_mtime_ns, file_format))
+                    except OSError:
+                        continue
+        except OSError:
+            self.__forget_directory(connection, directory)
+            return []
+
+        for removed in set(known_children.get(directory, [])).difference(subdirectories):
+            self.__forget_directory(connection, removed)
+
+        connection.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", files)
+        connection.execute("INSERT OR REPLACE INTO directories VALUES (?, ?, ?)", (directory, parent, mtime_ns))
+        return subdirectories
+
+    def __forget_directory(self, connection, directory):
+        lower, upper = subtree_bounds(directory)
+        connection.execute("DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)", (directory, lower, upper))
+        connection.execute("DELETE FROM files WHERE path >= ? AND path < ?", (lower, upper))
+
+
+def subtree_bounds(directory):
+    """Range of posix paths strictly below directory, usable in an indexed comparison.
+    '0' is the character right after '/', so every descendant sorts between the two bounds."""
+    directory = directory.rstrip("/")
+    return directory + "/", directory + "0"
@@ -0,0 +1,191 @@
+# Orders batch jobs and limits how many of them run against the same disk at once
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sheets import input_bytes
+from diskspace import free_bytes, existing_parent, RESERVED_FREE_BYTES
+from exceptions import InsufficientDiskSpaceError
+
+
+def device_of(path):
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def job_bytes(job):
+    """Bytes a job reads from its source, 0 when the source is gone."""
+    try:
+        return input_bytes(job.input_file)
+    except OSError:
+        return 0
+
+
+class DeviceScheduler:
+    """Hands out jobs by priority, then largest first, while keeping at most jobs_per_device jobs on any device.
+
+    Jobs need an input_file and may have an output_directory. A job uses the device its source is on
+    and the device of its output directory, which are
+    the same device when converting in place. Starting the biggest jobs first keeps one long job
+    from running alone at the end of a batch. Priorities are read again each time a job is handed out,
+    so changing the priority of a pending job reorders it.
+    jobs_per_device: None for no limit.
+    space_estimator: Optional SpaceEstimator. A job is then held back while the disk of its output
+    directory lacks the room it is estimated to need on top of what the running jobs there may still write,
+    and what reserve_ahead() set aside for pending jobs.
+    """
+    def __init__(self, jobs, jobs_per_device=None, space_estimator=None):
+        if jobs_per_device is not None and jobs_per_device < 1:
+            raise ValueError(f"jobs_per_device must be at least 1, got {jobs_per_device}")
+        self.jobs_per_device = jobs_per_device
+        self.space_estimator = space_estimator
+        self.sizes = {}
+        self.devices = {}
+        for job in jobs:
+            self.sizes[job] = job_bytes(job)
+            paths = (job.input_file, getattr(job, "output_directory", None))
+            self.devices[job] = {device_of(path) for path in paths if path is not None} - {None}
+        self.pending = list(jobs)
+        self.running_per_device = {}
+        self.reserved = {}  # Estimated bytes of the running jobs, by job
+        self.reserved_ahead = {}  # Bytes pending jobs already write before they start, by job
+        self.reserved_lock = threading.Lock()  # reserve_ahead() may be called from other threads
+        self.output_devices = {}
+
+    def __output_device(self, job):
+        if job not in self.output_devices:
+            output_directory = getattr(job, "output_directory", None)
+            self.output_devices[job] = None if output_directory is None else device_of(existing_parent(output_directory))
+        return self.output_devices[job]
+
+    def __space_shortage(self, job, needed=None):
+        """(needed, free) bytes when job does not fit on its output disk right now, None when it does.
+
+        needed: Bytes to check for, the estimate of job less what was reserved ahead for it when None.
+        """
+        if self.space_estimator is None or getattr(job, "output_directory", None) is None:
+            return None
+        device = self.__output_device(job)
+        with self.reserved_lock:
+            if needed is None:
+                needed = self.space_estimator.estimate(job) - self.reserved_ahead.get(job, 0)
+            reservations = list(self.reserved.items()) + list(self.reserved_ahead.items())
+        try:
+            free = free_bytes(job.output_directory) - RESERVED_FREE_BYTES
+        except OSError:
+            return None
+        # Running jobs have only written part of what they will, count all of it as taken
+        free -= sum(reserved for other, reserved in reservations if other is not job and self.__output_device(other) == device)
+        return None if needed <= free else (needed, max(0, free))
+
+    def reserve_ahead(self, job, size):
+        """Set size bytes aside on the output disk of the pending job, e.g. to extract its input before it starts.
+
+        Returns False, reserving nothing, when they do not fit. Safe to call from any thread.
+        """
+        if self.__space_shortage(job, size) is not None:
+            return False
+        with self.reserved_lock:
+            self.reserved_ahead[job] = self.reserved_ahead.get(job, 0) + size
+        return True
+
+    def has_pending(self):
+        return bool(self.pending)
+
+    def __has_capacity(self, job):
+        if self.jobs_per_device is None:
+            return True
+        return all(self.running_per_device.get(device, 0) < self.jobs_per_device for device in self.devices[job])
+
+    def __order(self, job):
+        return -getattr(job, "priority", 0), -self.sizes[job]
+
+    def next_job(self):
+        """Take the first pending job whose devices have room, or None when all of them are busy or full."""
+        # Nearly sorted already unless priorities changed, which sort() handles in linear time
+        self.pending.sort(key=self.__order)
+        for index, job in enumerate(self.pending):
+            if self.__has_capacity(job) and self.__space_shortage(job) is None:
+                del self.pending[index]
+                for device in self.devices[job]:
+                    self.running_per_device[device] = self.running_per_device.get(device, 0) + 1
+                if self.space_estimator is not None:
+                    with self.reserved_lock:
+                        # The estimate covers what was written ahead
+                        self.reserved[job] = self.space_estimator.estimate(job)
+                        self.reserved_ahead.pop(job, None)
+                return job
+        return None
+
+    def peek(self):
+        """The pending job most likely to be handed out next, None when none is left."""
+        self.pending.sort(key=self.__order)
+        return self.pending[0] if self.pending else None
+
+    def reject_next(self):
+        """Take the first pending job off the queue with the InsufficientDiskSpaceError it fails with.
+
+        Only meant for when nothing runs, so no job will free any space for the pending ones.
+        """
+        self.pending.sort(key=self.__order)
+        for index, job in enumerate(self.pending):
+            shortage = self.__space_shortage(job)
+            if shortage is not None:
+                del self.pending[index]
+                with self.reserved_lock:
+                    self.reserved_ahead.pop(job, None)
+                needed, free = shortage
+                return job, InsufficientDiskSpaceError(
+                    f"{job.input_file.name}: about {needed / 1e6:.1f} MB needed on the output disk, {free / 1e6:.1f} MB free"
+                )
+        return None, None
+
+    def release(self, job):
+        for device in self.devices[job]:
+            self.running_per_device[device] -= 1
+        with self.reserved_lock:
+            self.reserved.pop(job, None)
+
+
+def run_scheduled(jobs, run_job, workers, jobs_per_device=None, on_finished=None, space_estimator=None, prefetch=None):
+    """Call run_job(job) for every job on up to workers threads, in DeviceScheduler order.
+
+    on_finished(job, result, error) is called on the calling thread as each job ends, error being
+    the exception run_job raised or None. With a space_estimator, jobs wait for running ones to free
+    disk space; a job that does not fit even once nothing else runs fails with InsufficientDiskSpaceError.
+    prefetch(job, reserve) is called on the calling thread with the job that will likely start next, so
+    its input can be made ready while the running ones work. reserve(size) sets size bytes aside on the
+    job's output disk before anything is written there, see DeviceScheduler.reserve_ahead.
+    """
+    scheduler = DeviceScheduler(jobs, jobs_per_device, space_estimator)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while scheduler.has_pending() or running:
+            while len(running) < workers:
+                job = scheduler.next_job()
+                if job is None:
+                    break
+                running[executor.submit(run_job, job)] = job
+
+            if prefetch is not None and scheduler.has_pending():
+                upcoming = scheduler.peek()
+                prefetch(upcoming, lambda size: scheduler.reserve_ahead(upcoming, size))
+
+            if not running:
+                # Waiting would not free anything
+                job, error = scheduler.reject_next()
+                if on_finished is not None and job is not None:
+                    on_finished(job, None, error)
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                scheduler.release(job)
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, e
+                if on_finished is not None:
+                    on_finished(job, result, error)
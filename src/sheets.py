@@ -0,0 +1,321 @@
+# Parsers for the sheet files (CUE and GDI) that describe multi-file disc images
+import os
+import posixpath
+import shlex
+import zipfile
+from pathlib import Path, PurePosixPath
+from exceptions import SheetParseError, MissingTrackFileError, ChdFormatError, UnsupportedChdVersionError, ArchiveError
+from constants import CUE, GDI, CHD, ISO, ZIP
+from chdinfo import read_chd_info
+
+SECTOR_SIZES = {
+    "AUDIO": 2352,
+    "CDG": 2448,
+    "MODE1/2048": 2048,
+    "MODE1/2352": 2352,
+    "MODE2/2336": 2336,
+    "MODE2/2352": 2352,
+    "CDI/2336": 2336,
+    "CDI/2352": 2352,
+}
+# Offset of the 2048 bytes of user data inside a sector, for the track modes that carry it
+ISO_USER_DATA_OFFSETS = {
+    "MODE1/2048": 0,
+    "MODE1/2352": 16,   # 12 sync + 4 header bytes
+    "MODE2/2336": 8,    # XA form 1 subheader
+    "MODE2/2352": 24,   # 12 sync + 4 header + 8 subheader bytes
+}
+ISO_SECTOR_SIZE = 2048
+FRAMES_PER_SECOND = 75
+
+
+class CueTrack:
+    def __init__(self, number, mode):
+        self.number = number
+        self.mode = mode
+        self.sector_size = SECTOR_SIZES[mode]
+        self.indexes = {}  # index number -> offset in frames from the start of the track file
+
+    @property
+    def start_frame(self):
+        return self.indexes.get(1, self.indexes.get(0, 0))
+
+
+class CueFile:
+    def __init__(self, path, file_type):
+        self.path = path
+        self.file_type = file_type
+        self.tracks = []
+
+
+class CueSheet:
+    def __init__(self, path, files):
+        self.path = path
+        self.files = files
+
+    @property
+    def tracks(self):
+        return [track for cue_file in self.files for track in cue_file.tracks]
+
+    def is_single_data_track(self):
+        """True when the sheet is one data track in one file that holds ISO user data,
+        i.e. it can be turned into an ISO by stripping sector headers alone."""
+        return (
+            len(self.files) == 1
+            and len(self.files[0].tracks) == 1
+            and self.files[0].file_type == "BINARY"
+            and self.files[0].tracks[0].mode in ISO_USER_DATA_OFFSETS
+        )
+
+
+def parse_msf(value):
+    """Convert a mm:ss:ff timestamp into a number of frames."""
+    try:
+        minutes, seconds, frames = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise SheetParseError(f"Invalid timestamp {value}")
+    return (minutes * 60 + seconds) * FRAMES_PER_SECOND + frames
+
+
+def parse_cue(cue_path, text=None):
+    """text: Contents of the sheet when already read, e.g. from an archive."""
+    cue_path = Path(cue_path)
+    files = []
+    current_track = None
+    if text is None:
+        text = cue_path.read_text(encoding="utf-8-sig", errors="replace")
+
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        try:
+            tokens = shlex.split(line, posix=True)
+        except ValueError:
+            raise SheetParseError(f"{cue_path.name}:{line_number}: unbalanced quotes")
+        if not tokens:
+            continue
+
+        command = tokens[0].upper()
+        if command == "FILE":
+            if len(tokens) < 3:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: FILE needs a name and a type")
+            files.append(CueFile(cue_path.parent / tokens[1], tokens[2].upper()))
+            current_track = None
+        elif command == "TRACK":
+            if not files or len(tokens) < 3:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: TRACK outside of a FILE")
+            mode = tokens[2].upper()
+            if mode not in SECTOR_SIZES:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: unknown track mode {mode}")
+            try:
+                number = int(tokens[1])
+            except ValueError:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: invalid track number {tokens[1]}")
+            current_track = CueTrack(number, mode)
+            files[-1].tracks.append(current_track)
+        elif command == "INDEX":
+            if current_track is None or len(tokens) < 3:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: INDEX outside of a TRACK")
+            try:
+                index = int(tokens[1])
+            except ValueError:
+                raise SheetParseError(f"{cue_path.name}:{line_number}: invalid index number {tokens[1]}")
+            current_track.indexes[index] = parse_msf(tokens[2])
+
+    if not files:
+        raise SheetParseError(f"{cue_path.name}: no FILE entries")
+    return CueSheet(cue_path, files)
+
+
+class GdiTrack:
+    def __init__(self, number, start_lba, track_type, sector_size, path, offset):
+        self.number = number
+        self.start_lba = start_lba
+        self.track_type = track_type  # 4 for data, 0 for audio
+        self.sector_size = sector_size
+        self.path = path
+        self.offset = offset
+
+    @property
+    def is_data(self):
+        return self.track_type == 4
+
+
+class GdiSheet:
+    def __init__(self, path, tracks):
+        self.path = path
+        self.tracks = tracks
+
+
+def parse_gdi(gdi_path, text=None):
+    """Parse a GDI sheet: a track count line, then one "number lba type sector_size file offset" line per track."""
+    gdi_path = Path(gdi_path)
+    if text is None:
+        text = gdi_path.read_text(encoding="utf-8-sig", errors="replace")
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        raise SheetParseError(f"{gdi_path.name}: empty sheet")
+    try:
+        track_count = int(lines[0].split()[0])
+    except ValueError:
+        raise SheetParseError(f"{gdi_path.name}:1: invalid track count")
+
+    tracks = []
+    for line_number, line in enumerate(lines[1:], start=2):
+        try:
+            tokens = shlex.split(line, posix=True)
+        except ValueError:
+            raise SheetParseError(f"{gdi_path.name}:{line_number}: unbalanced quotes")
+        if len(tokens) < 6:
+            raise SheetParseError(f"{gdi_path.name}:{line_number}: expected 6 fields")
+        try:
+            number, start_lba, track_type, sector_size = (int(token) for token in tokens[:4])
+            offset = int(tokens[-1])
+        except ValueError:
+            raise SheetParseError(f"{gdi_path.name}:{line_number}: invalid number")
+        # Unquoted names with spaces end up split over several tokens
+        tracks.append(GdiTrack(number, start_lba, track_type, sector_size, gdi_path.parent / " ".join(tokens[4:-1]), offset))
+
+    if len(tracks) != track_count:
+        raise SheetParseError(f"{gdi_path.name}: declares {track_count} tracks but lists {len(tracks)}")
+    return GdiSheet(gdi_path, tracks)
+
+
+class SheetCheck:
+    """What preflight() found out about a disc image: the track files it is made of and their total size.
+
+    error is the SheetParseError, MissingTrackFileError or ChdFormatError that would make a conversion fail,
+    None when the image looks convertible. chd_info is the ChdInfo of a readable CHD, archive_image the
+    ArchiveImage of a ZIP archive, whose total_bytes is what its image weighs once extracted.
+    """
+    def __init__(self, input_file, track_files, total_bytes, error=None, chd_info=None, archive_image=None):
+        self.input_file = input_file
+        self.track_files = track_files
+        self.total_bytes = total_bytes
+        self.error = error
+        self.chd_info = chd_info
+        self.archive_image = archive_image
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def track_files(sheet_path, text=None):
+    """Every file a CUE or GDI sheet refers to, in sheet order and without duplicates."""
+    if sheet_path.suffix.lower() == CUE:
+        paths = [cue_file.path for cue_file in parse_cue(sheet_path, text).files]
+    else:
+        paths = [track.path for track in parse_gdi(sheet_path, text).tracks]
+    return list(dict.fromkeys(Path(os.path.normpath(path)) for path in paths))
+
+
+# Formats a ZIP archive may hold a disc image in, sheets first since their track files are images too
+ARCHIVE_IMAGE_FORMATS = (CUE, GDI, ISO, CHD)
+
+
+class ArchiveImage:
+    """The disc image inside a ZIP archive: the member to convert and every member it is made of."""
+    def __init__(self, archive, image, members, total_bytes):
+        self.archive = archive
+        self.image = image  # Member name, a posix path relative to the root of the archive
+        self.members = members
+        self.total_bytes = total_bytes
+
+
+def inspect_archive(archive):
+    """Find the disc image inside a ZIP archive from its central directory and sheet, extracting nothing.
+
+    Raises ArchiveError when the archive holds no image, several of them or a member that would
+    land outside the extraction directory, and the errors of a sheet as preflight() reports them.
+    """
+    archive = Path(archive)
+    with zipfile.ZipFile(archive) as zip_file:
+        infos = {info.filename: info for info in zip_file.infolist() if not info.is_dir()}
+        for name in infos:
+            if posixpath.isabs(name) or ".." in PurePosixPath(name).parts:
+                raise ArchiveError(f"{archive.name}: unsafe member path {name}")
+
+        for image_format in ARCHIVE_IMAGE_FORMATS:
+            images = sorted(name for name in infos if PurePosixPath(name).suffix.lower() == image_format)
+            if images:
+                break
+        else:
+            raise ArchiveError(f"{archive.name}: no disc image inside")
+        if len(images) > 1:
+            raise ArchiveError(f"{archive.name}: holds {len(images)} disc images, only one per archive can be converted")
+
+        image = images[0]
+        members = [image]
+        if image_format in (CUE, GDI):
+            text = zip_file.read(image).decode("utf-8-sig", errors="replace")
+            referenced = [path.as_posix() for path in track_files(Path(image), text)]
+            missing = [PurePosixPath(name).name for name in referenced if name not in infos]
+            if missing:
+                raise MissingTrackFileError(f"Missing track file(s) in {archive.name}: {', '.join(missing)}")
+            members.extend(referenced)
+    return ArchiveImage(archive, image, members, sum(infos[name].file_size for name in members))
+
+
+def preflight(input_file, size=None):
+    """Check that a disc image can be handed to chdman without reading more than its sheet.
+
+    Sheets are parsed and every track file they refer to is looked up, so a missing or misnamed
+    BIN is reported before any process is spawned. The header of a CHD is read the same way.
+    size: Size of input_file when already known.
+    """
+    input_file = Path(input_file)
+    if size is None:
+        size = input_file.stat().st_size
+    if input_file.suffix == CHD:
+        try:
+            return SheetCheck(input_file, [], size, chd_info=read_chd_info(input_file))
+        except UnsupportedChdVersionError:
+            return SheetCheck(input_file, [], size)
+        except (ChdFormatError, OSError) as e:
+            return SheetCheck(input_file, [], size, e if isinstance(e, ChdFormatError) else ChdFormatError(str(e)))
+    if input_file.suffix == ZIP:
+        try:
+            archive_image = inspect_archive(input_file)
+        except (SheetParseError, MissingTrackFileError, ArchiveError) as e:
+            return SheetCheck(input_file, [], size, e)
+        except (zipfile.BadZipFile, OSError) as e:
+            return SheetCheck(input_file, [], size, ArchiveError(f"{input_file.name}: {e}"))
+        return SheetCheck(input_file, [], archive_image.total_bytes, archive_image=archive_image)
+    if input_file.suffix not in (CUE, GDI):
+        return SheetCheck(input_file, [], size)
+
+    try:
+        files = track_files(input_file)
+    except (SheetParseError, OSError) as e:
+        return SheetCheck(input_file, [], size, e if isinstance(e, SheetParseError) else SheetParseError(str(e)))
+
+    total_bytes = size
+    missing = []
+    for track_file in files:
+        try:
+            total_bytes += track_file.stat().st_size
+        except OSError:
+            missing.append(track_file.name)
+    error = MissingTrackFileError(f"Missing track file(s): {', '.join(missing)}") if missing else None
+    return SheetCheck(input_file, files, total_bytes, error)
+
+
+def preflight_library(scanned_files):
+    """Preflight every ScannedFile of a library scan.
+
+    Files that a sheet refers to, e.g. an ISO used as the data track of a CUE, are converted as part of
+    that sheet and left out of the result.
+    """
+    checks = [preflight(scanned_file.path, scanned_file.size) for scanned_file in scanned_files]
+    referenced = {track_file for check in checks for track_file in check.track_files}
+    return [check for check in checks if check.input_file not in referenced]
+
+
+def source_files(input_file):
+    """The input file followed by every existing track file a CUE or GDI sheet refers to."""
+    check = preflight(input_file)
+    return [input_file] + [track_file for track_file in check.track_files if track_file.is_file()]
+
+
+def input_bytes(input_file):
+    """Total size of a disc image, including the track files a CUE or GDI sheet refers to."""
+    return preflight(input_file).total_bytes
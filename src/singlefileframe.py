@@ -2,19 +2,28 @@ from tkinter.filedialog import askopenfilename
 import customtkinter
 from pathlib import Path
 import threading
-from exceptions import ProgressBarException, SameFileExtensionError, FileFormatNotSupportedError
+from tools import format_eta, CancelToken
+from uiqueue import UIUpdateQueue
+from profiles import PROFILES, DEFAULT_PROFILE, AUTO_PROFILE
+from exceptions import ProgressBarException, SameFileExtensionError, FileFormatNotSupportedError, ConversionCancelledError, \
+    ConversionTimeoutError, OutputFileAlreadyExists, SheetParseError, MissingTrackFileError, ArchiveError, ChdFormatError
+from verifier import BulkVerifier
 
 VALID_FILE_TYPES = ['.chd', '.cue', '.gdi', '.iso']
 NO_FILE_TEXT = "No file selected"
+CHDMAN_MISSING_TEXT = "chdman was not found, install it to convert files"
 
 
 
 class SingleFileFrame(customtkinter.CTkFrame):
-    def __init__(self, master, converter, **kwargs):
+    def __init__(self, master, converter, ui_queue=None, **kwargs):
         super().__init__(master, **kwargs)
 
         self.converter = converter
+        self.active_task = None  # CancelToken or BulkVerifier of the running conversion or verification
+        self.ui_queue = ui_queue if ui_queue is not None else UIUpdateQueue(self)
         self.selected_file = customtkinter.StringVar(master=self, value=NO_FILE_TEXT)
+        self.profile = customtkinter.StringVar(master=self, value=DEFAULT_PROFILE)
         self.output_format = customtkinter.StringVar(master=self, value='.chd')
         self.LABEL_FONT = customtkinter.CTkFont(size=15)
         self.RESULT_FONT = customtkinter.CTkFont(size=15, slant="italic")
@@ -38,7 +47,9 @@ class SingleFileFrame(customtkinter.CTkFrame):
         
         # Convert widgets
         self.convert_button = customtkinter.CTkButton(self, text="Convert File", state="disabled", command=self.convert_file)
-        self.progressbar = customtkinter.CTkProgressBar(master=self, mode="indeterminate")
+        self.verify_button = customtkinter.CTkButton(self, text="Verify CHD", state="disabled", command=self.verify_file)
+        self.cancel_button = customtkinter.CTkButton(self, text="Cancel", state="disabled", command=self.cancel)
+        self.progressbar = customtkinter.CTkProgressBar(master=self, mode="determinate")
         self.progressbar_text = customtkinter.StringVar(value="")
         self.progressbar_label = customtkinter.CTkLabel(master=self, textvariable=self.progressbar_text, anchor="center")
 
@@ -55,24 +66,50 @@ class SingleFileFrame(customtkinter.CTkFrame):
             variable=self.output_format 
         )
 
+        # Compression profile
+        self.profile_label = customtkinter.CTkLabel(
+            master=self,
+            text="Compression profile:",
+            font=self.LABEL_FONT
+        )
+        self.profile_selector = customtkinter.CTkOptionMenu(
+            master=self,
+            dynamic_resizing=False,
+            values=list(PROFILES) + [AUTO_PROFILE],
+            variable=self.profile
+        )
+
         # Layout
         self.file_info_label.grid(row=0, column=0, sticky="e", padx=20, pady=10)
         self.file_browse_button.grid(row=0, column=1, padx=(10, 20), pady=10, sticky="w")
         self.file_label.grid(row=10, column=0, columnspan=2, padx=20, pady=10)
         self.conversion_output_format_label.grid(row=20, column=0, padx=(20, 10), pady=10, sticky="e")
         self.conversion_output_format_selector.grid(row=20, column=1, padx=(10, 20), pady=10,sticky="w")
-        self.convert_button.grid(row=30, column=0, columnspan=2, padx=(20, 20), pady=10)
+        self.profile_label.grid(row=21, column=0, padx=(20, 10), pady=10, sticky="e")
+        self.profile_selector.grid(row=21, column=1, padx=(10, 20), pady=10, sticky="w")
+        self.convert_button.grid(row=30, column=0, padx=(20, 10), pady=10, sticky="e")
+        self.verify_button.grid(row=30, column=1, padx=(10, 20), pady=10, sticky="w")
         self.progressbar.grid(row=31, column=0, columnspan=2, padx=20, pady=(10, 0), sticky="ew")
         self.progressbar.grid_forget()  # initially hide the progress bar
         self.progressbar_label.grid(row=32, column=0, columnspan=2, padx=20, pady=10)
+        self.cancel_button.grid(row=33, column=0, columnspan=2, padx=20, pady=(0, 10))
+
+    def set_converter(self, converter):
+        self.converter = converter
+        if converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
 
     def toggle_ui_state(self, ui_state="enabled"):
         """Enables or disables clickable widgets to prevent strange app behavior during various processes
         ui_state: By default, set to "enabled" to activate widgets, "disabled" to deactivtate the widgets.
         """
         self.convert_button.configure(state=ui_state, text="Convert Files")
+        self.verify_button.configure(state=ui_state)
+        # Cancel is only usable while everything else is disabled
+        self.cancel_button.configure(state="disabled" if ui_state == "enabled" else "normal", text="Cancel")
         self.file_browse_button.configure(state=ui_state)
         self.conversion_output_format_selector.configure(state=ui_state)
+        self.profile_selector.configure(state=ui_state)
 
     def interact_with_progressbar(self, state="start"):
         valid_state_inputs = ["start", "stop"]
@@ -87,31 +124,68 @@ class SingleFileFrame(customtkinter.CTkFrame):
         else:
             self.progressbar.configure(progress_color="mediumorchid")
             self.progressbar_text.set("Checking file for conversion...")
+            self.progressbar.set(0)
             self.progressbar.grid(row=31, column=0, columnspan=2, padx=20, pady=(10, 0), sticky="ew")
-            self.progressbar.start()
+
+    def show_progress(self, progress):
+        self.progressbar.set(progress.percent / 100)
+        self.progressbar_text.set(
+            f"{progress.stage} file... {progress.percent:.1f}% - {progress.mb_per_second:.1f} MB/s - ETA {format_eta(progress.eta_seconds)}"
+        )
+
+    def cancel(self):
+        """Stop the running conversion or verification, killing chdman and removing partial outputs."""
+        if self.active_task is not None:
+            self.active_task.cancel()
+            self.cancel_button.configure(state="disabled", text="Cancelling...")
+
+    def finish_conversion(self, result_text):
+        self.active_task = None
+        self.toggle_ui_state()
+        self.interact_with_progressbar(state="stop")
+        self.progressbar_text.set(result_text)
 
     def get_file(self):
         new_dir = askopenfilename()
         if new_dir != "":
             self.selected_file.set(new_dir)
             self.convert_button.configure(state="enabled")
+            self.verify_button.configure(state="enabled")
         self.file_browse_button.focus_set()
 
     def convert_file(self):
         """Convert selected files from checkboxes into desired format."""
+        if self.converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
+            return
         # Update UI
         self.toggle_ui_state("disabled")
         self.interact_with_progressbar(state="start")
         
+        # Read the widgets here, the worker thread must not touch Tk
+        input_file = Path(self.selected_file.get())
+        output_format = self.output_format.get()
+        profile = self.profile.get()
+        cancel_token = CancelToken()
+        self.active_task = cancel_token
+
         def run_conversion():
-            output_format = self.output_format.get()
-            
+            ui_queue = self.ui_queue
+            result_text = f"Conversion Failed"
+            chosen_profile = profile
             try:
-                self.progressbar_text.set(f"Converting file...")
+                if chosen_profile == AUTO_PROFILE:
+                    ui_queue.call(self.progressbar_text.set, f"Testing compression profiles...")
+                    chosen_profile, _ = self.converter.autotune_profile(input_file)
+
+                ui_queue.call(self.progressbar_text.set, f"Converting file...")
                 results = self.converter.convert_file(
-                    input_file=Path(self.selected_file.get()),
-                    output_directory=Path(self.selected_file.get()).parent,
-                    output_format=output_format
+                    input_file=input_file,
+                    output_directory=input_file.parent,
+                    output_format=output_format,
+                    on_progress=lambda progress: ui_queue.post((self, "progress"), self.show_progress, progress),
+                    profile=chosen_profile,
+                    cancel_token=cancel_token
                 )
                 
                 if results[0]:
@@ -119,15 +193,58 @@ class SingleFileFrame(customtkinter.CTkFrame):
                 else:
                     
                     result_text = f"Conversion Failed"
+            except ConversionCancelledError:
+                result_text = f"Conversion Cancelled"
             except (SameFileExtensionError, FileFormatNotSupportedError) as e:
                 if type(e) is SameFileExtensionError:
                     result_text = f"Conversion Failed - File already has type of {output_format}"
                 else:
                     result_text = f"Conversion Failed - Selected file can not be converted"
+            except ConversionTimeoutError:
+                result_text = f"Conversion Failed - Timed out"
+            except OutputFileAlreadyExists:
+                result_text = f"Conversion Failed - Output file already exists"
+            except (SheetParseError, MissingTrackFileError) as e:
+                result_text = f"Conversion Failed - Broken sheet - {e}"
+            except ArchiveError as e:
+                result_text = f"Conversion Failed - Broken archive - {e}"
+            except ChdFormatError as e:
+                result_text = f"Conversion Failed - Broken CHD - {e}"
             finally:
-                self.toggle_ui_state()
-                self.interact_with_progressbar(state="stop")
-                self.progressbar_text.set(result_text)
+                ui_queue.call(self.finish_conversion, result_text)
         
         # Begin the conversion in a different thread
         threading.Thread(target=run_conversion, daemon=True).start()
+
+    def verify_file(self):
+        """Check the selected CHD with chdman verify, unless it was verified before and is unchanged."""
+        if self.converter is None:
+            self.progressbar_text.set(CHDMAN_MISSING_TEXT)
+            return
+        input_file = Path(self.selected_file.get())
+        self.toggle_ui_state("disabled")
+        self.interact_with_progressbar(state="start")
+        self.progressbar_text.set("Verifying file...")
+        verifier = BulkVerifier(self.converter)
+        self.active_task = verifier
+
+        def run_verification():
+            ui_queue = self.ui_queue
+            result_text = "Verification Failed"
+            try:
+                result = verifier.verify_files(
+                    [input_file],
+                    on_progress=lambda _path, progress: ui_queue.post((self, "progress"), self.show_progress, progress)
+                )[input_file]
+                if verifier.cancel_token.cancelled:
+                    result_text = "Verification Cancelled"
+                elif result.ok:
+                    result_text = "Verification Passed (cached)" if result.cached else "Verification Passed"
+                elif input_file.suffix != ".chd":
+                    result_text = "Verification Failed - Only CHD files can be verified"
+                else:
+                    result_text = f"Verification Failed - {result.message}"
+            finally:
+                ui_queue.call(self.finish_conversion, result_text)
+
+        threading.Thread(target=run_verification, daemon=True).start()
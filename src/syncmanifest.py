@@ -0,0 +1,92 @@
+# Records which source every output was converted from, so unchanged sources can be skipped
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from sheets import source_files
+
+SYNC_MANIFEST_FILENAME = ".easychd-sync.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def source_fingerprint(input_file):
+    """Total size and newest mtime of a disc image and the track files it refers to."""
+    stats = [f.stat() for f in source_files(input_file)]
+    return sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)
+
+
+def source_hash(input_file):
+    digest = hashlib.sha1()
+    for f in source_files(input_file):
+        with open(f, "rb") as source:
+            while chunk := source.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SyncManifest:
+    """Small JSON manifest kept in an output directory.
+
+    Every output converted in sync mode gets an entry with the size and mtime of its sources and of
+    the output itself, plus optionally a content hash of the sources. An output is up to date when
+    it still matches its entry and the sources still match too, either by size and mtime or,
+    when hashing is enabled, by content.
+    Outputs with no entry, like ones converted before sync mode existed, are up to date when they
+    are newer than their sources, in the same way as make.
+    """
+    def __init__(self, output_directory):
+        self.path = Path(output_directory) / SYNC_MANIFEST_FILENAME
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as manifest:
+                self.entries = json.load(manifest)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_up_to_date(self, job, use_hash=False):
+        if job.input_file.suffix == job.output_format:
+            return False
+        try:
+            output_stat = job.output_file.stat()
+            size, mtime_ns = source_fingerprint(job.input_file)
+        except OSError:
+            return False
+
+        entry = self.entries.get(job.output_file.name)
+        if entry is None or entry["source"] != str(job.input_file):
+            return output_stat.st_size > 0 and output_stat.st_mtime_ns >= mtime_ns
+        if entry["output_size"] != output_stat.st_size or entry["output_mtime_ns"] != output_stat.st_mtime_ns:
+            return False
+        if entry["source_size"] == size and entry["source_mtime_ns"] == mtime_ns:
+            return True
+        if use_hash and entry.get("source_hash") and entry["source_size"] == size:
+            # Touched or copied but possibly unchanged, only the content can tell
+            if source_hash(job.input_file) == entry["source_hash"]:
+                with self.lock:
+                    entry["source_mtime_ns"] = mtime_ns
+                    self.save()
+                return True
+        return False
+
+    def record(self, job, use_hash=False):
+        """Store the fingerprint of a job that just converted successfully."""
+        size, mtime_ns = source_fingerprint(job.input_file)
+        output_stat = job.output_file.stat()
+        entry = {
+            "source": str(job.input_file),
+            "source_size": size,
+            "source_mtime_ns": mtime_ns,
+            "source_hash": source_hash(job.input_file) if use_hash else None,
+            "output_size": output_stat.st_size,
+            "output_mtime_ns": output_stat.st_mtime_ns,
+        }
+        with self.lock:
+            self.entries[job.output_file.name] = entry
+            self.save()
+
+    def save(self):
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary_path, "w") as manifest:
+            json.dump(self.entries, manifest, indent=1)
+        os.replace(temporary_path, self.path)
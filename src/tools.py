@@ -1,81 +1,680 @@
 # This is a utility library for converting different games
+import asyncio
 import subprocess
-from pathlib import Path
-from exceptions import ChdmanNotInstalledError, SameFileExtensionError, FileFormatNotSupportedError, OutputFileAlreadyExists
+import re
+import signal
+import threading
+import time
+import os
+import shutil
+import tempfile
+from pathlib import Path, PurePosixPath
+import mmap
+from exceptions import SameFileExtensionError, FileFormatNotSupportedError, OutputFileAlreadyExists, SheetParseError, ConversionCancelledError, ConversionTimeoutError
 from constants import *
-from os import remove
+from sheets import parse_cue, input_bytes, preflight, ISO_USER_DATA_OFFSETS, ISO_SECTOR_SIZE
+from syncmanifest import SyncManifest
+from capabilities import probe_chdman
+from metrics import ConversionMetrics, MetricsRecorder
+from scheduler import run_scheduled
+from diskspace import SpaceEstimator
+from archives import ArchiveScratch
+from profiles import get_profile, write_sample_image, pick_profile, PROFILES, AUTO_PROFILE, INTERMEDIARY_PROFILE, AUTOTUNE_SAMPLE_BYTES
+from os import remove, cpu_count
+
+CHDMAN_PROGRESS_PATTERN = re.compile(rb"(\w+), (\d+(?:\.\d+)?)% complete")
+ISO_EXTRACT_CHUNK_SECTORS = 4096  # 8 MiB of user data per write
+
+class ConversionProgress:
+    """A single progress event for a running conversion.
+
+    percent: Overall completion of the job from 0 to 100, across every chdman step it needs.
+    mb_per_second: Average input throughput since the job started.
+    eta_seconds: Estimated seconds left, or None until enough progress has been seen.
+    """
+    def __init__(self, stage, percent, mb_per_second, eta_seconds):
+        self.stage = stage
+        self.percent = percent
+        self.mb_per_second = mb_per_second
+        self.eta_seconds = eta_seconds
+
+    def __repr__(self):
+        return f"ConversionProgress(stage={self.stage!r}, percent={self.percent:.1f}, mb_per_second={self.mb_per_second:.1f}, eta_seconds={self.eta_seconds})"
+
+
+class ProgressTracker:
+    """Turns chdman's per-step percentages into job-wide ConversionProgress events."""
+    def __init__(self, input_bytes, stages, on_progress):
+        self.input_bytes = input_bytes
+        self.stages = stages
+        self.on_progress = on_progress
+        self.current_stage = 0
+        self.started = time.monotonic()
+
+    def next_stage(self):
+        self.current_stage += 1
+
+    def update(self, stage, step_percent):
+        fraction = min(1.0, (self.current_stage + step_percent / 100) / self.stages)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        mb_per_second = self.input_bytes * self.stages * fraction / elapsed / 1_000_000
+        eta_seconds = elapsed / fraction * (1 - fraction) if fraction > 0 else None
+        self.on_progress(ConversionProgress(stage, fraction * 100, mb_per_second, eta_seconds))
+
+
+class ChildUsage:
+    """CPU time of a child process, shaped like the fields of resource.struct_rusage that metrics read."""
+    def __init__(self, ru_utime, ru_stime):
+        self.ru_utime = ru_utime
+        self.ru_stime = ru_stime
+
+
+class CancelToken:
+    """Lets one thread cancel conversions running on the event loops of other threads."""
+    def __init__(self):
+        self.cancelled = False
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        """Call callback on cancel(), right away if already cancelled. Returns a function that unregisters it."""
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return lambda: self.__unregister(callback)
+        callback()
+        return lambda: None
+
+    def __unregister(self, callback):
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+def run_cancellable(coroutine, cancel_token=None):
+    """Run coroutine on a new event loop in this thread and return its result.
+
+    Raises ConversionCancelledError when cancel_token is cancelled before the coroutine finishes.
+    """
+    async def run():
+        if cancel_token is None:
+            return await coroutine
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        unregister = cancel_token.register(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await coroutine
+        except asyncio.CancelledError:
+            raise ConversionCancelledError()
+        finally:
+            unregister()
+
+    try:
+        return asyncio.run(run())
+    except asyncio.CancelledError:
+        # Cancelled in the instant between the coroutine finishing and the task completing
+        raise ConversionCancelledError()
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
 
-# File Formats
-CHDMAN_OUTPUT_VERIFICATION = "chdman - MAME Compressed Hunks of Data (CHD) manager"
 
 class FileConverter:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, chdman="chdman"):
+        """chdman: Name or path of the chdman executable. Raises ChdmanNotInstalledError when it can not be found."""
         self.debug = debug
-        self.conversion_result = None  # Stores the last result of a conversion as a CompletedProcess object
-        if not self.__test_chdman_installed():
-            raise ChdmanNotInstalledError()
+        self.capabilities = probe_chdman(chdman)
+        self.chdman = self.capabilities.path
+        self.metrics = MetricsRecorder()
+        self.archives = ArchiveScratch()
+
+    def convert_file(self, input_file, output_directory, output_format=CHD, num_processors=None, on_progress=None, overwrite=False, profile=None,
+                     timeout=None, cancel_token=None):
+        """Convert input_file into output_format inside output_directory, blocking until done.
+
+        Runs convert_file_async on an event loop of its own. cancel_token: CancelToken another thread can
+        use to stop the conversion, which then raises ConversionCancelledError.
+        """
+        return run_cancellable(
+            self.convert_file_async(input_file, output_directory, output_format, num_processors, on_progress, overwrite, profile, timeout),
+            cancel_token
+        )
 
-    def convert_file(self, input_file, output_directory, output_format=CHD):
+    async def convert_file_async(self, input_file, output_directory, output_format=CHD, num_processors=None, on_progress=None, overwrite=False,
+                                 profile=None, timeout=None):
+        """Convert input_file into output_format inside output_directory.
+
+        profile: CompressionProfile or profile name used when creating a CHD, chdman's defaults when None.
+        on_progress: Optional callable receiving a ConversionProgress each time chdman reports progress.
+        overwrite: Replace an existing output file instead of raising OutputFileAlreadyExists.
+        timeout: Seconds after which the conversion is stopped and ConversionTimeoutError raised.
+        Cancelling the task kills chdman. Either way nothing is left behind in output_directory.
+        Returns (success, completed_process). The stderr of completed_process holds chdman's output
+        with the progress lines removed.
+        """
+        try:
+            return await asyncio.wait_for(
+                self.__convert(Path(input_file), Path(output_directory), output_format, num_processors, on_progress, overwrite, profile),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            raise ConversionTimeoutError(f"{Path(input_file).name}: not converted after {timeout} s")
+
+    async def __convert(self, input_file, output_directory, output_format, num_processors, on_progress, overwrite, profile):
         output_file = output_directory / Path(input_file.stem + output_format)
-        intermediary_file = None
 
-        if input_file.suffix not in VALID_FORMATS:
+        if input_file.suffix not in INPUT_FORMATS:
             raise FileFormatNotSupportedError()
         if not input_file.exists():
             raise FileNotFoundError()
         if input_file.suffix == output_format:
             raise SameFileExtensionError()
-        if output_file.exists():
+        if output_file.exists() and not overwrite:
             raise OutputFileAlreadyExists()
-        
-        if input_file.suffix != CHD and output_format != CHD:
-            # Have to convert twice, once to CHD then CHD to desired format
-            intermediary_file = output_directory / Path(input_file.stem + CHD)
-            self.conversion_result = self.__convert_other_to_chd(input_file=input_file, output_file=intermediary_file)
-            
-            if not self.conversion_result.returncode:
-                if output_format == ISO:
-                    self.conversion_result = self.__convert_chd_to_iso(input_file=intermediary_file, output_file=output_file)
-                else:
-                    self.conversion_result = self.__convert_chd_to_gdi_cue(input_file=intermediary_file, output_file=output_file)
-
-        elif output_format == CHD:
-            self.conversion_result = self.__convert_other_to_chd(input_file=input_file, output_file=output_file)
-        elif input_file.suffix == CHD and output_format == ISO:
-            self.conversion_result = self.__convert_chd_to_iso(input_file=input_file, output_file=output_file)
-        else:
-            self.conversion_result = self.__convert_chd_to_gdi_cue(input_file=input_file, output_file=output_file)
-        
-        if intermediary_file != None:
+        # Fail before spawning chdman when a sheet is unreadable or one of its track files is missing
+        sheet_check = preflight(input_file)
+        if not sheet_check.ok:
+            raise sheet_check.error
+        # Staging and archive scratch directories are created inside it
+        output_directory.mkdir(parents=True, exist_ok=True)
+        if sheet_check.archive_image is None:
+            return await self.__convert_image(input_file, input_file, sheet_check, output_directory, output_file, output_format, num_processors, on_progress, profile)
+
+        # The disc image inside the archive is converted under the name of the archive
+        if PurePosixPath(sheet_check.archive_image.image).suffix.lower() == output_format:
+            raise SameFileExtensionError()
+        extraction = self.archives.claim(input_file, output_directory)
+        try:
+            # Already done when the archive was prefetched while the previous job ran
+            image = await asyncio.to_thread(extraction.wait)
+            return await self.__convert_image(image, input_file, sheet_check, output_directory, output_file, output_format, num_processors, on_progress, profile)
+        finally:
+            self.archives.release(extraction)
+
+    async def __convert_image(self, input_file, source_file, sheet_check, output_directory, output_file, output_format, num_processors, on_progress, profile):
+        """Convert the checked disc image input_file, which source_file holds or is, into output_file."""
+        fast_path_sheet = self.__single_data_track_sheet(input_file) if input_file.suffix == CUE and output_format == ISO else None
+
+        tracker = None
+        if on_progress is not None:
+            stages = 2 if input_file.suffix != CHD and output_format != CHD and fast_path_sheet is None else 1
+            # Extracting a CHD costs what its uncompressed contents weigh, known from its header
+            tracker_bytes = sheet_check.chd_info.logical_bytes if sheet_check.chd_info is not None else sheet_check.total_bytes
+            tracker = ProgressTracker(tracker_bytes, stages, on_progress)
+
+        metrics = ConversionMetrics(source_file, output_file, output_format)
+        metrics.source_bytes = sheet_check.total_bytes
+        metrics.bytes_read = metrics.source_bytes
+        started = time.monotonic()
+
+        # Everything is written into a private staging directory and only renamed into place once
+        # complete, so an interrupted job never leaves a partial output or intermediary file behind.
+        staging_directory = create_staging_directory(output_directory)
+        staged_output_file = staging_directory / output_file.name
+        intermediary_file = None
+        intermediary_result = None
+        # Kept local, jobs of a batch run concurrently on the same FileConverter
+        result = None
+        try:
+            if fast_path_sheet is not None:
+                # Raw data sectors only need their headers stripped, no need to round trip through a CHD
+                result = await self.__convert_cue_to_iso_async(sheet=fast_path_sheet, output_file=staged_output_file, tracker=tracker)
+            elif input_file.suffix != CHD and output_format != CHD:
+                # Have to convert twice, once to CHD then CHD to desired format
+                intermediary_file = staging_directory / Path(input_file.stem + CHD)
+                result = await self.__convert_other_to_chd(input_file=input_file, output_file=intermediary_file, num_processors=num_processors, tracker=tracker, profile=INTERMEDIARY_PROFILE)
+                intermediary_result = result
+                metrics.add_usage(intermediary_result.rusage)
+                metrics.intermediary_seconds = time.monotonic() - started
+                if intermediary_file.exists():
+                    metrics.intermediary_bytes = intermediary_file.stat().st_size
+                    metrics.bytes_written += metrics.intermediary_bytes
+                    metrics.bytes_read += metrics.intermediary_bytes
+                
+                if not result.returncode:
+                    if tracker is not None:
+                        tracker.next_stage()
+                    if output_format == ISO:
+                        result = await self.__convert_chd_to_iso(input_file=intermediary_file, output_file=staged_output_file, tracker=tracker)
+                    else:
+                        result = await self.__convert_chd_to_gdi_cue(input_file=intermediary_file, output_file=staged_output_file, tracker=tracker)
+
+            elif output_format == CHD:
+                result = await self.__convert_other_to_chd(input_file=input_file, output_file=staged_output_file, num_processors=num_processors, tracker=tracker, profile=get_profile(profile))
+            elif input_file.suffix == CHD and output_format == ISO:
+                result = await self.__convert_chd_to_iso(input_file=input_file, output_file=staged_output_file, tracker=tracker)
+            else:
+                result = await self.__convert_chd_to_gdi_cue(input_file=input_file, output_file=staged_output_file, tracker=tracker)
+
+            if result is not intermediary_result:
+                metrics.add_usage(result.rusage)
+            if intermediary_file != None and intermediary_file.exists():
                 remove(intermediary_file)
+            if not result.returncode:
+                published = publish_staged_outputs(staging_directory, output_directory, output_file.name)
+                published_bytes = sum(f.stat().st_size for f in published)
+                metrics.bytes_written += published_bytes
+                metrics.output_bytes = published_bytes
+                metrics.success = True
+            result.metrics = metrics
+        finally:
+            shutil.rmtree(staging_directory, ignore_errors=True)
+            metrics.wall_seconds = time.monotonic() - started
+            self.metrics.record(metrics)
                 
-        if not self.conversion_result.returncode:
-            return True, self.conversion_result
-        else:
-            return False, self.conversion_result
-
-    def __test_chdman_installed(self):
-        test_run = subprocess.run(["chdman"], capture_output=True, shell=True, text=True)
-        chdman_output = test_run.stdout.splitlines()[0]
-        if CHDMAN_OUTPUT_VERIFICATION in chdman_output:
-            return True
-        else:
-            return False
-
-    def __convert_chd_to_gdi_cue(self, input_file, output_file):
-        return subprocess.run(
-            args=["chdman", "extractcd", "-i", str(input_file), "-o", str(output_file), "--force"],
-            capture_output=True
-        )
+        return not result.returncode, result
+
+    def __single_data_track_sheet(self, cue_file):
+        try:
+            sheet = parse_cue(cue_file)
+        except (SheetParseError, OSError):
+            return None
+        if sheet.is_single_data_track() and sheet.files[0].path.is_file():
+            return sheet
+        return None
+
+    async def __convert_cue_to_iso_async(self, sheet, output_file, tracker=None):
+        """Run __convert_cue_to_iso on a thread, stopping it when the task is cancelled."""
+        cancel_event = threading.Event()
+        copy = asyncio.ensure_future(asyncio.to_thread(self.__convert_cue_to_iso, sheet, output_file, tracker, cancel_event))
+        try:
+            return await asyncio.shield(copy)
+        except asyncio.CancelledError:
+            # Let the copy stop before the caller removes the staging directory under it
+            cancel_event.set()
+            await asyncio.wait([copy])
+            raise
+
+    def __convert_cue_to_iso(self, sheet, output_file, tracker=None, cancel_event=None):
+        """Write the user data of a single data track CUE/BIN image straight to an ISO without chdman.
+
+        cancel_event: threading.Event that stops the copy between chunks when set.
+        Failed copies are reported like failed chdman runs, with the CPU time they took too.
+        """
+        thread_cpu_started = time.thread_time()
+        completed_process = self.__copy_user_data(sheet, output_file, tracker, cancel_event)
+        completed_process.rusage = ChildUsage(time.thread_time() - thread_cpu_started, 0.0)
+        return completed_process
+
+    def __copy_user_data(self, sheet, output_file, tracker, cancel_event):
+        track = sheet.files[0].tracks[0]
+        sector_size = track.sector_size
+        user_data_offset = ISO_USER_DATA_OFFSETS[track.mode]
+        args = ["cue2iso", str(sheet.path), str(output_file)]
+
+        try:
+            with open(sheet.files[0].path, "rb") as bin_file, open(output_file, "wb", buffering=ISO_EXTRACT_CHUNK_SECTORS * ISO_SECTOR_SIZE) as iso_file:
+                first_sector = track.start_frame
+                total_sectors = bin_file.seek(0, 2) // sector_size - first_sector
+                if total_sectors <= 0:
+                    return subprocess.CompletedProcess(args, 1, stdout=b"", stderr=b"Track file holds no sectors")
+
+                with mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ) as raw, memoryview(raw) as view:
+                    for chunk_start in range(first_sector, first_sector + total_sectors, ISO_EXTRACT_CHUNK_SECTORS):
+                        if cancel_event is not None and cancel_event.is_set():
+                            return subprocess.CompletedProcess(args, 1, stdout=b"", stderr=b"Cancelled")
+                        chunk_end = min(chunk_start + ISO_EXTRACT_CHUNK_SECTORS, first_sector + total_sectors)
+                        if sector_size == ISO_SECTOR_SIZE:
+                            iso_file.write(view[chunk_start * sector_size:chunk_end * sector_size])
+                        else:
+                            iso_file.write(b"".join(
+                                view[offset:offset + ISO_SECTOR_SIZE]
+                                for offset in range(chunk_start * sector_size + user_data_offset, chunk_end * sector_size, sector_size)
+                            ))
+                        if tracker is not None:
+                            tracker.update("Extracting", (chunk_end - first_sector) / total_sectors * 100)
+        except OSError as e:
+            if output_file.exists():
+                remove(output_file)
+            return subprocess.CompletedProcess(args, 1, stdout=b"", stderr=str(e).encode())
+        return subprocess.CompletedProcess(args, 0, stdout=b"", stderr=b"")
+
+    async def __run_chdman(self, args, tracker=None):
+        """Run chdman and stream its output as it arrives.
+
+        chdman reports progress and errors on stderr and redraws its progress line with carriage returns,
+        so stderr is split on carriage returns as well as newlines. Progress lines are forwarded to the
+        tracker and dropped, everything else is kept and returned as the stderr of the CompletedProcess.
+        stdout, which only carries chdman's banner, is returned as is.
+        If the task is cancelled, chdman is killed and reaped before the cancellation goes on.
+        chdman is reaped with os.wait4 instead of by asyncio's child watcher, which throws away the
+        resource usage of the children it reaps.
+        """
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        reaped = asyncio.ensure_future(asyncio.to_thread(os.wait4, process.pid, 0))
+        kept_lines = []
+        stdout_chunks = []
+        pending = b""
 
-    def __convert_other_to_chd(self, input_file, output_file):
-        return subprocess.run(
-            args=["chdman", "createcd", "-i", str(input_file), "-o", str(output_file), "--force"],
-            capture_output=True,
+        def on_stderr(chunk):
+            nonlocal pending
+            *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+            for line in lines:
+                self.__handle_output_line(line, kept_lines, tracker)
+
+        try:
+            await asyncio.gather(self.__read_pipe(process.stdout, stdout_chunks.append), self.__read_pipe(process.stderr, on_stderr))
+            self.__handle_output_line(pending, kept_lines, tracker)
+            _, status, rusage = await asyncio.shield(reaped)
+        except BaseException:
+            if not reaped.done():
+                # Popen.kill() would poll, and could reap the child under os.wait4
+                try:
+                    os.kill(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await asyncio.wait([reaped])
+            if reaped.exception() is None:
+                process.returncode = os.waitstatus_to_exitcode(reaped.result()[1])
+            raise
+        finally:
+            process.stdout.close()
+            process.stderr.close()
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        completed_process = subprocess.CompletedProcess(args, process.returncode, stdout=b"".join(stdout_chunks), stderr=b"\n".join(kept_lines))
+        completed_process.rusage = rusage
+        return completed_process
+
+    @staticmethod
+    async def __read_pipe(pipe, on_chunk):
+        """Call on_chunk with everything read from pipe until it is closed."""
+        reader = asyncio.StreamReader()
+        transport, _ = await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        try:
+            while chunk := await reader.read(65536):
+                on_chunk(chunk)
+        finally:
+            transport.close()
+
+    def __handle_output_line(self, line, kept_lines, tracker):
+        if not line.strip():
+            return
+        match = CHDMAN_PROGRESS_PATTERN.search(line)
+        if match is None:
+            kept_lines.append(line)
+        elif tracker is not None:
+            tracker.update(match.group(1).decode(), float(match.group(2)))
+
+    async def __convert_chd_to_gdi_cue(self, input_file, output_file, tracker=None):
+        return await self.__run_chdman(
+            [self.chdman, "extractcd", "-i", str(input_file), "-o", str(output_file), "--force"],
+            tracker
         )
+
+    async def __convert_other_to_chd(self, input_file, output_file, num_processors=None, tracker=None, profile=None):
+        args = [self.chdman, "createcd", "-i", str(input_file), "-o", str(output_file), "--force"]
+        args += get_profile(profile).createcd_args(self.capabilities, num_processors)
+        return await self.__run_chdman(args, tracker)
+
+    def verify_file(self, input_file, on_progress=None, timeout=None, cancel_token=None):
+        """Blocking verify_file_async, see convert_file for cancel_token."""
+        return run_cancellable(self.verify_file_async(input_file, on_progress, timeout), cancel_token)
+
+    async def verify_file_async(self, input_file, on_progress=None, timeout=None):
+        """Check a CHD against the SHA-1s stored in it with chdman verify.
+
+        Returns (success, completed_process). Raises FileFormatNotSupportedError for anything but a CHD,
+        ChdFormatError when its header can not be read and ConversionTimeoutError after timeout seconds.
+        """
+        input_file = Path(input_file)
+        if input_file.suffix != CHD:
+            raise FileFormatNotSupportedError()
+        check = preflight(input_file)
+        if not check.ok:
+            raise check.error
+
+        tracker = None
+        if on_progress is not None:
+            tracker = ProgressTracker(check.chd_info.logical_bytes if check.chd_info is not None else check.total_bytes, 1, on_progress)
+        try:
+            completed_process = await asyncio.wait_for(self.__run_chdman([self.chdman, "verify", "-i", str(input_file)], tracker), timeout)
+        except asyncio.TimeoutError:
+            raise ConversionTimeoutError(f"{input_file.name}: not verified after {timeout} s")
+        return completed_process.returncode == 0, completed_process
+
+    def autotune_profile(self, input_file, candidates=None, min_mb_per_second=None, num_processors=None, sample_bytes=AUTOTUNE_SAMPLE_BYTES):
+        """Test-compress a sample of input_file with every candidate profile and pick the best one.
+
+        The best profile has the lowest ratio among those compressing at least min_mb_per_second,
+        see profiles.pick_profile. Returns (profile, measurements) where measurements holds a
+        (profile, ratio, mb_per_second) tuple per candidate that could be measured, or
+        (None, []) when input_file can not be sampled.
+        """
+        candidates = [get_profile(candidate) for candidate in (candidates or PROFILES.values())]
+        measurements = []
+        with tempfile.TemporaryDirectory(prefix="easychd-autotune-") as sample_directory:
+            sample = write_sample_image(Path(input_file), sample_directory, sample_bytes)
+            if sample is None:
+                return None, []
+            sample_size = input_bytes(sample)
+
+            for candidate in candidates:
+                output_file = Path(sample_directory) / f"{candidate.name}{CHD}"
+                started = time.monotonic()
+                result = asyncio.run(self.__convert_other_to_chd(sample, output_file, num_processors=num_processors, profile=candidate))
+                elapsed = max(time.monotonic() - started, 1e-6)
+                if result.returncode or not output_file.exists():
+                    continue
+                measurements.append((candidate, output_file.stat().st_size / sample_size, sample_size / elapsed / 1_000_000))
+                remove(output_file)
+
+        if not measurements:
+            return None, []
+        return pick_profile(measurements, min_mb_per_second), measurements
     
-    def __convert_chd_to_iso(self, input_file, output_file):
-        return subprocess.run(
-            args=["chdman", "extractraw", "-i", str(input_file), "-o", str(output_file), "--force"],
-            capture_output=True,
+    async def __convert_chd_to_iso(self, input_file, output_file, tracker=None):
+        return await self.__run_chdman(
+            [self.chdman, "extractraw", "-i", str(input_file), "-o", str(output_file), "--force"],
+            tracker
+        )
+
+
+def create_staging_directory(output_directory):
+    return Path(tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{os.getpid()}-", dir=output_directory))
+
+
+def publish_staged_outputs(staging_directory, output_directory, output_name):
+    """Atomically rename every staged file into output_directory and return their new paths.
+
+    The main output goes last so that a CUE or GDI sheet never points at track files that are not there yet.
+    """
+    published = []
+    staged_files = sorted(staging_directory.iterdir(), key=lambda f: f.name == output_name)
+    for staged_file in staged_files:
+        os.replace(staged_file, output_directory / staged_file.name)
+        published.append(output_directory / staged_file.name)
+    return published
+
+
+def remove_orphaned_staging(directory):
+    """Delete staging directories left in directory by conversions whose process no longer runs."""
+    removed = []
+    for entry in Path(directory).glob(STAGING_PREFIX + "*"):
+        pid = entry.name[len(STAGING_PREFIX):].split("-", 1)[0]
+        if entry.is_dir() and not (pid.isdigit() and process_is_running(int(pid))):
+            shutil.rmtree(entry, ignore_errors=True)
+            removed.append(entry)
+    return removed
+
+
+def process_is_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists but belongs to someone else
+    return True
+
+
+class ConversionJob:
+    """One input file to convert, with where and into what format.
+
+    Pending jobs with a higher priority start first, see DeviceScheduler.
+    """
+    def __init__(self, input_file, output_directory=None, output_format=CHD, priority=0):
+        self.input_file = Path(input_file)
+        self.output_directory = Path(output_directory) if output_directory is not None else self.input_file.parent
+        self.output_format = output_format
+        self.priority = priority
+
+    @property
+    def output_file(self):
+        return self.output_directory / (self.input_file.stem + self.output_format)
+
+    def __repr__(self):
+        return f"ConversionJob({str(self.input_file)!r}, {str(self.output_directory)!r}, {self.output_format!r})"
+
+
+class BatchConverter:
+    """Runs several FileConverter jobs at once.
+
+    The core budget is split between the concurrent jobs: each chdman process
+    is started with --numprocessors set to its share of the budget so that
+    N jobs together never ask for more cores than the budget allows.
+    """
+    def __init__(self, converter, workers=1, cores=None, sync=False, sync_hash=False, journal=None, profile=None, min_mb_per_second=None, jobs_per_device=None,
+                 timeout=None, check_disk_space=True):
+        """jobs_per_device: Most jobs allowed to read from or write to the same disk at once, None for no limit.
+            Jobs are started by priority then largest first, see DeviceScheduler.
+        timeout: Seconds after which a single job is stopped and fails with ConversionTimeoutError.
+        check_disk_space: Hold jobs back while their output disk lacks the room they are estimated to need,
+            see SpaceEstimator. The estimates improve as the batch creates CHDs.
+        profile: Compression profile name or CompressionProfile for created CHDs. With AUTO_PROFILE,
+            the profile is auto-tuned once per batch on the first job that creates a CHD.
+        min_mb_per_second: Speed target of the auto-tuning.
+        sync: Skip jobs whose output is up to date with its source, see SyncManifest.
+        sync_hash: Also store and compare a content hash of the sources when syncing.
+        journal: Optional JobJournal recording the state of every job so an interrupted batch can be resumed.
+        """
+        self.converter = converter
+        self.cores = max(1, cores or cpu_count() or 1)
+        self.workers = max(1, min(workers, self.cores))
+        self.sync = sync
+        self.sync_hash = sync_hash
+        self.journal = journal
+        self.profile = profile
+        self.min_mb_per_second = min_mb_per_second
+        self.jobs_per_device = jobs_per_device
+        self.timeout = timeout
+        self.space_estimator = SpaceEstimator() if check_disk_space else None
+        self.cancel_token = CancelToken()
+
+    @property
+    def processors_per_job(self):
+        return max(1, self.cores // self.workers)
+
+    def cancel(self):
+        """Stop the running jobs and fail the pending ones with ConversionCancelledError. Safe to call from any thread."""
+        self.cancel_token.cancel()
+
+    def convert_files(self, input_files, output_format=CHD, output_directory=None, on_job_done=None, on_progress=None, on_job_skipped=None):
+        """Convert every file in input_files, running up to self.workers jobs at a time.
+
+        output_directory: By default, each output is written next to its input file.
+        on_job_done: Called from a worker thread as on_job_done(input_file, success, completed_process, error)
+            once per job, in completion order. error is the exception raised by the job, or None.
+        on_progress: Called from a worker thread as on_progress(input_file, conversion_progress).
+        on_job_skipped: Called as on_job_skipped(input_file) for every job skipped because its output is up to date.
+        Returns a dict mapping each input file to its (success, completed_process, error) tuple.
+        Skipped jobs are reported as (True, None, None).
+        """
+        jobs = [ConversionJob(f, output_directory, output_format) for f in input_files]
+        results = self.run_jobs(
+            jobs,
+            on_job_done=None if on_job_done is None else lambda job, *result: on_job_done(job.input_file, *result),
+            on_progress=None if on_progress is None else lambda job, progress: on_progress(job.input_file, progress),
+            on_job_skipped=None if on_job_skipped is None else lambda job: on_job_skipped(job.input_file)
         )
+        return {job.input_file: result for job, result in results.items()}
+
+    def run_jobs(self, jobs, on_job_done=None, on_progress=None, on_job_skipped=None):
+        """Run a list of ConversionJob, up to self.workers at a time.
+
+        Same as convert_files, except that callbacks receive and results are keyed by the ConversionJob.
+        """
+        results = {}
+        manifests = {}
+
+        if self.sync:
+            # Decide what is up to date before any process is spawned
+            pending_jobs = []
+            for job in jobs:
+                if job.output_directory not in manifests:
+                    manifests[job.output_directory] = SyncManifest(job.output_directory)
+                if manifests[job.output_directory].is_up_to_date(job, use_hash=self.sync_hash):
+                    results[job] = (True, None, None)
+                    if on_job_skipped is not None:
+                        on_job_skipped(job)
+                else:
+                    pending_jobs.append(job)
+            jobs = pending_jobs
+
+        if self.journal is not None:
+            self.journal.start_batch(jobs)
+
+        profile = self.profile
+        if profile == AUTO_PROFILE:
+            # Archives can not be sampled without extracting them
+            chd_jobs = [job for job in jobs if job.output_format == CHD and job.input_file.suffix not in (CHD, ZIP)]
+            profile = None
+            if chd_jobs:
+                profile, _ = self.converter.autotune_profile(chd_jobs[0].input_file, min_mb_per_second=self.min_mb_per_second, num_processors=self.cores)
+
+        def run_job(job):
+            if self.cancel_token.cancelled:
+                raise ConversionCancelledError()
+            if self.journal is not None:
+                self.journal.mark(job, JOB_RUNNING)
+            result = self.converter.convert_file(
+                input_file=job.input_file,
+                output_directory=job.output_directory,
+                output_format=job.output_format,
+                num_processors=self.processors_per_job,
+                on_progress=None if on_progress is None else lambda progress: on_progress(job, progress),
+                overwrite=self.sync,
+                profile=profile,
+                timeout=self.timeout,
+                cancel_token=self.cancel_token
+            )
+            if self.sync and result[0]:
+                manifests[job.output_directory].record(job, use_hash=self.sync_hash)
+            return result
+
+        def job_finished(job, result, error):
+            success, completed_process = result if error is None else (False, None)
+            results[job] = (success, completed_process, error)
+            if success and self.space_estimator is not None and hasattr(completed_process, "metrics"):
+                self.space_estimator.observe(completed_process.metrics)
+            if self.journal is not None:
+                self.journal.mark(job, JOB_DONE if success else JOB_FAILED)
+            if on_job_done is not None:
+                on_job_done(job, success, completed_process, error)
+
+        def prefetch(job, reserve):
+            if job.input_file.suffix == ZIP:
+                self.converter.archives.prefetch(job.input_file, job.output_directory, reserve)
+
+        try:
+            run_scheduled(jobs, run_job, self.workers, self.jobs_per_device, job_finished, self.space_estimator, prefetch)
+        finally:
+            self.converter.archives.clear()
+
+        if self.journal is not None:
+            self.journal.finish_batch()
+        return results
@@ -0,0 +1,44 @@
+# Thread-safe queue of widget updates, drained by the Tk main loop
+import itertools
+import threading
+
+DRAIN_INTERVAL_MS = 50
+
+
+class UIUpdateQueue:
+    """Lets worker threads schedule widget updates without touching Tk themselves.
+
+    Updates are callables that run on the Tk thread during a fixed-rate after() tick. Updates
+    posted under a key replace any update still pending under the same key, so a job that
+    reports progress hundreds of times a second costs one redraw per tick.
+    """
+    def __init__(self, widget, interval_ms=DRAIN_INTERVAL_MS):
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self.pending = {}  # dicts keep insertion order, which is the order updates run in
+        self.lock = threading.Lock()
+        self.unique_keys = itertools.count()
+        self.widget.after(self.interval_ms, self.drain)
+
+    def post(self, key, callback, *args):
+        """Schedule callback(*args), replacing the pending update with the same key if there is one.
+
+        The queue is shared by the whole app, so keys are namespaced by their owner, e.g. (frame, "progress").
+        """
+        with self.lock:
+            # Re-inserting moves the update behind everything posted before it
+            self.pending.pop(key, None)
+            self.pending[key] = (callback, args)
+
+    def call(self, callback, *args):
+        """Schedule callback(*args) to run exactly once, after everything already queued."""
+        self.post(("call", next(self.unique_keys)), callback, *args)
+
+    def drain(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            for callback, args in pending.values():
+                callback(*args)
+        finally:
+            self.widget.after(self.interval_ms, self.drain)
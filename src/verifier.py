@@ -0,0 +1,177 @@
+# Verifies many CHDs at once and remembers which ones already passed
+import os
+import sqlite3
+import time
+from pathlib import Path
+from constants import CACHE_DIRECTORY
+from exceptions import ChdFormatError, UnsupportedChdVersionError, ConversionCancelledError
+from chdinfo import read_chd_info
+from scheduler import run_scheduled
+from tools import CancelToken
+
+VERIFY_CACHE_PATH = CACHE_DIRECTORY / "verify.sqlite"
+DEFAULT_VERIFY_JOBS_PER_DEVICE = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verifications (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    message TEXT,
+    verified_at REAL NOT NULL
+);
+"""
+
+
+def file_key(path):
+    """(size, mtime_ns, header SHA-1) of a CHD, the SHA-1 is empty for CHDs older than v5."""
+    stat = os.stat(path)
+    try:
+        sha1 = read_chd_info(path).sha1
+    except UnsupportedChdVersionError:
+        sha1 = ""
+    return stat.st_size, stat.st_mtime_ns, sha1
+
+
+class VerifyResult:
+    def __init__(self, path, ok, message=None, cached=False, seconds=0.0):
+        self.path = Path(path)
+        self.ok = ok
+        self.message = message
+        self.cached = cached  # True when the result comes from VerifyCache and nothing was read
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {
+            "input": str(self.path),
+            "ok": self.ok,
+            "cached": self.cached,
+            "message": self.message,
+            "elapsed_seconds": round(self.seconds, 3),
+        }
+
+
+class VerifyJob:
+    def __init__(self, input_file, key):
+        self.input_file = input_file
+        self.key = key
+
+
+class VerifyCache:
+    """SQLite table of verify results keyed by path, size, mtime and the SHA-1 in the CHD header.
+
+    A result only counts while all four still match, so a replaced or rewritten CHD is verified again.
+    """
+    def __init__(self, path=VERIFY_CACHE_PATH):
+        self.path = Path(path)
+
+    def __connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.executescript(SCHEMA)
+        return connection
+
+    def lookup(self, keyed_paths):
+        """Return {path: VerifyResult} for every (path, key) pair with a matching cached result."""
+        connection = self.__connect()
+        try:
+            found = {}
+            for path, (size, mtime_ns, sha1) in keyed_paths:
+                row = connection.execute(
+                    "SELECT ok, message FROM verifications WHERE path = ? AND size = ? AND mtime_ns = ? AND sha1 = ?",
+                    (str(path), size, mtime_ns, sha1)
+                ).fetchone()
+                if row is not None:
+                    found[path] = VerifyResult(path, bool(row[0]), row[1], cached=True)
+            return found
+        finally:
+            connection.close()
+
+    def store(self, result, key):
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO verifications VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(result.path), *key, int(result.ok), result.message, time.time())
+                )
+        finally:
+            connection.close()
+
+
+class BulkVerifier:
+    """Runs chdman verify over many CHDs, up to workers at a time and jobs_per_device per disk.
+
+    Verifying is mostly reading, so the per-disk limit matters more than the core count. CHDs whose
+    cached result still applies are reported at once without being read.
+    """
+    def __init__(self, converter, workers=1, jobs_per_device=DEFAULT_VERIFY_JOBS_PER_DEVICE, cache=None, timeout=None):
+        """cache: VerifyCache to use, None for the default one. Pass False to verify everything every time.
+        timeout: Seconds after which a single verification is stopped and reported as failed.
+        """
+        self.converter = converter
+        self.workers = max(1, workers)
+        self.jobs_per_device = jobs_per_device
+        self.cache = VerifyCache() if cache is None else cache
+        self.timeout = timeout
+        self.cancel_token = CancelToken()
+
+    def cancel(self):
+        """Stop the running verifications and report the pending ones as failed. Safe to call from any thread."""
+        self.cancel_token.cancel()
+
+    def verify_files(self, input_files, on_result=None, on_progress=None, force=False):
+        """Verify every CHD of input_files and return {path: VerifyResult}.
+
+        on_result(result) is called as each result is known, cached ones first.
+        on_progress(path, progress) receives the ConversionProgress of running verifications.
+        force: Ignore cached results, they are still updated.
+        """
+        results = {}
+
+        def report(result, key=None):
+            results[result.path] = result
+            if self.cache and key is not None and not result.cached:
+                self.cache.store(result, key)
+            if on_result is not None:
+                on_result(result)
+
+        keyed_paths = []
+        for path in map(Path, input_files):
+            try:
+                keyed_paths.append((path, file_key(path)))
+            except (ChdFormatError, OSError) as e:
+                report(VerifyResult(path, False, str(e)))
+
+        cached = self.cache.lookup(keyed_paths) if self.cache and not force else {}
+        jobs = []
+        for path, key in keyed_paths:
+            if path in cached:
+                report(cached[path])
+            else:
+                jobs.append(VerifyJob(path, key))
+
+        def run_job(job):
+            if self.cancel_token.cancelled:
+                raise ConversionCancelledError()
+            started = time.monotonic()
+            success, completed_process = self.converter.verify_file(
+                job.input_file,
+                on_progress=None if on_progress is None else lambda progress: on_progress(job.input_file, progress),
+                timeout=self.timeout,
+                cancel_token=self.cancel_token
+            )
+            message = None if success else completed_process.stderr.decode(errors="replace").strip()
+            return VerifyResult(job.input_file, success, message, seconds=time.monotonic() - started)
+
+        def job_finished(job, result, error):
+            if error is not None:
+                # Not cached, the CHD itself may be fine
+                report(VerifyResult(job.input_file, False, "Cancelled" if isinstance(error, ConversionCancelledError) else str(error) or type(error).__name__))
+            else:
+                report(result, job.key)
+
+        run_scheduled(jobs, run_job, self.workers, self.jobs_per_device, job_finished)
+        return results
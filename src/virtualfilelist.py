@@ -0,0 +1,105 @@
+# Scrolling file list that only creates the widgets needed to fill its visible area
+import customtkinter
+from filelistmodel import FileListModel, STATUS_COLORS
+
+ROW_HEIGHT = 30
+
+
+class VirtualFileList(customtkinter.CTkFrame):
+    """Shows a FileListModel with a fixed pool of checkboxes.
+
+    Scrolling changes which model rows the pooled checkboxes display instead of moving widgets,
+    so drawing a list of fifty thousand files costs the same as drawing one screenful.
+    """
+    def __init__(self, master, visible_rows=10, **kwargs):
+        super().__init__(master, **kwargs)
+        self.model = FileListModel()
+        self.first_row = 0
+        self.row_state = "normal"
+        self.row_font = customtkinter.CTkFont(family="Courier New", size=12)
+        self.default_text_color = None
+
+        self.row_frame = customtkinter.CTkFrame(master=self, fg_color="transparent", height=visible_rows * ROW_HEIGHT)
+        self.row_frame.grid_propagate(False)
+        self.row_frame.grid_columnconfigure(0, weight=1)
+        self.scrollbar = customtkinter.CTkScrollbar(master=self, command=self.on_scrollbar)
+        self.empty_label = customtkinter.CTkLabel(master=self.row_frame, text="No files found in this directory")
+
+        self.rows = []
+        for index in range(visible_rows):
+            checkbox = customtkinter.CTkCheckBox(
+                master=self.row_frame,
+                font=self.row_font,
+                text="",
+                command=lambda index=index: self.on_row_toggled(index)
+            )
+            self.bind_mousewheel(checkbox)
+            self.rows.append(checkbox)
+        self.default_text_color = self.rows[0].cget("text_color")
+        self.bind_mousewheel(self.row_frame)
+
+        self.row_frame.grid(row=0, column=0, padx=(10, 0), pady=5, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, padx=5, pady=5, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+        self.refresh()
+
+    def bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", lambda event: self.scroll_rows(-1 if event.delta > 0 else 1), add="+")
+        widget.bind("<Button-4>", lambda event: self.scroll_rows(-1), add="+")
+        widget.bind("<Button-5>", lambda event: self.scroll_rows(1), add="+")
+
+    def set_model(self, model):
+        self.model = model
+        self.first_row = 0
+        self.refresh()
+
+    def on_row_toggled(self, index):
+        self.model.toggle(self.model.visible_rows[self.first_row + index])
+
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.first_row = int(float(amount) * len(self.model.visible_rows))
+            self.refresh()
+        else:
+            self.scroll_rows(int(amount) * (len(self.rows) if unit == "pages" else 1))
+
+    def scroll_rows(self, count):
+        self.first_row += count
+        self.refresh()
+
+    def set_row_state(self, state):
+        self.row_state = state
+        self.refresh()
+
+    def refresh(self):
+        """Redraw the pooled rows from the model. Call after the model's statuses, selection or filter change."""
+        visible_rows = self.model.visible_rows
+        self.first_row = max(0, min(self.first_row, len(visible_rows) - len(self.rows)))
+
+        if visible_rows:
+            self.empty_label.grid_forget()
+        else:
+            self.empty_label.grid(row=0, column=0, padx=10, pady=5, sticky="w")
+
+        for index, checkbox in enumerate(self.rows):
+            position = self.first_row + index
+            if position >= len(visible_rows):
+                checkbox.grid_forget()
+                continue
+
+            row = visible_rows[position]
+            checkbox.configure(
+                text=self.model.row_text(row),
+                text_color=STATUS_COLORS[self.model.statuses[row]] or self.default_text_color,
+                state=self.row_state
+            )
+            if self.model.selected[row]:
+                checkbox.select()
+            else:
+                checkbox.deselect()
+            checkbox.grid(row=index, column=0, padx=0, pady=(0, 6), sticky="w")
+
+        if visible_rows:
+            self.scrollbar.set(self.first_row / len(visible_rows), min(1.0, (self.first_row + len(self.rows)) / len(visible_rows)))
+        else:
+            self.scrollbar.set(0, 1)
@@ -0,0 +1,33 @@
+# Shared fixtures: conversions run against the fake chdman of the benchmarks
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from tools import FileConverter
+
+FAKE_CHDMAN = ROOT / "benchmarks" / "fake_chdman.py"
+SECTOR_BYTES = 2352
+
+
+@pytest.fixture
+def converter(monkeypatch):
+    """FileConverter running the fake chdman, which finishes at once."""
+    monkeypatch.setenv("FAKE_CHDMAN_SPEED", "0")
+    return FileConverter(chdman=str(FAKE_CHDMAN))
+
+
+@pytest.fixture
+def make_cue():
+    """make_cue(directory, name, sectors=16) writes name.cue and its single data track name.bin."""
+    def make(directory, name, sectors=16):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{name}.bin").write_bytes(bytes(sectors * SECTOR_BYTES))
+        cue = directory / f"{name}.cue"
+        cue.write_text(f'FILE "{name}.bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n')
+        return cue
+    return make
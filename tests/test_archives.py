@@ -0,0 +1,96 @@
+# Extracting ZIP archives into scratch directories and cleaning them up
+import zipfile
+
+from archives import ArchiveScratch
+from constants import STAGING_PREFIX, ISO
+from tools import BatchConverter, ConversionJob
+
+TRACK_BYTES = bytes(range(256)) * (2352 // 256 * 8)  # Does not compress to nothing
+SHEET = 'FILE "a.bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n'
+
+
+def write_archive(path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("disc/a.CUE", SHEET)
+        archive.writestr("disc/a.bin", TRACK_BYTES)
+        archive.writestr("readme.txt", "not part of the image")
+    return path
+
+
+def staging_directories(directory):
+    return list(directory.glob(STAGING_PREFIX + "*"))
+
+
+def test_claim_extracts_the_image_and_release_removes_it(tmp_path):
+    archive = write_archive(tmp_path / "a.zip")
+    scratch = ArchiveScratch()
+
+    extraction = scratch.claim(archive, tmp_path)
+    image = extraction.wait()
+    assert image.name == "a.cue"
+    assert image.read_text() == SHEET
+    assert (image.parent / "a.bin").read_bytes() == TRACK_BYTES
+    assert not list(extraction.directory.rglob("readme.txt"))
+
+    scratch.release(extraction)
+    assert staging_directories(tmp_path) == []
+
+
+def test_prefetched_extraction_is_claimed(tmp_path):
+    archive = write_archive(tmp_path / "a.zip")
+    scratch = ArchiveScratch()
+
+    assert scratch.prefetch(archive, tmp_path)
+    extraction = scratch.claim(archive, tmp_path)
+    assert len(staging_directories(tmp_path)) == 1
+    assert extraction.wait().read_text() == SHEET
+    scratch.release(extraction)
+    assert staging_directories(tmp_path) == []
+
+
+def test_refused_reservation_writes_nothing(tmp_path):
+    archive = write_archive(tmp_path / "a.zip")
+    reserved = []
+
+    def reserve(size):
+        reserved.append(size)
+        return False
+
+    assert not ArchiveScratch().prefetch(archive, tmp_path, reserve)
+    assert reserved == [len(SHEET) + len(TRACK_BYTES)]
+    assert staging_directories(tmp_path) == []
+
+
+def test_large_archives_are_not_prefetched(tmp_path):
+    archive = write_archive(tmp_path / "a.zip")
+    assert not ArchiveScratch(prefetch_bytes=1024).prefetch(archive, tmp_path)
+    assert staging_directories(tmp_path) == []
+
+
+def test_only_one_archive_waits_extracted_ahead(tmp_path):
+    first, second = write_archive(tmp_path / "a.zip"), write_archive(tmp_path / "b.zip")
+    scratch = ArchiveScratch()
+
+    assert scratch.prefetch(first, tmp_path)
+    assert not scratch.prefetch(second, tmp_path)
+    assert len(staging_directories(tmp_path)) == 1
+    # Claiming the waiting one starts the deferred one
+    extraction = scratch.claim(first, tmp_path)
+    assert len(staging_directories(tmp_path)) == 2
+
+    scratch.release(extraction)
+    scratch.clear()
+    assert staging_directories(tmp_path) == []
+
+
+def test_converted_archives_leave_no_scratch(tmp_path, converter):
+    archives = [write_archive(tmp_path / f"disc{n}.zip") for n in range(3)]
+    output_directory = tmp_path / "out"
+    jobs = [ConversionJob(archive, output_directory) for archive in archives]
+    jobs += [ConversionJob(archives[0], tmp_path / "iso", ISO)]
+    results = BatchConverter(converter, workers=2, cores=2).run_jobs(jobs)
+
+    assert all(success for success, _, _ in results.values())
+    assert sorted(path.name for path in output_directory.iterdir()) == ["disc0.chd", "disc1.chd", "disc2.chd"]
+    assert [path.name for path in (tmp_path / "iso").iterdir()] == ["disc0.iso"]
+    assert staging_directories(tmp_path) == []
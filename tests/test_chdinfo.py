@@ -0,0 +1,63 @@
+# Parses CHD v5 bytes laid out by hand from the format description in MAME's chd.h
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from chdinfo import read_chd_info, MEDIA_CD
+
+HEADER_BYTES = 124
+SHA1 = bytes(range(20))
+
+
+def metadata_entry(tag, data, next_offset):
+    """tag (4 bytes), flags (1 byte) and length (3 bytes), offset of the next entry (8 bytes), then data."""
+    return tag + bytes([0x01]) + len(data).to_bytes(3, "big") + next_offset.to_bytes(8, "big") + data
+
+
+def build_chd(tracks):
+    header = bytearray(HEADER_BYTES)
+    header[0:8] = b"MComprHD"
+    header[8:12] = HEADER_BYTES.to_bytes(4, "big")
+    header[12:16] = (5).to_bytes(4, "big")
+    header[16:20] = b"cdlz"
+    header[20:24] = b"cdfl"
+    header[32:40] = (2448 * 3000).to_bytes(8, "big")  # logical bytes
+    header[40:48] = HEADER_BYTES.to_bytes(8, "big")  # map offset
+    header[48:56] = HEADER_BYTES.to_bytes(8, "big")  # metadata offset
+    header[56:60] = (19584).to_bytes(4, "big")  # hunk bytes
+    header[60:64] = (2448).to_bytes(4, "big")  # unit bytes
+    header[84:104] = SHA1
+
+    metadata = b""
+    offset = HEADER_BYTES
+    for index, track in enumerate(tracks):
+        data = track.encode() + b"\0"
+        entry_bytes = 16 + len(data)
+        next_offset = offset + entry_bytes if index < len(tracks) - 1 else 0
+        metadata += metadata_entry(b"CHT2", data, next_offset)
+        offset += entry_bytes
+    return bytes(header) + metadata
+
+
+def test_reads_header_and_track_chain(tmp_path):
+    chd = tmp_path / "game.chd"
+    chd.write_bytes(build_chd([
+        "TRACK:1 TYPE:MODE1_RAW SUBTYPE:NONE FRAMES:2000 PREGAP:0 PGTYPE:MODE1 PGSUB:RW POSTGAP:0",
+        "TRACK:2 TYPE:AUDIO SUBTYPE:NONE FRAMES:1000 PREGAP:150 PGTYPE:AUDIO PGSUB:RW POSTGAP:0",
+    ]))
+
+    info = read_chd_info(chd)
+
+    assert info.version == 5
+    assert info.compressors == ["cdlz", "cdfl"]
+    assert info.logical_bytes == 2448 * 3000
+    assert info.hunk_bytes == 19584
+    assert info.unit_bytes == 2448
+    assert info.sha1 == SHA1.hex()
+    assert info.parent_sha1 is None
+    assert info.media == MEDIA_CD
+    assert [(track.number, track.track_type, track.frames, track.pregap) for track in info.tracks] == [
+        (1, "MODE1_RAW", 2000, 0),
+        (2, "AUDIO", 1000, 150),
+    ]
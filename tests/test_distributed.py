@@ -0,0 +1,86 @@
+# A coordinator and two workers on 127.0.0.1, converting through the fake chdman
+import threading
+import time
+from pathlib import Path
+
+import distributed
+from distributed import Coordinator, Worker, send_request
+from tools import ConversionJob
+
+
+def start_coordinator(coordinator, jobs):
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(coordinator.run_jobs(jobs)), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while coordinator.server is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return thread, results
+
+
+def run_workers(converter, address, count=2):
+    workers = [Worker(converter, address, name=f"worker-{n}") for n in range(count)]
+    threads = [threading.Thread(target=worker.run, daemon=True) for worker in workers]
+    for thread in threads:
+        thread.start()
+    return workers, threads
+
+
+def test_workers_convert_every_job(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_SECONDS", 0.05)
+    output_directory = tmp_path / "out"
+    jobs = [ConversionJob(make_cue(tmp_path / "in", f"disc{n}"), output_directory) for n in range(4)]
+    coordinator = Coordinator(("127.0.0.1", 0))
+    thread, results = start_coordinator(coordinator, jobs)
+
+    workers, worker_threads = run_workers(converter, coordinator.server_address)
+    thread.join(30)
+    for worker_thread in worker_threads:
+        worker_thread.join(10)
+
+    assert not thread.is_alive()
+    assert all(success for success, _, _ in results.values()) and len(results) == len(jobs)
+    assert sum(worker.jobs_done for worker in workers) == len(jobs)
+    assert sorted(path.name for path in output_directory.glob("*.chd")) == [f"disc{n}.chd" for n in range(4)]
+
+
+def test_expired_lease_is_requeued(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_SECONDS", 0.05)
+    output_directory = tmp_path / "out"
+    jobs = [ConversionJob(make_cue(tmp_path / "in", f"disc{n}"), output_directory) for n in range(3)]
+    coordinator = Coordinator(("127.0.0.1", 0), lease_seconds=1)
+    thread, results = start_coordinator(coordinator, jobs)
+
+    # A worker that takes a job and is never heard from again
+    stalled = send_request(coordinator.server_address, {"op": "lease", "worker": "stalled"})
+    assert stalled["job"] is not None
+
+    workers, worker_threads = run_workers(converter, coordinator.server_address)
+    thread.join(30)
+    for worker_thread in worker_threads:
+        worker_thread.join(10)
+
+    assert not thread.is_alive()
+    assert len(results) == len(jobs) and all(success for success, _, _ in results.values())
+    assert sum(worker.jobs_done for worker in workers) == len(jobs)
+    assert (output_directory / f"{Path(stalled['job']['input']).stem}.chd").exists()
+    # The stalled worker's lease expired, its late result no longer counts
+    late = coordinator.handle_message({"op": "result", "lease": stalled["lease"], "success": False, "error": "ConversionCancelledError"})
+    assert late == {"ok": True, "accepted": False}
+
+
+def test_timeout_is_sent_to_the_workers(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setattr(distributed, "POLL_SECONDS", 0.05)
+    monkeypatch.setenv("FAKE_CHDMAN_SPEED", "0.001")
+    jobs = [ConversionJob(make_cue(tmp_path / "in", "slow"), tmp_path / "out")]
+    coordinator = Coordinator(("127.0.0.1", 0), timeout=0.5)
+    thread, results = start_coordinator(coordinator, jobs)
+
+    _, worker_threads = run_workers(converter, coordinator.server_address, count=1)
+    thread.join(30)
+    for worker_thread in worker_threads:
+        worker_thread.join(10)
+
+    success, _, error = results[jobs[0]]
+    assert not success
+    assert type(error).__name__ == "ConversionTimeoutError"
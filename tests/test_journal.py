@@ -0,0 +1,57 @@
+# Resuming a batch from its journal after the process running it was killed
+import os
+
+from constants import JOB_DONE, JOB_RUNNING, JOB_FAILED, STAGING_PREFIX
+from journal import JobJournal
+from tools import BatchConverter, ConversionJob
+
+DEAD_PID = 999_999_999  # Above any pid_max
+
+
+def test_recover_returns_unfinished_jobs_in_order(tmp_path):
+    jobs = [ConversionJob(tmp_path / f"disc{n}.cue", tmp_path / "out") for n in range(4)]
+    journal = JobJournal(tmp_path / "journal.jsonl")
+    journal.start_batch(jobs)
+    journal.mark(jobs[0], JOB_RUNNING)
+    journal.mark(jobs[0], JOB_DONE)
+    journal.mark(jobs[1], JOB_FAILED)
+    journal.mark(jobs[2], JOB_RUNNING)
+
+    recovered = JobJournal(tmp_path / "journal.jsonl").recover()
+    assert [(job.input_file, job.output_directory, job.output_format) for job in recovered] == [
+        (job.input_file, job.output_directory, job.output_format) for job in jobs[2:]
+    ]
+
+
+def test_recover_ignores_a_torn_last_line(tmp_path):
+    jobs = [ConversionJob(tmp_path / f"disc{n}.cue", tmp_path / "out") for n in range(2)]
+    journal = JobJournal(tmp_path / "journal.jsonl")
+    journal.start_batch(jobs)
+    with open(journal.path, "a") as journal_file:
+        journal_file.write('{"job": "')
+
+    assert [job.input_file for job in journal.recover()] == [job.input_file for job in jobs]
+
+
+def test_recover_removes_staging_left_by_dead_processes(tmp_path):
+    output_directory = tmp_path / "out"
+    orphan = output_directory / f"{STAGING_PREFIX}{DEAD_PID}-abc"
+    orphan.mkdir(parents=True)
+    (orphan / "disc0.chd").write_bytes(b"partial")
+    ours = output_directory / f"{STAGING_PREFIX}{os.getpid()}-abc"
+    ours.mkdir()
+    journal = JobJournal(tmp_path / "journal.jsonl")
+    journal.start_batch([ConversionJob(tmp_path / "disc0.cue", output_directory)])
+
+    journal.recover()
+    assert not orphan.exists()
+    assert ours.exists()
+
+
+def test_finished_batch_leaves_no_journal(tmp_path, converter, make_cue):
+    journal = JobJournal(tmp_path / "journal.jsonl")
+    jobs = [ConversionJob(make_cue(tmp_path, f"disc{n}"), tmp_path / "out") for n in range(2)]
+    BatchConverter(converter, workers=2, cores=2, journal=journal).run_jobs(jobs)
+
+    assert not journal.path.exists()
+    assert journal.recover() == []
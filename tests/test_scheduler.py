@@ -0,0 +1,106 @@
+# DeviceScheduler ordering, per-device cap and disk space admission
+import pytest
+
+import scheduler
+from diskspace import SpaceEstimator, RESERVED_FREE_BYTES
+from exceptions import InsufficientDiskSpaceError
+from scheduler import DeviceScheduler
+from tools import ConversionJob
+
+
+def jobs_of_sizes(directory, sizes):
+    jobs = []
+    for n, size in enumerate(sizes):
+        source = directory / f"disc{n}.iso"
+        source.write_bytes(bytes(size))
+        jobs.append(ConversionJob(source, directory / "out"))
+    return jobs
+
+
+def drain(device_scheduler):
+    order = []
+    while (job := device_scheduler.next_job()) is not None:
+        order.append(job)
+        device_scheduler.release(job)
+    return order
+
+
+def test_largest_jobs_start_first(tmp_path):
+    jobs = jobs_of_sizes(tmp_path, [100, 300, 200])
+    assert drain(DeviceScheduler(jobs)) == [jobs[1], jobs[2], jobs[0]]
+
+
+def test_priority_comes_before_size(tmp_path):
+    jobs = jobs_of_sizes(tmp_path, [100, 300, 200])
+    device_scheduler = DeviceScheduler(jobs)
+    # Raised while pending, as the app does when a file is moved up
+    jobs[0].priority = 1
+    assert drain(device_scheduler) == [jobs[0], jobs[1], jobs[2]]
+
+
+def test_jobs_per_device_holds_jobs_back_until_release(tmp_path):
+    jobs = jobs_of_sizes(tmp_path, [100, 200])
+    device_scheduler = DeviceScheduler(jobs, jobs_per_device=1)
+
+    first = device_scheduler.next_job()
+    assert first is jobs[1]
+    assert device_scheduler.next_job() is None
+    device_scheduler.release(first)
+    assert device_scheduler.next_job() is jobs[0]
+
+
+def test_jobs_per_device_below_one_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        DeviceScheduler(jobs_of_sizes(tmp_path, [100]), jobs_per_device=0)
+
+
+def test_jobs_wait_for_disk_space(tmp_path, monkeypatch):
+    jobs = jobs_of_sizes(tmp_path, [1000, 1000])
+    estimator = SpaceEstimator()
+    needed = estimator.estimate(jobs[0])
+    # Room for one job at a time
+    monkeypatch.setattr(scheduler, "free_bytes", lambda path: RESERVED_FREE_BYTES + needed * 3 // 2)
+    device_scheduler = DeviceScheduler(jobs, space_estimator=estimator)
+
+    first = device_scheduler.next_job()
+    assert first is not None
+    assert device_scheduler.next_job() is None
+    device_scheduler.release(first)
+    assert device_scheduler.next_job() is not None
+
+
+def test_reserved_ahead_bytes_count_against_other_jobs(tmp_path, monkeypatch):
+    jobs = jobs_of_sizes(tmp_path, [1000, 500])
+    estimator = SpaceEstimator()
+    free = estimator.estimate(jobs[0]) + estimator.estimate(jobs[1])
+    monkeypatch.setattr(scheduler, "free_bytes", lambda path: RESERVED_FREE_BYTES + free)
+    device_scheduler = DeviceScheduler(jobs, space_estimator=estimator)
+
+    assert device_scheduler.reserve_ahead(jobs[1], estimator.estimate(jobs[1]))
+    assert not device_scheduler.reserve_ahead(jobs[0], estimator.estimate(jobs[0]) + 1)
+    assert device_scheduler.next_job() is jobs[0]
+    assert device_scheduler.next_job() is jobs[1]
+
+
+def test_job_larger_than_the_disk_is_rejected(tmp_path, monkeypatch):
+    jobs = jobs_of_sizes(tmp_path, [1000])
+    monkeypatch.setattr(scheduler, "free_bytes", lambda path: RESERVED_FREE_BYTES)
+    device_scheduler = DeviceScheduler(jobs, space_estimator=SpaceEstimator())
+
+    assert device_scheduler.next_job() is None
+    job, error = device_scheduler.reject_next()
+    assert job is jobs[0]
+    assert isinstance(error, InsufficientDiskSpaceError)
+    assert not device_scheduler.has_pending()
+
+
+def test_run_scheduled_fails_jobs_that_never_fit(tmp_path, monkeypatch):
+    jobs = jobs_of_sizes(tmp_path, [1000, 10])
+    estimator = SpaceEstimator()
+    monkeypatch.setattr(scheduler, "free_bytes", lambda path: RESERVED_FREE_BYTES + estimator.estimate(jobs[1]))
+    finished = {}
+    scheduler.run_scheduled(jobs, lambda job: job.input_file.name, 2, space_estimator=estimator,
+                            on_finished=lambda job, result, error: finished.update({job: (result, error)}))
+
+    assert isinstance(finished[jobs[0]][1], InsufficientDiskSpaceError)
+    assert finished[jobs[1]] == ("disc1.iso", None)
@@ -0,0 +1,104 @@
+# Sheet parsing and preflight errors, reported before chdman is spawned
+import zipfile
+
+import pytest
+
+from exceptions import SheetParseError, MissingTrackFileError, ArchiveError
+from sheets import parse_cue, parse_gdi, preflight
+
+TRACK = '  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n'
+
+
+def write_sheet(directory, name, text, encoding="utf-8"):
+    sheet = directory / name
+    sheet.write_text(text, encoding=encoding)
+    return sheet
+
+
+@pytest.mark.parametrize("text, message", [
+    ('FILE "a.bin" BINARY\n  TRACK 1a MODE1/2352\n', "invalid track number"),
+    ('FILE "a.bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 1a 00:00:00\n', "invalid index number"),
+    ('FILE "a.bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:xx:00\n', "Invalid timestamp"),
+    ('FILE "a.bin" BINARY\n  TRACK 01 MODE9/2352\n', "unknown track mode"),
+    ('FILE "a.bin BINARY\n', "unbalanced quotes"),
+    (TRACK, "TRACK outside of a FILE"),
+    ('REM nothing\n', "no FILE entries"),
+])
+def test_broken_cue_raises_sheet_parse_error(tmp_path, text, message):
+    with pytest.raises(SheetParseError, match=message):
+        parse_cue(write_sheet(tmp_path, "a.cue", text))
+
+
+def test_cue_with_byte_order_mark(tmp_path):
+    sheet = parse_cue(write_sheet(tmp_path, "a.cue", 'FILE "a.bin" BINARY\n' + TRACK, encoding="utf-8-sig"))
+    assert [cue_file.path.name for cue_file in sheet.files] == ["a.bin"]
+    assert sheet.is_single_data_track()
+
+
+@pytest.mark.parametrize("text, message", [
+    ("", "empty sheet"),
+    ("x\n", "invalid track count"),
+    ("1\n1 0 4 2352\n", "expected 6 fields"),
+    ("1\n1 zero 4 2352 track01.bin 0\n", "invalid number"),
+    ("2\n1 0 4 2352 track01.bin 0\n", "declares 2 tracks but lists 1"),
+])
+def test_broken_gdi_raises_sheet_parse_error(tmp_path, text, message):
+    with pytest.raises(SheetParseError, match=message):
+        parse_gdi(write_sheet(tmp_path, "a.gdi", text))
+
+
+def test_preflight_reports_a_broken_sheet_instead_of_raising(tmp_path):
+    check = preflight(write_sheet(tmp_path, "a.cue", 'FILE "a.bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 1a 00:00:00\n'))
+    assert not check.ok
+    assert isinstance(check.error, SheetParseError)
+
+
+def test_preflight_reports_missing_track_files(tmp_path):
+    (tmp_path / "a.bin").write_bytes(bytes(2352))
+    check = preflight(write_sheet(tmp_path, "a.cue", 'FILE "a.bin" BINARY\n' + TRACK + 'FILE "b.bin" BINARY\n' + TRACK.replace("01 MODE", "02 MODE")))
+    assert isinstance(check.error, MissingTrackFileError)
+    assert "b.bin" in str(check.error)
+
+
+def test_preflight_counts_track_files(tmp_path):
+    (tmp_path / "a.bin").write_bytes(bytes(2352 * 4))
+    cue = write_sheet(tmp_path, "a.cue", 'FILE "a.bin" BINARY\n' + TRACK)
+    check = preflight(cue)
+    assert check.ok
+    assert check.track_files == [tmp_path / "a.bin"]
+    assert check.total_bytes == cue.stat().st_size + 2352 * 4
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return path
+
+
+@pytest.mark.parametrize("members, error, message", [
+    ({"readme.txt": b"no disc"}, ArchiveError, "no disc image"),
+    ({"a.iso": b"1", "b.iso": b"2"}, ArchiveError, "holds 2 disc images"),
+    ({"../a.iso": b"1"}, ArchiveError, "unsafe member path"),
+    ({"a.cue": 'FILE "a.bin" BINARY\n' + TRACK}, MissingTrackFileError, "a.bin"),
+    ({"a.cue": 'FILE "a.bin" BINARY\n  TRACK x MODE1/2352\n'}, SheetParseError, "invalid track number"),
+])
+def test_preflight_reports_broken_archives(tmp_path, members, error, message):
+    check = preflight(write_zip(tmp_path / "a.zip", members))
+    assert isinstance(check.error, error)
+    assert message in str(check.error)
+
+
+def test_preflight_of_a_corrupt_zip(tmp_path):
+    archive = tmp_path / "a.zip"
+    archive.write_bytes(b"PK not really")
+    assert isinstance(preflight(archive).error, ArchiveError)
+
+
+def test_preflight_of_an_archived_cue(tmp_path):
+    sheet = ('\ufeffFILE "a.bin" BINARY\n' + TRACK).encode()
+    check = preflight(write_zip(tmp_path / "a.zip", {"disc/a.cue": sheet, "disc/a.bin": bytes(2352 * 2)}))
+    assert check.ok
+    assert check.archive_image.image == "disc/a.cue"
+    assert check.archive_image.members == ["disc/a.cue", "disc/a.bin"]
+    assert check.total_bytes == len(sheet) + 2352 * 2
@@ -0,0 +1,69 @@
+# Sync mode: unchanged sources are skipped, changed ones converted again
+import os
+
+from syncmanifest import SyncManifest
+from tools import BatchConverter, ConversionJob
+
+
+def run_sync(converter, jobs, sync_hash=False):
+    skipped = []
+    results = BatchConverter(converter, workers=2, cores=2, sync=True, sync_hash=sync_hash).run_jobs(jobs, on_job_skipped=skipped.append)
+    return results, skipped
+
+
+def touch(path):
+    """Move the mtime of path forward without changing its content."""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000_000))
+
+
+def test_unchanged_sources_are_skipped(tmp_path, converter, make_cue):
+    jobs = [ConversionJob(make_cue(tmp_path, f"disc{n}"), tmp_path / "out") for n in range(2)]
+    results, skipped = run_sync(converter, jobs)
+    assert all(success for success, _, _ in results.values()) and skipped == []
+
+    results, skipped = run_sync(converter, jobs)
+    assert skipped == jobs
+    assert all(result == (True, None, None) for result in results.values())
+
+
+def test_changed_track_file_is_converted_again(tmp_path, converter, make_cue):
+    cue = make_cue(tmp_path, "disc")
+    job = ConversionJob(cue, tmp_path / "out")
+    run_sync(converter, [job])
+
+    with open(cue.with_suffix(".bin"), "ab") as track:
+        track.write(bytes(2352))
+    results, skipped = run_sync(converter, [job])
+    assert skipped == []
+    assert results[job][0] and results[job][1] is not None
+
+
+def test_touched_source_is_only_skipped_when_hashing(tmp_path, converter, make_cue):
+    job = ConversionJob(make_cue(tmp_path, "disc"), tmp_path / "out")
+    run_sync(converter, [job], sync_hash=True)
+    touch(job.input_file.with_suffix(".bin"))
+
+    assert not SyncManifest(job.output_directory).is_up_to_date(job, use_hash=False)
+    assert SyncManifest(job.output_directory).is_up_to_date(job, use_hash=True)
+    # The matching hash stored the new mtime, so the next check needs no hashing
+    assert SyncManifest(job.output_directory).is_up_to_date(job, use_hash=False)
+
+
+def test_replaced_output_is_rebuilt(tmp_path, converter, make_cue):
+    job = ConversionJob(make_cue(tmp_path, "disc"), tmp_path / "out")
+    run_sync(converter, [job])
+    job.output_file.write_bytes(b"not the converted disc")
+
+    assert not SyncManifest(job.output_directory).is_up_to_date(job)
+    _, skipped = run_sync(converter, [job])
+    assert skipped == []
+
+
+def test_output_without_entry_is_up_to_date_when_newer(tmp_path, make_cue):
+    job = ConversionJob(make_cue(tmp_path, "disc"), tmp_path / "out")
+    job.output_directory.mkdir()
+    job.output_file.write_bytes(b"converted before sync mode")
+    touch(job.output_file)
+
+    assert SyncManifest(job.output_directory).is_up_to_date(job)
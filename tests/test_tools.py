@@ -0,0 +1,77 @@
+# BatchConverter against the fake chdman: core budget split and per-disk concurrency
+import threading
+
+from tools import BatchConverter, ConversionJob
+
+
+class CountingConverter:
+    """Runs conversions through a real FileConverter and records how many ran at once."""
+    def __init__(self, converter):
+        self.converter = converter
+        self.archives = converter.archives
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+        self.num_processors = set()
+
+    def convert_file(self, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+            self.num_processors.add(kwargs.get("num_processors"))
+        try:
+            return self.converter.convert_file(**kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def test_core_budget_is_split_between_workers(converter):
+    assert BatchConverter(converter, workers=3, cores=8).processors_per_job == 2
+    assert BatchConverter(converter, workers=16, cores=4).workers == 4
+    assert BatchConverter(converter, workers=4, cores=2).processors_per_job == 1
+
+
+def test_jobs_pass_their_share_of_cores_to_chdman(tmp_path, converter, make_cue):
+    jobs = [ConversionJob(make_cue(tmp_path, f"disc{n}"), tmp_path / "out") for n in range(4)]
+    results = BatchConverter(converter, workers=2, cores=6).run_jobs(jobs)
+
+    assert len(results) == 4
+    for success, completed_process, error in results.values():
+        assert success and error is None
+        assert completed_process.args[completed_process.args.index("--numprocessors") + 1] == "3"
+
+
+def test_jobs_per_device_caps_concurrency(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setenv("FAKE_CHDMAN_SPEED", "0.5")  # about 0.1 s per disc
+    jobs = [ConversionJob(make_cue(tmp_path, f"disc{n}", sectors=20), tmp_path / "out") for n in range(4)]
+    counting = CountingConverter(converter)
+    results = BatchConverter(counting, workers=4, cores=4, jobs_per_device=1).run_jobs(jobs)
+
+    assert all(success for success, _, _ in results.values())
+    assert counting.most_running == 1
+    assert counting.num_processors == {1}
+
+
+def test_unlimited_devices_run_jobs_in_parallel(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setenv("FAKE_CHDMAN_SPEED", "0.5")
+    jobs = [ConversionJob(make_cue(tmp_path, f"disc{n}", sectors=20), tmp_path / "out") for n in range(4)]
+    counting = CountingConverter(converter)
+    results = BatchConverter(counting, workers=4, cores=4).run_jobs(jobs)
+
+    assert all(success for success, _, _ in results.values())
+    assert counting.most_running > 1
+
+
+def test_failed_jobs_do_not_stop_the_batch(tmp_path, converter, make_cue, monkeypatch):
+    monkeypatch.setenv("FAKE_CHDMAN_FAIL", "bad")
+    jobs = [ConversionJob(make_cue(tmp_path, name), tmp_path / "out") for name in ("good", "bad")]
+    results = BatchConverter(converter, workers=2, cores=2).run_jobs(jobs)
+
+    assert results[jobs[0]][0]
+    success, completed_process, error = results[jobs[1]]
+    assert not success and error is None
+    assert completed_process.returncode == 1
+    assert b"simulated failure" in completed_process.stderr
+    assert not completed_process.stderr.startswith(b"chdman - ")
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()) == ["good.chd"]